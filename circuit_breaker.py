@@ -0,0 +1,158 @@
+"""
+Автоматический выключатель (circuit breaker) для моделей OpenRouter.
+
+Для каждой модели хранится скользящее окно последних вызовов. Если доля
+ошибок или слишком медленных ответов превышает порог, выключатель
+размыкается и запросы к модели сразу отклоняются вместо ожидания таймаута.
+Через open_s секунд пропускается пробный запрос (полуоткрытое состояние):
+успех замыкает выключатель, ошибка снова размыкает.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Dict
+
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_CALL_S = float(os.getenv("BREAKER_SLOW_CALL_S", "20"))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.8"))
+BREAKER_OPEN_S = float(os.getenv("BREAKER_OPEN_S", "30"))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "1"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Выключатель одной модели."""
+
+    def __init__(
+            self,
+            name: str,
+            window: int = BREAKER_WINDOW,
+            min_calls: int = BREAKER_MIN_CALLS,
+            failure_rate: float = BREAKER_FAILURE_RATE,
+            slow_call_s: float = BREAKER_SLOW_CALL_S,
+            slow_rate: float = BREAKER_SLOW_RATE,
+            open_s: float = BREAKER_OPEN_S,
+            half_open_calls: int = BREAKER_HALF_OPEN_CALLS
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_s = slow_call_s
+        self.slow_rate = slow_rate
+        self.open_s = open_s
+        self.half_open_calls = half_open_calls
+
+        # Окно исходов: (успех, медленный)
+        self._calls = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self.times_opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_s:
+            self._state = HALF_OPEN
+            self._trials = 0
+        return self._state
+
+    def allow(self) -> bool:
+        """Можно ли сейчас отправить запрос к модели."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._trials < self.half_open_calls:
+                self._trials += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self, latency_s: float):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._close()
+                return
+            self._calls.append((True, latency_s >= self.slow_call_s))
+            self._evaluate()
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._open()
+                return
+            self._calls.append((False, False))
+            self._evaluate()
+
+    def release(self):
+        """Запрос завершился без исхода (например, отменён) - освобождаем пробный слот."""
+        with self._lock:
+            if self._state == HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def _evaluate(self):
+        if self._state != CLOSED or len(self._calls) < self.min_calls:
+            return
+        total = len(self._calls)
+        failures = sum(1 for ok, _ in self._calls if not ok)
+        slow = sum(1 for ok, is_slow in self._calls if ok and is_slow)
+        if failures / total >= self.failure_rate or slow / total >= self.slow_rate:
+            self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self.times_opened += 1
+
+    def _close(self):
+        self._state = CLOSED
+        self._calls.clear()
+        self._trials = 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = len(self._calls)
+            failures = sum(1 for ok, _ in self._calls if not ok)
+            return {
+                "state": self._current_state(),
+                "calls": total,
+                "failure_rate": failures / total if total else 0.0,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected
+            }
+
+
+class CircuitBreakerRegistry:
+    """Выключатели по именам моделей; создаются при первом обращении."""
+
+    def __init__(self, **breaker_options):
+        self.breaker_options = breaker_options
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(name, CircuitBreaker(name, **self.breaker_options))
+        return breaker
+
+    def is_available(self, name: str) -> bool:
+        """Не разомкнут ли выключатель (без занятия пробного слота)."""
+        return self.get(name).state != OPEN
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {name: breaker.snapshot() for name, breaker in list(self._breakers.items())}
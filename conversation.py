@@ -0,0 +1,222 @@
+"""
+История диалога с моделью.
+
+Последние реплики каждого собеседника хранятся в кольцевом буфере в
+памяти, а все реплики дописываются в таблицу conversation_turns (из неё
+буфер восстанавливается после перезапуска). Число токенов реплики
+оценивается один раз при сохранении, поэтому подбор истории под бюджет
+модели - это проход по готовым числам, без повторного подсчёта.
+
+История ведётся отдельно в каждом чате: в личке это просто история
+пользователя, а все обновления одного чата обрабатывает один воркер
+(см. workers.py), так что буфер в памяти не расходится с таблицей.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import List, NamedTuple, Tuple
+
+from db import ConnectionPool, LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних сообщений (вопросов и ответов) держать в буфере
+HISTORY_MESSAGES = int(os.getenv("HISTORY_MESSAGES", "20"))
+# Сколько диалогов держать в памяти и как долго
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "10000"))
+HISTORY_CACHE_TTL_S = float(os.getenv("HISTORY_CACHE_TTL_S", "3600"))
+# Доля max_tokens модели, которую может занять запрос; остальное - под ответ
+HISTORY_BUDGET_RATIO = float(os.getenv("HISTORY_BUDGET_RATIO", "0.5"))
+# Потолок бюджета запроса для моделей с огромным контекстом (история стоит денег)
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "8000"))
+# Потолок max_tokens ответа: длиннее Telegram всё равно не покажет
+ANSWER_MAX_TOKENS = int(os.getenv("ANSWER_MAX_TOKENS", "4096"))
+
+# Служебные токены на каждое сообщение (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+Key = Tuple[int, int]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов без токенизатора.
+
+    BPE-токенизаторы кладут в токен около 4 символов латиницы и около 2
+    символов кириллицы и прочего не-ASCII; оценка слегка завышена, чтобы
+    запрос гарантированно помещался в контекст.
+    """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    other_chars = len(text) - ascii_chars
+    return MESSAGE_OVERHEAD_TOKENS + (ascii_chars + 3) // 4 + (other_chars + 1) // 2
+
+
+def prompt_budget(max_tokens: int) -> int:
+    """Сколько токенов может занять запрос к модели с данным max_tokens."""
+    return min(HISTORY_MAX_TOKENS, int(max_tokens * HISTORY_BUDGET_RATIO))
+
+
+def answer_budget(max_tokens: int, messages: list) -> int:
+    """Сколько токенов остаётся на ответ модели с данным max_tokens после запроса messages."""
+    used = sum(estimate_tokens(m["content"]) for m in messages)
+    return max(1, min(ANSWER_MAX_TOKENS, max_tokens - used))
+
+
+class Turn(NamedTuple):
+    role: str
+    content: str
+    tokens: int
+
+
+class ConversationStore:
+    """Кольцевые буферы диалогов поверх таблицы всех реплик."""
+
+    def __init__(
+            self,
+            db_path: str = "bot.db",
+            max_messages: int = HISTORY_MESSAGES,
+            cache_size: int = HISTORY_CACHE_SIZE,
+            cache_ttl_s: float = HISTORY_CACHE_TTL_S
+    ):
+        self.max_messages = max_messages
+        self._pool = ConnectionPool(db_path, size=2)
+        self._buffers = LRUCache(cache_size, cache_ttl_s)
+        self.trimmed = 0
+        self._init_tables()
+
+    def _init_tables(self):
+        with self._pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS conversation_turns (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    role TEXT NOT NULL CHECK (role IN ('user', 'assistant')),
+                    content TEXT NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_conversation_turns_chat_user
+                ON conversation_turns(chat_id, user_id, id)
+            ''')
+            # Таблица реплик только дополняется; /reset запоминает, с какой
+            # реплики начинается новый диалог
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS conversation_resets (
+                    chat_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    after_id INTEGER NOT NULL,
+                    PRIMARY KEY (chat_id, user_id)
+                )
+            ''')
+            conn.commit()
+
+    def close(self):
+        self._pool.close()
+
+    def _load(self, key: Key) -> deque:
+        chat_id, user_id = key
+        with self._pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT role, content, tokens FROM conversation_turns
+                WHERE chat_id = ? AND user_id = ? AND id > COALESCE(
+                    (SELECT after_id FROM conversation_resets WHERE chat_id = ? AND user_id = ?), 0)
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (chat_id, user_id, chat_id, user_id, self.max_messages)).fetchall()
+        return deque(
+            (Turn(row["role"], row["content"], row["tokens"]) for row in reversed(rows)),
+            maxlen=self.max_messages
+        )
+
+    def history(self, key: Key) -> deque:
+        """Буфер последних реплик диалога (загружается из БД при первом обращении)."""
+        buffer = self._buffers.get(key)
+        if buffer is LRUCache.MISSING:
+            buffer = self._load(key)
+            self._buffers.put(key, buffer)
+        return buffer
+
+    def build_messages(self, key: Key, messages: list, max_tokens: int) -> list:
+        """
+        Вставляет в [system, user] столько последних реплик, сколько помещается
+        в бюджет модели. Реплики отбрасываются с самых старых и парами
+        вопрос-ответ, чтобы модель не увидела ответ без вопроса.
+        """
+        budget = prompt_budget(max_tokens)
+        used = sum(estimate_tokens(m["content"]) for m in messages)
+
+        turns = list(self.history(key))
+        start = len(turns)
+        while start > 0:
+            # Ответ и предшествующий ему вопрос берутся вместе
+            step = 2 if turns[start - 1].role == "assistant" else 1
+            if step > start:
+                break  # вопрос к самому старому ответу уже вытеснен из буфера
+            cost = sum(turn.tokens for turn in turns[start - step:start])
+            if used + cost > budget:
+                break
+            used += cost
+            start -= step
+
+        if start:
+            self.trimmed += 1
+        history = [{"role": turn.role, "content": turn.content} for turn in turns[start:]]
+        return messages[:-1] + history + messages[-1:]
+
+    def remember(self, key: Key, question: str, answer: str) -> List[tuple]:
+        """Добавляет вопрос и ответ в буфер; возвращает строки для записи в БД."""
+        chat_id, user_id = key
+        now = time.time()
+        buffer = self.history(key)
+        rows = []
+        for role, content in (("user", question), ("assistant", answer)):
+            turn = Turn(role, content, estimate_tokens(content))
+            buffer.append(turn)
+            rows.append((chat_id, user_id, role, content, turn.tokens, now))
+        # Продлеваем жизнь буфера в кэше
+        self._buffers.put(key, buffer)
+        return rows
+
+    def save(self, rows: List[tuple]):
+        with self._pool.connection() as conn:
+            conn.executemany('''
+                INSERT INTO conversation_turns (chat_id, user_id, role, content, tokens, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+
+    def reset(self, key: Key):
+        """Начинает диалог заново; старые реплики остаются в таблице."""
+        chat_id, user_id = key
+        with self._pool.connection() as conn:
+            conn.execute('''
+                INSERT INTO conversation_resets (chat_id, user_id, after_id)
+                VALUES (?, ?, COALESCE((SELECT MAX(id) FROM conversation_turns), 0))
+                ON CONFLICT(chat_id, user_id) DO UPDATE SET after_id = excluded.after_id
+            ''', (chat_id, user_id))
+            conn.commit()
+        self._buffers.put(key, deque(maxlen=self.max_messages))
+
+    async def aremember(self, key: Key, question: str, answer: str):
+        """remember() сразу, запись в БД - в пуле потоков."""
+        rows = self.remember(key, question, answer)
+        await asyncio.get_running_loop().run_in_executor(None, self.save, rows)
+
+    async def areset(self, key: Key):
+        await asyncio.get_running_loop().run_in_executor(None, self.reset, key)
+
+    async def abuild_messages(self, key: Key, messages: list, max_tokens: int) -> list:
+        """build_messages(); загрузка буфера из БД при промахе - в пуле потоков."""
+        if self._buffers.get(key) is LRUCache.MISSING:
+            buffer = await asyncio.get_running_loop().run_in_executor(None, self._load, key)
+            self._buffers.put(key, buffer)
+        return self.build_messages(key, messages, max_tokens)
+
+    def stats(self) -> dict:
+        return dict(self._buffers.stats.snapshot(), buffers=len(self._buffers), trimmed=self.trimmed)
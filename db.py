@@ -1,15 +1,235 @@
+import asyncio
+import hashlib
+import html
+import itertools
+import os
+import queue
+import random
 import sqlite3
-from typing import List, Optional
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Iterator, List, Optional, NamedTuple, Mapping, Tuple
+
+from metrics import metric
+
+# Настройки пула соединений SQLite
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+CACHED_STATEMENTS = int(os.getenv("DB_CACHED_STATEMENTS", "256"))
+
+# Кэш персонажей пользователей
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_S = float(os.getenv("USER_CACHE_TTL_S", "300"))
+# Как часто сверяться с журналом изменений (0 - при каждом обращении)
+USER_CACHE_SYNC_S = float(os.getenv("USER_CACHE_SYNC_S", "1"))
+# Как часто сверять снимок моделей и персонажей с версией в БД (0 - при каждом обращении)
+CATALOG_SYNC_S = float(os.getenv("CATALOG_SYNC_S", "1"))
+# Сколько последних записей журнала изменений хранить
+CHANGELOG_KEEP = int(os.getenv("USER_CHANGELOG_KEEP", "10000"))
+
+DEFAULT_CHARACTER_PROMPT = "Ты полезный AI-ассистент. Отвечай кратко и по делу."
+
+
+class ConnectionPool:
+    """
+    Пул переиспользуемых соединений SQLite.
+
+    Соединения открываются лениво (не больше size), работают в режиме WAL
+    с synchronous=NORMAL и кэшем подготовленных выражений, поэтому читатели
+    не ждут писателя, а разбор схемы не повторяется на каждый запрос.
+    """
+
+    def __init__(
+            self,
+            db_path: str,
+            size: int = POOL_SIZE,
+            busy_timeout_ms: int = BUSY_TIMEOUT_MS,
+            cached_statements: int = CACHED_STATEMENTS
+    ):
+        self.db_path = db_path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        # Все соединения заняты - ждём освободившееся
+        return self._idle.get(timeout=self.busy_timeout_ms / 1000)
+
+    @contextmanager
+    def connection(self):
+        """Выдаёт соединение из пула; незавершённая транзакция откатывается."""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        """Закрывает простаивающие соединения пула."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+class CacheStats:
+    """Счётчики попаданий и промахов кэша."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с ограничением размера и временем жизни записей."""
+
+    MISSING = object()
+
+    def __init__(self, maxsize: int, ttl_s: float):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.stats = CacheStats()
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Значение по ключу или LRUCache.MISSING"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] > now:
+                self._data.move_to_end(key)
+                self.stats.hit()
+                return item[0]
+            if item is not None:
+                del self._data[key]
+        self.stats.miss()
+        return self.MISSING
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl_s)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Catalog(NamedTuple):
+    """Неизменяемый снимок таблиц models и characters."""
+    models: Tuple[Mapping, ...]
+    models_by_id: Mapping[int, Mapping]
+    active_model: Optional[Mapping]
+    characters: Tuple[Mapping, ...]
+    characters_by_id: Mapping[int, Mapping]
+
+
+def _freeze(rows) -> Tuple[Mapping, ...]:
+    return tuple(MappingProxyType(dict(row)) for row in rows)
 
 
 class Database:
-    def __init__(self, db_path: str = "bot.db"):
+    def __init__(
+            self,
+            db_path: str = "bot.db",
+            pool_size: int = POOL_SIZE,
+            user_cache_size: int = USER_CACHE_SIZE,
+            user_cache_ttl_s: float = USER_CACHE_TTL_S
+    ):
         self.db_path = db_path
+        self.pool_size = pool_size
+        self._pool = ConnectionPool(db_path, pool_size)
+
+        self.catalog_sync_s = CATALOG_SYNC_S
+        self.catalog_stats = CacheStats()
+        self._catalog: Optional[Catalog] = None
+        # Номер сброса снимка: перезагрузка, во время которой был сброс,
+        # могла прочитать данные до записи и не должна их устанавливать
+        self._catalog_generations = itertools.count(1)
+        self._catalog_generation = 0
+        self._catalog_lock = threading.Lock()
+        self._catalog_version = -1
+        self._catalog_checked_at = 0.0
+
+        self.user_cache_sync_s = USER_CACHE_SYNC_S
+        self.user_cache = LRUCache(user_cache_size, user_cache_ttl_s)
+        self._user_sync_lock = threading.Lock()
+        self._user_changes_seq = 0
+        self._user_synced_at = 0.0
+
         self.init_database()
 
     def init_database(self):
         """Инициализация базы данных и создание таблиц"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._pool.connection() as conn:
             cursor = conn.cursor()
 
             # Создаем таблицу моделей
@@ -57,6 +277,42 @@ class Database:
                 ON user_characters(user_id, active) WHERE active = 1
             ''')
 
+            # Журнал изменений user_characters: по нему процессы, работающие
+            # с одним файлом БД, сбрасывают устаревшие записи своих кэшей
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_character_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL
+                )
+            ''')
+            for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_user_characters_{event.lower()}
+                    AFTER {event} ON user_characters
+                    BEGIN
+                        INSERT INTO user_character_changes (user_id) VALUES ({row}.user_id);
+                    END
+                ''')
+
+            # Версия моделей и персонажей: меняется при любой их правке,
+            # по ней другие процессы понимают, что их снимок устарел
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS catalog_version (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    version INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+            for table in ("models", "characters"):
+                for event in ("INSERT", "UPDATE", "DELETE"):
+                    cursor.execute(f'''
+                        CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                        AFTER {event} ON {table}
+                        BEGIN
+                            UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+                        END
+                    ''')
+
             # Добавляем 10 моделей (если их еще нет)
             models = [
                 # Бесплатные модели
@@ -109,73 +365,155 @@ class Database:
 
             conn.commit()
 
+            cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM user_character_changes")
+            self._user_changes_seq = cursor.fetchone()[0]
+
+        self.invalidate_catalog()
+
+    def close(self):
+        """Закрывает соединения пула"""
+        self._pool.close()
+
+    def _fetchone(self, query: str, params: tuple = ()) -> Optional[dict]:
+        with self._pool.connection() as conn:
+            row = conn.execute(query, params).fetchone()
+            return dict(row) if row else None
+
+    def invalidate_catalog(self):
+        """Сбрасывает снимок моделей и персонажей (вызывать после их изменения)"""
+        self._catalog_generation = next(self._catalog_generations)
+        self._catalog = None
+
+    def _sync_catalog(self):
+        """Сбрасывает снимок, если модели или персонажи изменены другим процессом"""
+        now = time.monotonic()
+        if self._catalog is None:
+            return
+        if self.catalog_sync_s and now - self._catalog_checked_at < self.catalog_sync_s:
+            return
+        with self._pool.connection() as conn:
+            version = conn.execute("SELECT version FROM catalog_version WHERE id = 1").fetchone()[0]
+        self._catalog_checked_at = now
+        if version != self._catalog_version:
+            self.invalidate_catalog()
+
+    def get_catalog(self) -> Catalog:
+        """Снимок моделей и персонажей; SQL выполняется только после сброса"""
+        self._sync_catalog()
+        catalog = self._catalog
+        if catalog is not None:
+            self.catalog_stats.hit()
+            return catalog
+
+        with self._catalog_lock:
+            if self._catalog is not None:
+                self.catalog_stats.hit()
+                return self._catalog
+
+            self.catalog_stats.miss()
+            generation = self._catalog_generation
+            with self._pool.connection() as conn:
+                # Версию читаем до данных: правка между запросами лишь вызовет лишнюю перезагрузку
+                version = conn.execute("SELECT version FROM catalog_version WHERE id = 1").fetchone()[0]
+                checked_at = time.monotonic()
+                models = _freeze(conn.execute(
+                    "SELECT * FROM models ORDER BY active DESC, is_free DESC, name"
+                ).fetchall())
+                characters = _freeze(conn.execute(
+                    "SELECT * FROM characters ORDER BY id"
+                ).fetchall())
+
+            catalog = Catalog(
+                models=models,
+                models_by_id=MappingProxyType({m['id']: m for m in models}),
+                active_model=next((m for m in models if m['active'] == 1), None),
+                characters=characters,
+                characters_by_id=MappingProxyType({c['id']: c for c in characters})
+            )
+            # Пока читали, снимок сбросили - этот вызов получит прочитанное,
+            # а следующий перечитает заново
+            if self._catalog_generation == generation:
+                self._catalog = catalog
+                self._catalog_version = version
+                self._catalog_checked_at = checked_at
+            return catalog
+
+    def cache_stats(self) -> dict:
+        """Статистика кэшей базы данных"""
+        return {
+            "catalog": self.catalog_stats.snapshot(),
+            "user_characters": self.user_cache.stats.snapshot()
+        }
+
     def get_all_models(self) -> List[dict]:
         """Получение списка всех моделей"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM models ORDER BY active DESC, is_free DESC, name")
-            return [dict(row) for row in cursor.fetchall()]
+        return [dict(model) for model in self.get_catalog().models]
 
     def get_active_model(self) -> Optional[dict]:
         """Получение активной модели"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM models WHERE active = 1 LIMIT 1")
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        model = self.get_catalog().active_model
+        return dict(model) if model else None
 
     def get_model_by_id(self, model_id: int) -> Optional[dict]:
         """Получение модели по ID"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM models WHERE id = ?", (model_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        model = self.get_catalog().models_by_id.get(model_id)
+        return dict(model) if model else None
 
     def set_active_model(self, model_id: int) -> bool:
         """Установка активной модели"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._pool.connection() as conn:
             cursor = conn.cursor()
 
             # Блокируем запись и обновляем активность
             cursor.execute("BEGIN IMMEDIATE")
 
+            # Проверяем, что модель существует, иначе активной не останется ни одной
+            cursor.execute("SELECT COUNT(*) FROM models WHERE id = ?", (model_id,))
+            if cursor.fetchone()[0] == 0:
+                conn.rollback()
+                raise ValueError(f"Модель с ID {model_id} не найдена")
+
             # Сбрасываем активность у всех моделей
-            cursor.execute("UPDATE models SET active = 0")
+            cursor.execute("UPDATE models SET active = 0 WHERE active = 1")
 
             # Устанавливаем активность выбранной модели
             cursor.execute("UPDATE models SET active = 1 WHERE id = ?", (model_id,))
 
             conn.commit()
 
-            # Проверяем, обновлена ли модель
-            cursor.execute("SELECT COUNT(*) FROM models WHERE id = ? AND active = 1", (model_id,))
-            return cursor.fetchone()[0] > 0
+        self.invalidate_catalog()
+        return True
 
     def get_all_characters(self) -> List[dict]:
         """Получение списка всех персонажей"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM characters ORDER BY id")
-            return [dict(row) for row in cursor.fetchall()]
+        return [dict(character) for character in self.get_catalog().characters]
 
     def get_character_by_id(self, character_id: int) -> Optional[dict]:
         """Получение персонажа по ID"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM characters WHERE id = ?", (character_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        character = self.get_catalog().characters_by_id.get(character_id)
+        return dict(character) if character else None
+
+    def get_random_character(self) -> Optional[dict]:
+        """Случайный персонаж без загрузки всего списка"""
+        characters = self.get_catalog().characters
+        return dict(random.choice(characters)) if characters else None
 
     def set_user_character(self, user_id: int, character_id: int) -> bool:
         """Установка персонажа для пользователя (upsert)"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._pool.connection() as conn:
             cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+
+            cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM user_character_changes")
+            seq_before = cursor.fetchone()[0]
+
+            # Сначала деактивируем другие персонажи пользователя,
+            # иначе UPSERT нарушит уникальный индекс активного персонажа
+            cursor.execute('''
+                UPDATE user_characters 
+                SET active = 0 
+                WHERE user_id = ? AND character_id != ? AND active = 1
+            ''', (user_id, character_id))
 
             # Используем UPSERT (INSERT OR REPLACE)
             cursor.execute('''
@@ -185,33 +523,538 @@ class Database:
                 DO UPDATE SET active = 1
             ''', (user_id, character_id))
 
-            # Деактивируем другие персонажи пользователя
-            cursor.execute('''
-                UPDATE user_characters 
-                SET active = 0 
-                WHERE user_id = ? AND character_id != ?
-            ''', (user_id, character_id))
+            cursor.execute("SELECT MAX(seq) FROM user_character_changes")
+            seq_after = cursor.fetchone()[0]
+            cursor.execute(
+                "DELETE FROM user_character_changes WHERE seq <= ?",
+                (seq_after - CHANGELOG_KEEP,)
+            )
 
             conn.commit()
-            return True
+
+        # Write-through: свои изменения не должны сбрасывать только что записанное значение
+        with self._user_sync_lock:
+            if self._user_changes_seq == seq_before:
+                self._user_changes_seq = seq_after
+        character = self.get_character_by_id(character_id)
+        self.user_cache.put(user_id, MappingProxyType(character) if character else None)
+        return True
+
+    def _sync_user_cache(self):
+        """Сбрасывает записи кэша пользователей, изменённые другими процессами"""
+        now = time.monotonic()
+        if self.user_cache_sync_s and now - self._user_synced_at < self.user_cache_sync_s:
+            return
+
+        # Журнал читаем без блокировки, чтобы потоки не ждали друг друга на SQL
+        known = self._user_changes_seq
+        with self._pool.connection() as conn:
+            changes = conn.execute(
+                "SELECT seq, user_id FROM user_character_changes WHERE seq > ? ORDER BY seq",
+                (known,)
+            ).fetchall()
+            oldest = conn.execute("SELECT MIN(seq) FROM user_character_changes").fetchone()[0] if changes else None
+
+        with self._user_sync_lock:
+            self._user_synced_at = now
+            # Другой поток (или своя запись в set_user_character) мог уже учесть часть изменений
+            applied = self._user_changes_seq
+            if not changes or changes[-1]['seq'] <= applied:
+                return
+
+            if oldest > known + 1:
+                # Часть журнала уже удалена - точечно сбросить нельзя
+                self.user_cache.clear()
+            else:
+                for change in changes:
+                    if change['seq'] > applied:
+                        self.user_cache.invalidate(change['user_id'])
+
+            self._user_changes_seq = changes[-1]['seq']
 
     def get_user_character(self, user_id: int) -> Optional[dict]:
         """Получение активного персонажа пользователя"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('''
+        self._sync_user_cache()
+
+        character = self.user_cache.get(user_id)
+        if character is LRUCache.MISSING:
+            character = self._fetchone('''
                 SELECT c.* FROM characters c
                 JOIN user_characters uc ON c.id = uc.character_id
                 WHERE uc.user_id = ? AND uc.active = 1
                 LIMIT 1
             ''', (user_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+            character = MappingProxyType(character) if character else None
+            self.user_cache.put(user_id, character)
+
+        return dict(character) if character else None
 
     def get_character_prompt(self, user_id: int) -> str:
         """Получение промпта персонажа пользовател"""
         character = self.get_user_character(user_id)
         if character:
             return character['prompt']
-        return "Ты полезный AI-ассистент. Отвечай кратко и по делу."
\ No newline at end of file
+        return DEFAULT_CHARACTER_PROMPT
+
+
+class QueryStats:
+    """Время выполнения запросов к БД: число вызовов, суммарное и максимальное время."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, wait_ms: float, exec_ms: float):
+        with self._lock:
+            stats = self._stats.setdefault(
+                name, {"count": 0, "wait_ms": 0.0, "exec_ms": 0.0, "max_exec_ms": 0.0}
+            )
+            stats["count"] += 1
+            stats["wait_ms"] += wait_ms
+            stats["exec_ms"] += exec_ms
+            stats["max_exec_ms"] = max(stats["max_exec_ms"], exec_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+
+class AsyncDatabase:
+    """
+    Асинхронный фасад над Database для обработчиков python-telegram-bot.
+
+    Запросы выполняются в отдельном пуле потоков размером с пул соединений,
+    поэтому медленный диск или блокировка записи не останавливают event loop.
+    """
+
+    def __init__(self, database: Database, max_workers: Optional[int] = None):
+        self.database = database
+        self.query_stats = QueryStats()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or database.pool_size,
+            thread_name_prefix="db"
+        )
+
+    async def _run(self, name: str, func, *args):
+        submitted = time.perf_counter()
+
+        def timed_call():
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                finished = time.perf_counter()
+                wait_ms = (started - submitted) * 1000
+                exec_ms = (finished - started) * 1000
+                self.query_stats.observe(name, wait_ms=wait_ms, exec_ms=exec_ms)
+                metric.latency("db_query_ms", query=name).observe(exec_ms)
+                metric.latency("db_queue_wait_ms").observe(wait_ms)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, timed_call)
+
+    async def get_all_models(self) -> List[dict]:
+        return await self._run("get_all_models", self.database.get_all_models)
+
+    async def get_active_model(self) -> Optional[dict]:
+        return await self._run("get_active_model", self.database.get_active_model)
+
+    async def get_model_by_id(self, model_id: int) -> Optional[dict]:
+        return await self._run("get_model_by_id", self.database.get_model_by_id, model_id)
+
+    async def set_active_model(self, model_id: int) -> bool:
+        return await self._run("set_active_model", self.database.set_active_model, model_id)
+
+    async def get_all_characters(self) -> List[dict]:
+        return await self._run("get_all_characters", self.database.get_all_characters)
+
+    async def get_character_by_id(self, character_id: int) -> Optional[dict]:
+        return await self._run("get_character_by_id", self.database.get_character_by_id, character_id)
+
+    async def get_random_character(self) -> Optional[dict]:
+        return await self._run("get_random_character", self.database.get_random_character)
+
+    async def set_user_character(self, user_id: int, character_id: int) -> bool:
+        return await self._run(
+            "set_user_character", self.database.set_user_character, user_id, character_id
+        )
+
+    async def get_user_character(self, user_id: int) -> Optional[dict]:
+        return await self._run("get_user_character", self.database.get_user_character, user_id)
+
+    async def get_character_prompt(self, user_id: int) -> str:
+        return await self._run("get_character_prompt", self.database.get_character_prompt, user_id)
+
+    def close(self):
+        """Останавливает пул потоков и закрывает соединения"""
+        self._executor.shutdown(wait=True)
+        self.database.close()
+
+
+# --- Заметки (main3.py) ---
+#
+# Все операции касаются заметок одного пользователя и идут по индексам
+# (user_id, id) и (user_id, created_at), поэтому их стоимость зависит от
+# числа заметок пользователя, а не от размера всей таблицы.
+
+NOTES_DB_PATH = os.getenv("DB_PATH", "bot.db")
+NOTES_POOL_SIZE = int(os.getenv("NOTES_POOL_SIZE", str(POOL_SIZE)))
+# Сколько строк вставлять одним executemany в add_notes
+NOTES_BATCH_SIZE = int(os.getenv("NOTES_BATCH_SIZE", "500"))
+
+_notes_pool: Optional[ConnectionPool] = None
+_notes_lock = threading.Lock()
+
+
+def init_db(db_path: Optional[str] = None):
+    """Создаёт таблицу заметок и индексы; повторный вызов с другим путём переключает БД."""
+    global _notes_pool
+    with _notes_lock:
+        if _notes_pool is not None:
+            _notes_pool.close()
+        _notes_pool = ConnectionPool(db_path or NOTES_DB_PATH, NOTES_POOL_SIZE)
+
+        with _notes_pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS notes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    created_at TEXT NOT NULL DEFAULT (datetime('now')),
+                    updated_at TEXT,
+                    text_hash INTEGER
+                )
+            ''')
+            _init_notes_dedup(conn)
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_notes_user_id
+                ON notes(user_id, id)
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_notes_user_created
+                ON notes(user_id, created_at)
+            ''')
+            _init_notes_search(conn)
+            _init_notes_stats(conn)
+            conn.commit()
+
+
+def _note_text_hash(text: str) -> int:
+    """64-битный хэш текста заметки (со знаком, как INTEGER в SQLite)."""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+def _init_notes_dedup(conn: sqlite3.Connection):
+    """
+    Одинаковые заметки у пользователя не дублируются (main3.py сообщает об этом).
+
+    Уникальный индекс строится по хэшу текста, а не по самому тексту: индекс
+    по тексту хранил бы каждую заметку второй раз. Хэш считает Python при
+    записи; заметки из старых БД получают его здесь один раз. Случайное
+    совпадение 64-битных хэшей двух заметок одного пользователя практически
+    исключено.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(notes)")}
+    if "text_hash" not in columns:
+        conn.execute("ALTER TABLE notes ADD COLUMN text_hash INTEGER")
+    if conn.execute("SELECT 1 FROM notes WHERE text_hash IS NULL LIMIT 1").fetchone():
+        conn.create_function("note_text_hash", 1, _note_text_hash, deterministic=True)
+        conn.execute("UPDATE notes SET text_hash = note_text_hash(text) WHERE text_hash IS NULL")
+    conn.execute("DROP INDEX IF EXISTS idx_notes_user_text")
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_notes_user_text_hash
+        ON notes(user_id, text_hash)
+    ''')
+
+
+def _init_notes_search(conn: sqlite3.Connection):
+    """
+    Полнотекстовый индекс заметок (FTS5).
+
+    Текст в индексе не дублируется: индекс берёт его из notes через
+    представление notes_fts_source. Владелец заметки индексируется как
+    отдельный токен "u<user_id>", поэтому поиск сразу ограничен заметками
+    пользователя. Токенизатор unicode61 приводит к одному регистру и
+    кириллицу, а prefix-индексы ускоряют поиск по началу слова.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notes_fts'"
+    ).fetchone()
+    conn.execute('''
+        CREATE VIEW IF NOT EXISTS notes_fts_source AS
+        SELECT id, text, 'u' || user_id AS owner FROM notes
+    ''')
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+            text, owner,
+            content = 'notes_fts_source',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    # Индекс обновляется в той же транзакции, что и сама заметка
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_notes_fts_insert AFTER INSERT ON notes
+        BEGIN
+            INSERT INTO notes_fts (rowid, text, owner) VALUES (new.id, new.text, 'u' || new.user_id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_notes_fts_delete AFTER DELETE ON notes
+        BEGIN
+            INSERT INTO notes_fts (notes_fts, rowid, text, owner)
+            VALUES ('delete', old.id, old.text, 'u' || old.user_id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_notes_fts_update AFTER UPDATE OF text, user_id ON notes
+        BEGIN
+            INSERT INTO notes_fts (notes_fts, rowid, text, owner)
+            VALUES ('delete', old.id, old.text, 'u' || old.user_id);
+            INSERT INTO notes_fts (rowid, text, owner) VALUES (new.id, new.text, 'u' || new.user_id);
+        END
+    ''')
+    if not exists:
+        # Индекс создан для уже существующих заметок - заполняем его
+        conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+
+
+@contextmanager
+def _notes_connection():
+    if _notes_pool is None:
+        init_db()
+    with _notes_pool.connection() as conn:
+        yield conn
+
+
+def add_note(user_id: int, text: str) -> int:
+    """Добавляет заметку и возвращает её id"""
+    return add_notes(user_id, [text])[0]
+
+
+def add_notes(user_id: int, texts: List[str]) -> List[int]:
+    """
+    Добавляет несколько заметок одной транзакцией (пачками по NOTES_BATCH_SIZE).
+
+    Возвращает id в порядке texts. При дубликате не добавляется ни одна
+    заметка (sqlite3.IntegrityError).
+    """
+    if not texts:
+        return []
+    with _notes_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for start in range(0, len(texts), NOTES_BATCH_SIZE):
+            conn.executemany(
+                "INSERT INTO notes (user_id, text, text_hash) VALUES (?, ?, ?)",
+                [(user_id, text, _note_text_hash(text)) for text in texts[start:start + NOTES_BATCH_SIZE]]
+            )
+        last_id = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'notes'").fetchone()[0]
+        conn.commit()
+    # Под BEGIN IMMEDIATE писатель один, поэтому id выданы подряд
+    return list(range(last_id - len(texts) + 1, last_id + 1))
+
+
+def list_notes(user_id: int, limit: int = 10, before_id: Optional[int] = None) -> List[dict]:
+    """
+    Последние заметки пользователя, новые первыми.
+
+    Следующая страница - before_id = id последней заметки предыдущей:
+    поиск по индексу вместо OFFSET, который перебирал бы пропущенные строки.
+    """
+    with _notes_connection() as conn:
+        rows = conn.execute('''
+            SELECT id, text, created_at, updated_at FROM notes
+            WHERE user_id = ? AND id < ?
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (user_id, before_id if before_id is not None else 2 ** 63 - 1, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def _init_notes_stats(conn: sqlite3.Connection):
+    """
+    Сводки по заметкам, которые триггеры обновляют в той же транзакции,
+    что и саму заметку: note_user_stats - число заметок пользователя,
+    note_daily_stats - по дням: сколько из созданных в этот день заметок
+    существует (created) и сколько правок сделано (edited).
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'note_daily_stats'"
+    ).fetchone()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS note_daily_stats (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            created INTEGER NOT NULL DEFAULT 0,
+            edited INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS note_user_stats (
+            user_id INTEGER PRIMARY KEY,
+            notes INTEGER NOT NULL
+        )
+    ''')
+
+    def created_delta(row: str, delta: str) -> str:
+        return f'''
+            INSERT INTO note_daily_stats (user_id, day, created) VALUES ({row}.user_id, date({row}.created_at), {delta})
+            ON CONFLICT(user_id, day) DO UPDATE SET created = created + {delta};
+            INSERT INTO note_user_stats (user_id, notes) VALUES ({row}.user_id, {delta})
+            ON CONFLICT(user_id) DO UPDATE SET notes = notes + {delta};
+        '''
+
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_notes_stats_insert AFTER INSERT ON notes
+        BEGIN {created_delta("new", "1")} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_notes_stats_delete AFTER DELETE ON notes
+        BEGIN {created_delta("old", "-1")} END
+    ''')
+    # Перенос заметки на другой день или другому пользователю (правка created_at/user_id)
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_notes_stats_move AFTER UPDATE OF created_at, user_id ON notes
+        BEGIN {created_delta("old", "-1")} {created_delta("new", "1")} END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_notes_stats_edit AFTER UPDATE OF text ON notes
+        BEGIN
+            INSERT INTO note_daily_stats (user_id, day, edited) VALUES (new.user_id, date('now'), 1)
+            ON CONFLICT(user_id, day) DO UPDATE SET edited = edited + 1;
+        END
+    ''')
+
+    if not exists:
+        # Сводки созданы для уже существующих заметок - считаем их один раз
+        conn.execute('''
+            INSERT INTO note_daily_stats (user_id, day, created)
+            SELECT user_id, date(created_at), COUNT(*) FROM notes GROUP BY user_id, date(created_at)
+        ''')
+        conn.execute('''
+            INSERT OR REPLACE INTO note_user_stats (user_id, notes)
+            SELECT user_id, COUNT(*) FROM notes GROUP BY user_id
+        ''')
+
+
+def _fts_query(query: str) -> str:
+    """
+    Запрос пользователя -> выражение FTS5: все слова обязательны, каждое
+    ищется как начало слова. Слова берутся в кавычки, поэтому операторы и
+    спецсимволы FTS5 во вводе не действуют.
+    """
+    terms = []
+    for word in query.split():
+        word = word.strip('"*')
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"*')
+    return " ".join(terms)
+
+
+def find_notes(user_id: int, query: str, limit: int = 20, offset: int = 0) -> List[dict]:
+    """
+    Поиск по заметкам пользователя, самые релевантные (bm25) первыми.
+
+    В snippet - фрагмент текста с найденными словами в <b>...</b>, уже
+    экранированный для parse_mode='HTML'. Следующая страница - offset += limit.
+    """
+    match = _fts_query(query)
+    if not match:
+        return []
+    with _notes_connection() as conn:
+        rows = conn.execute('''
+            SELECT n.id, n.text, n.created_at, n.updated_at,
+                   snippet(notes_fts, 0, char(2), char(3), '…', 16) AS snippet
+            FROM notes_fts
+            JOIN notes n ON n.id = notes_fts.rowid
+            WHERE notes_fts MATCH ?
+            ORDER BY bm25(notes_fts, 1.0, 0.0), n.id DESC
+            LIMIT ? OFFSET ?
+        ''', (f"owner:u{int(user_id)} AND text:({match})", limit, offset)).fetchall()
+
+    notes = []
+    for row in rows:
+        note = dict(row)
+        note['snippet'] = html.escape(note['snippet']).replace("\x02", "<b>").replace("\x03", "</b>")
+        notes.append(note)
+    return notes
+
+
+def update_note(user_id: int, note_id: int, text: str) -> bool:
+    """
+    Меняет текст заметки; False, если у пользователя нет такой заметки.
+    Если такой текст уже есть в другой заметке - sqlite3.IntegrityError.
+    """
+    with _notes_connection() as conn:
+        cursor = conn.execute('''
+            UPDATE notes SET text = ?, text_hash = ?, updated_at = datetime('now')
+            WHERE id = ? AND user_id = ?
+        ''', (text, _note_text_hash(text), note_id, user_id))
+        conn.commit()
+        return cursor.rowcount > 0
+
+
+def delete_note(user_id: int, note_id: int) -> bool:
+    """Удаляет заметку; False, если у пользователя нет такой заметки"""
+    with _notes_connection() as conn:
+        cursor = conn.execute("DELETE FROM notes WHERE id = ? AND user_id = ?", (note_id, user_id))
+        conn.commit()
+    return cursor.rowcount > 0
+
+
+def count_notes(user_id: int) -> int:
+    """
+    Число заметок пользователя из сводки note_user_stats.
+
+    Поиск по первичному ключу, поэтому кэш в памяти не нужен: без него
+    число сразу видит правки из других процессов и воркеров.
+    """
+    with _notes_connection() as conn:
+        row = conn.execute("SELECT notes FROM note_user_stats WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def get_notes_statistics(user_id: int, days: int = 7, until: Optional[str] = None) -> List[dict]:
+    """
+    Активность по дням (UTC) за days дней, заканчивая днём until
+    (YYYY-MM-DD, по умолчанию - сегодня), новые дни первыми.
+
+    count - сколько из созданных в этот день заметок существует,
+    edited - сколько правок сделано. Читается из note_daily_stats,
+    поэтому стоимость зависит от длины окна, а не от числа заметок.
+    """
+    until = until or time.strftime("%Y-%m-%d", time.gmtime())
+    with _notes_connection() as conn:
+        rows = conn.execute('''
+            SELECT day AS date, created AS count, edited FROM note_daily_stats
+            WHERE user_id = ? AND day BETWEEN date(?, ?) AND ?
+              AND (created > 0 OR edited > 0)
+            ORDER BY day DESC
+        ''', (user_id, until, f"-{max(days, 1) - 1} days", until)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def export_notes(user_id: int, chunk_size: int = 1000) -> Iterator[dict]:
+    """
+    Все заметки пользователя в порядке создания, порциями по chunk_size.
+
+    Каждая порция - отдельный запрос по индексу (user_id, id) с id больше
+    последнего прочитанного, поэтому соединение не удерживается между
+    порциями, а в памяти не больше одной порции.
+    """
+    last_id = 0
+    while True:
+        with _notes_connection() as conn:
+            rows = conn.execute('''
+                SELECT id, text, created_at, updated_at FROM notes
+                WHERE user_id = ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (user_id, last_id, chunk_size)).fetchall()
+        for row in rows:
+            yield dict(row)
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1]['id']
@@ -0,0 +1,101 @@
+"""
+Минимальный HTTP/1.1 на asyncio-потоках для внутренних эндпоинтов бота
+(метрики, вебхук Telegram). Поддерживаются Content-Length и keep-alive;
+chunked-запросы не поддерживаются.
+"""
+
+import asyncio
+from typing import Dict, NamedTuple, Optional
+
+MAX_HEADER_BYTES = 16 * 1024
+READ_TIMEOUT_S = 10.0
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    503: "Service Unavailable"
+}
+
+
+class HttpError(Exception):
+    """Запрос нельзя обработать; status уходит клиенту, соединение закрывается."""
+
+    def __init__(self, status: int):
+        self.status = status
+        super().__init__(f"HTTP {status}")
+
+
+class HttpRequest(NamedTuple):
+    method: str
+    path: str
+    headers: Dict[str, str]
+    body: bytes
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.headers.get("connection", "").lower() != "close"
+
+
+async def read_request(
+        reader: asyncio.StreamReader,
+        max_body_bytes: int = 0,
+        timeout_s: float = READ_TIMEOUT_S
+) -> Optional[HttpRequest]:
+    """
+    Читает один запрос; None - клиент закрыл соединение между запросами.
+
+    Тело длиннее max_body_bytes не читается (HttpError 413).
+    """
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout_s)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise HttpError(400)
+    except asyncio.LimitOverrunError:
+        raise HttpError(400)
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HttpError(400)
+
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+    body = b""
+    if "transfer-encoding" in headers:
+        raise HttpError(411)
+    length = headers.get("content-length")
+    if length:
+        if not length.isdigit():
+            raise HttpError(400)
+        if int(length) > max_body_bytes:
+            raise HttpError(413)
+        body = await asyncio.wait_for(reader.readexactly(int(length)), timeout_s)
+
+    return HttpRequest(method, target.split("?", 1)[0], headers, body)
+
+
+def write_response(
+        writer: asyncio.StreamWriter,
+        status: int,
+        body: bytes = b"",
+        content_type: str = "text/plain; charset=utf-8",
+        keep_alive: bool = False
+):
+    writer.write(
+        f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body
+    )
@@ -0,0 +1,218 @@
+"""
+Планировщик запросов к LLM.
+
+Стоит между обработчиками и OpenRouter: ограничивает общее число
+одновременных запросов и число запросов к каждой модели, держит для
+каждого пользователя очередь FIFO с лимитом одновременно выполняемых
+запросов и обслуживает пользователей по кругу (round-robin), чтобы один
+активный пользователь не занимал весь лимит OpenRouter.
+"""
+
+import os
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "50"))
+MODEL_CONCURRENCY = int(os.getenv("LLM_MODEL_CONCURRENCY", "10"))
+USER_INFLIGHT = int(os.getenv("LLM_USER_INFLIGHT", "1"))
+USER_QUEUE_SIZE = int(os.getenv("LLM_USER_QUEUE", "3"))
+
+
+def parse_model_limits(value: str) -> Dict[str, int]:
+    """Разбирает строку вида "model-a=5,model-b=2" в словарь лимитов."""
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            model, limit = item.rsplit("=", 1)
+            limits[model.strip()] = int(limit)
+    return limits
+
+
+class QueueFullError(Exception):
+    """У пользователя слишком много запросов в очереди."""
+
+    def __init__(self, user_id: int, limit: int):
+        self.user_id = user_id
+        self.limit = limit
+        super().__init__(f"Очередь пользователя {user_id} заполнена (лимит {limit})")
+
+
+class Ticket:
+    """Запрос в планировщике."""
+
+    def __init__(self, user_id: int, model: str, job: Callable[[], Awaitable]):
+        self.user_id = user_id
+        self.model = model
+        self.job = job
+        self.position = 0
+        self.started = False
+        self.future = asyncio.get_running_loop().create_future()
+
+    async def result(self):
+        """Дожидается выполнения запроса и возвращает его результат."""
+        return await asyncio.shield(self.future)
+
+
+class RequestScheduler:
+    """Ограничение конкурентности и справедливая очередь запросов к LLM."""
+
+    def __init__(
+            self,
+            max_concurrency: int = MAX_CONCURRENCY,
+            model_concurrency: int = MODEL_CONCURRENCY,
+            user_inflight: int = USER_INFLIGHT,
+            user_queue_size: int = USER_QUEUE_SIZE,
+            model_limits: Optional[Dict[str, int]] = None
+    ):
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = model_concurrency
+        self.user_inflight = user_inflight
+        self.user_queue_size = user_queue_size
+        self.model_limits = model_limits or parse_model_limits(os.getenv("LLM_MODEL_LIMITS", ""))
+
+        # user_id -> очередь ожидающих запросов (есть, пока у пользователя
+        # что-то ждёт или выполняется)
+        self._queues: Dict[int, deque] = {}
+        # Порядок обхода: сначала ещё не обслуженные пользователи, затем
+        # обслуженные - от давно обслуженных к недавним
+        self._waiting_first: "OrderedDict[int, None]" = OrderedDict()
+        self._rotation: "OrderedDict[int, None]" = OrderedDict()
+        self._in_flight = 0
+        self._user_in_flight: Dict[int, int] = {}
+        self._model_in_flight: Dict[str, int] = {}
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _model_limit(self, model: str) -> int:
+        return self.model_limits.get(model, self.model_concurrency)
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, user_id: int, model: str, job: Callable[[], Awaitable]) -> Ticket:
+        """
+        Ставит запрос в очередь пользователя.
+
+        Ticket.position == 0 означает, что запрос запущен сразу; иначе это
+        примерный номер в общей очереди. Если очередь пользователя заполнена,
+        выбрасывается QueueFullError.
+        """
+        queue = self._queues.get(user_id)
+        if queue is not None and len(queue) >= self.user_queue_size:
+            self.rejected += 1
+            raise QueueFullError(user_id, self.user_queue_size)
+
+        ticket = Ticket(user_id, model, job)
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+            self._waiting_first[user_id] = None
+        queue.append(ticket)
+
+        self._pump()
+
+        if not ticket.started:
+            ticket.position = self._estimate_position(user_id, len(queue))
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        return ticket
+
+    def _estimate_position(self, user_id: int, own_depth: int) -> int:
+        """При обходе по кругу перед k-м запросом пользователя обслужат не больше k запросов каждого."""
+        ahead = own_depth - 1
+        for other_id, queue in self._queues.items():
+            if other_id != user_id:
+                ahead += min(len(queue), own_depth)
+        return ahead + 1
+
+    def _can_start(self, ticket: Ticket) -> bool:
+        return (
+                self._in_flight < self.max_concurrency
+                and self._user_in_flight.get(ticket.user_id, 0) < self.user_inflight
+                and self._model_in_flight.get(ticket.model, 0) < self._model_limit(ticket.model)
+        )
+
+    def _pump(self):
+        """Запускает запросы, пока есть свободные слоты, обходя пользователей по кругу."""
+        progress = True
+        while progress and self._queues and self._in_flight < self.max_concurrency:
+            progress = False
+            for user_id in list(self._waiting_first) + list(self._rotation):
+                queue = self._queues[user_id]
+                if not queue or not self._can_start(queue[0]):
+                    continue
+
+                ticket = queue.popleft()
+                self._waiting_first.pop(user_id, None)
+                self._rotation.pop(user_id, None)
+                self._rotation[user_id] = None
+
+                self._start(ticket)
+                progress = True
+                if self._in_flight >= self.max_concurrency:
+                    break
+
+    def _start(self, ticket: Ticket):
+        ticket.started = True
+        self._in_flight += 1
+        self._user_in_flight[ticket.user_id] = self._user_in_flight.get(ticket.user_id, 0) + 1
+        self._model_in_flight[ticket.model] = self._model_in_flight.get(ticket.model, 0) + 1
+        asyncio.ensure_future(self._run(ticket))
+
+    async def _run(self, ticket: Ticket):
+        try:
+            result = await ticket.job()
+        except asyncio.CancelledError:
+            ticket.future.cancel()
+            raise
+        except Exception as e:
+            if not ticket.future.done():
+                ticket.future.set_exception(e)
+        else:
+            if not ticket.future.done():
+                ticket.future.set_result(result)
+        finally:
+            self._finish(ticket)
+
+    def _finish(self, ticket: Ticket):
+        self._in_flight -= 1
+        self.completed += 1
+        for counter, key in ((self._user_in_flight, ticket.user_id), (self._model_in_flight, ticket.model)):
+            counter[key] -= 1
+            if counter[key] == 0:
+                del counter[key]
+        self._forget_if_idle(ticket.user_id)
+        self._pump()
+
+    def _forget_if_idle(self, user_id: int):
+        """Пользователь без ожидающих и выполняющихся запросов выходит из обхода."""
+        if not self._queues.get(user_id) and user_id not in self._user_in_flight:
+            self._queues.pop(user_id, None)
+            self._waiting_first.pop(user_id, None)
+            self._rotation.pop(user_id, None)
+
+    def cancel(self, ticket: Ticket) -> bool:
+        """Убирает ещё не запущенный запрос из очереди."""
+        queue = self._queues.get(ticket.user_id)
+        if ticket.started or queue is None or ticket not in queue:
+            return False
+        queue.remove(ticket)
+        self._forget_if_idle(ticket.user_id)
+        ticket.future.cancel()
+        return True
+
+    def stats(self) -> dict:
+        """Глубина очередей и загрузка для метрик."""
+        return {
+            "in_flight": self._in_flight,
+            "queued": self.queued,
+            "users_waiting": sum(1 for queue in self._queues.values() if queue),
+            "max_queue_depth": self.max_queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "model_in_flight": dict(self._model_in_flight)
+        }
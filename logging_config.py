@@ -0,0 +1,204 @@
+"""
+Настройка логирования для всех ботов проекта.
+
+Записи не пишутся на диск в потоке обработчика: корневой логгер кладёт
+их в очередь (QueueHandler), а один фоновый поток (QueueListener)
+форматирует их и пишет в файл и консоль. Файл ротируется по размеру.
+
+Переменные окружения:
+    LOG_DIR, LOG_FILE        - каталог и имя файла лога (logs/bot.log)
+    LOG_LEVEL                - уровень корневого логгера (INFO)
+    LOG_MAX_BYTES            - размер файла до ротации (10 МБ)
+    LOG_BACKUP_COUNT         - число хранимых архивов (5)
+    LOG_ENCODING             - кодировка файла (utf-8)
+    LOG_FORMAT               - text или json (строка JSON на запись)
+    LOG_QUEUE_SIZE           - ёмкость очереди; при переполнении записи отбрасываются
+    LOG_SAMPLING             - доли записей по логгерам: "bot.messages=0.1,httpx=0.5"
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import logging
+import contextvars
+import logging.handlers
+from typing import Dict, Optional
+
+DEFAULT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+# Идентификатор обрабатываемого запроса (update) для связывания записей
+request_id_var: contextvars.ContextVar = contextvars.ContextVar("request_id", default="-")
+
+
+def bind_request_id(request_id) -> contextvars.Token:
+    """Привязывает идентификатор запроса к текущему контексту (задаче asyncio или потоку)."""
+    return request_id_var.set(str(request_id))
+
+
+def parse_sampling(value: str) -> Dict[str, float]:
+    """Разбирает строку вида "bot.messages=0.1,httpx=0.5"."""
+    rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, rate = item.rsplit("=", 1)
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+class DotTimeFormatter(logging.Formatter):
+    """Форматтер с миллисекундами через точку: 2024-01-31 12:00:00.123."""
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
+        created = self.converter(record.created)
+        base = time.strftime(datefmt or "%Y-%m-%d %H:%M:%S", created)
+        return f"{base}.{int(record.msecs):03d}"
+
+
+class JsonFormatter(DotTimeFormatter):
+    """Одна запись - одна строка JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет к записи request_id из текущего контекста."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только долю записей от указанных логгеров (и их потомков).
+
+    Предупреждения и ошибки не отбрасываются никогда.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def _rate(self, name: str) -> float:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class QueuedLogHandler(logging.handlers.QueueHandler):
+    """
+    Единственный обработчик корневого логгера.
+
+    Кладёт записи в очередь, а один QueueListener в фоновом потоке передаёт
+    их настоящим обработчикам (файл, консоль). Фильтры этого обработчика
+    выполняются в потоке, где запись создана, - там доступен request_id.
+    """
+
+    def __init__(self, handlers, queue_size: int = 10000):
+        super().__init__(queue.Queue(queue_size))
+        self.handlers = list(handlers)
+        self.dropped = 0
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers)
+        self.listener.start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Запись уходит как есть: QueueHandler.prepare() вписал бы трейсбек в
+        # msg и убрал exc_info, и JsonFormatter потерял бы поле exc.
+        # Форматирование выполняют обработчики в потоке слушателя
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.listener is not None:
+            # stop() дожидается записи всего, что уже в очереди
+            self.listener.stop()
+            self.listener = None
+        for handler in self.handlers:
+            handler.close()
+        super().close()
+
+
+def setup_logging(
+        default_log_file: str = "bot.log",
+        level: Optional[str] = None,
+        json_format: Optional[bool] = None,
+        console: bool = True
+) -> logging.Logger:
+    """
+    Настраивает корневой логгер: консоль + файл с ротацией по размеру.
+
+    Параметры, не переданные явно, берутся из переменных окружения (см.
+    описание модуля); default_log_file используется, если не задан LOG_FILE.
+    Повторный вызов заменяет обработчики, установленные предыдущим вызовом.
+    """
+    log_dir = os.getenv("LOG_DIR", "logs")
+    log_file = os.getenv("LOG_FILE", default_log_file)
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    max_bytes = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    backup_count = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    encoding = os.getenv("LOG_ENCODING", "utf-8")
+    queue_size = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    if json_format is None:
+        json_format = os.getenv("LOG_FORMAT", "text").lower() == "json"
+    sampling = parse_sampling(os.getenv("LOG_SAMPLING", ""))
+
+    os.makedirs(log_dir, exist_ok=True)
+
+    if json_format:
+        formatter = JsonFormatter()
+    else:
+        formatter = DotTimeFormatter(DEFAULT_FORMAT)
+
+    handlers = [logging.handlers.RotatingFileHandler(
+        os.path.join(log_dir, log_file),
+        maxBytes=max_bytes,
+        backupCount=backup_count,
+        encoding=encoding
+    )]
+    if console:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queued = QueuedLogHandler(handlers, queue_size=queue_size)
+    queued.addFilter(RequestIdFilter())
+    if sampling:
+        queued.addFilter(SamplingFilter(sampling))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, QueuedLogHandler):
+            root.removeHandler(handler)
+            handler.close()
+    root.addHandler(queued)
+
+    root.setLevel(level)
+    return root
@@ -1,24 +1,47 @@
+import asyncio
 import logging
+import math
 import os
-import random
+import signal
+import time
+from typing import Optional
 from telegram import Update, BotCommand
-from telegram.ext import Application, CommandHandler, ContextTypes
-from db import Database
-from openrouter_client import OpenRouterClient
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, ContextTypes, TypeHandler
+from telegram.request import BaseRequest
+from db import Database, AsyncDatabase
+from openrouter_client import AsyncOpenRouterClient, OpenRouterError
+from streaming import StreamingReply, fit_message, TRUNCATED_SUFFIX
+from llm_scheduler import RequestScheduler, QueueFullError
+from response_cache import ResponseCache, make_cache_key
+from metrics import metric, timed, series_name
+from metrics_server import MetricsServer, METRICS_PORT
+from usage_ledger import UsageLedger
+from conversation import ConversationStore, answer_budget
+import notes_handlers
+from rate_limit import RateLimiter
+from send_scheduler import SendScheduler
+from workers import ChatOrderedUpdateProcessor
+from webhook_server import WebhookServer, set_webhook, WEBHOOK_URL, DROP_PENDING_UPDATES
+from logging_config import setup_logging, bind_request_id
 from dotenv import load_dotenv
 
 load_dotenv()
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Инициализация компонентов
 try:
     db = Database()
-    openrouter_client = OpenRouterClient()
+    adb = AsyncDatabase(db)
+    llm_scheduler = RequestScheduler()
+    response_cache = ResponseCache(db.db_path)
+    openrouter_client = AsyncOpenRouterClient()
+    usage_ledger = UsageLedger(db.db_path)
+    conversations = ConversationStore(db.db_path)
+    rate_limiter = RateLimiter()
+    send_scheduler = SendScheduler()
+    metrics_server = MetricsServer() if METRICS_PORT else None
     logger.info("Все компоненты успешно инициализированы")
 except Exception as e:
     logger.error(f"Ошибка инициализации: {e}")
@@ -29,6 +52,20 @@ except Exception as e:
 # Константы
 MAX_QUESTION_LENGTH = 2000
 MAX_RESPONSE_LENGTH = 4000
+# Температура генерации; кэш ответов работает только при 0
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+# Резервные модели: явный список имён через запятую или (если пусто)
+# бесплатные модели с достаточным контекстом
+LLM_FALLBACK_MODELS = [m.strip() for m in os.getenv("LLM_FALLBACK_MODELS", "").split(",") if m.strip()]
+LLM_FALLBACK_DEPTH = int(os.getenv("LLM_FALLBACK_DEPTH", "2"))
+LLM_FALLBACK_MIN_TOKENS = int(os.getenv("LLM_FALLBACK_MIN_TOKENS", "4096"))
+# Сколько обновлений обрабатывается одновременно (разные чаты; один чат - по
+# порядку). Потоковый /ask держит своё обновление всю генерацию (и ожидание
+# в очереди планировщика), так что значение должно быть с запасом больше
+# LLM_MAX_CONCURRENCY
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "512"))
+# Telegram ID администраторов через запятую (доступ к /usage_all)
+ADMIN_USER_IDS = {int(i) for i in os.getenv("ADMIN_USER_IDS", "").split(",") if i.strip()}
 
 # Список команд для меню бота
 COMMANDS = [
@@ -41,8 +78,10 @@ COMMANDS = [
     ("characters", "Показать список персонажей"),
     ("setcharacter", "Выбрать персонажа"),
     ("current", "Текущая активная модель и персонаж"),
-    ("ask_random", "Задать вопрос случайному персонажу")
-]
+    ("ask_random", "Задать вопрос случайному персонажу"),
+    ("usage", "Мой расход токенов"),
+    ("reset", "Начать диалог заново")
+] + notes_handlers.COMMANDS
 
 
 def _build_messages(character_prompt: str, question: str) -> list:
@@ -71,6 +110,223 @@ def _build_messages_for_character(character_prompt: str, question: str) -> list:
     ]
 
 
+def build_fallback_chain(
+        primary: dict,
+        models: list,
+        preferred: list = None,
+        depth: int = LLM_FALLBACK_DEPTH,
+        min_tokens: int = LLM_FALLBACK_MIN_TOKENS
+) -> list:
+    """
+    Порядок моделей для запроса: основная, затем резервные.
+
+    Резервные берутся из preferred (имена в заданном порядке), а если он пуст -
+    из бесплатных моделей, у которых max_tokens не меньше
+    min(max_tokens основной модели, min_tokens).
+    """
+    by_name = {m['name']: m for m in models}
+    if preferred:
+        candidates = [by_name[name] for name in preferred if name in by_name]
+    else:
+        required = min(primary.get('max_tokens', 0), min_tokens)
+        candidates = sorted(
+            (m for m in models if m['is_free'] == 1 and m['max_tokens'] >= required),
+            key=lambda m: -m['max_tokens']
+        )
+
+    fallbacks = [m for m in candidates if m['name'] != primary['name']][:depth]
+    return [primary] + fallbacks
+
+
+def _fit_answer(answer: str, frame: str) -> str:
+    """
+    Обрезает ответ так, чтобы вместе с обрамлением frame (текст сообщения
+    без ответа) он уложился в MAX_RESPONSE_LENGTH.
+    """
+    room = MAX_RESPONSE_LENGTH - len(frame)
+    if len(answer) <= room:
+        return answer
+    return answer[:max(0, room - len(TRUNCATED_SUFFIX))] + TRUNCATED_SUFFIX
+
+
+async def _stream_answer(
+        update: Update,
+        model: dict,
+        messages: list,
+        render,
+        fallback: bool = True,
+        history: bool = False
+) -> None:
+    """
+    Отправляет вопрос модели в потоковом режиме и показывает ответ по мере генерации.
+
+    Запрос проходит через планировщик: если слоты заняты, пользователь видит
+    свой номер в очереди. Детерминированные запросы отдаются из кэша ответов.
+    Если модель недоступна (разомкнут выключатель или ошибка до первого
+    фрагмента) и fallback включён, запрос уходит следующей модели из цепочки.
+    С history в запрос добавляются предыдущие реплики диалога (сколько
+    поместится в max_tokens модели), а вопрос и ответ сохраняются в историю.
+    На ответ модели запрашивается остаток max_tokens после запроса.
+    render(answer, latency_ms) формирует итоговый текст сообщения в Markdown.
+    """
+    max_tokens = model.get('max_tokens', 400)
+    conversation_key = (update.effective_chat.id, update.effective_user.id)
+
+    async def prepare(candidate: dict) -> list:
+        if not history:
+            return messages
+        return await conversations.abuild_messages(
+            conversation_key, messages, candidate.get('max_tokens', 400)
+        )
+
+    cache_key = None
+    if response_cache.is_cacheable(LLM_TEMPERATURE):
+        start_time = time.time()
+        prepared = await prepare(model)
+        cache_key = make_cache_key(
+            model['name'], prepared, LLM_TEMPERATURE, answer_budget(max_tokens, prepared)
+        )
+        cached = await response_cache.aget(cache_key)
+        if cached:
+            latency = int((time.time() - start_time) * 1000)
+            if history:
+                await conversations.aremember(conversation_key, messages[-1]['content'], cached['text'])
+            header = "💾 *Ответ из кэша*\n"
+            answer = _fit_answer(cached['text'], header + render("", latency))
+            await update.message.reply_text(
+                fit_message(header + render(answer, latency)),
+                parse_mode='Markdown'
+            )
+            return
+
+    reply = StreamingReply(update.message, max_length=MAX_RESPONSE_LENGTH)
+    placeholder_sent = asyncio.Event()
+
+    submitted_at = time.time()
+
+    async def job():
+        await placeholder_sent.wait()
+        if reply.message is None:
+            return  # заглушку отправить не удалось - ответ показывать негде
+        metric.latency("llm_queue_wait_ms").observe((time.time() - submitted_at) * 1000)
+
+        chain = [model]
+        if fallback:
+            chain = build_fallback_chain(model, await adb.get_all_models(), LLM_FALLBACK_MODELS)
+            # Резервные модели с разомкнутым выключателем пропускаем сразу
+            chain = [model] + [m for m in chain[1:] if openrouter_client.breakers.is_available(m['name'])]
+
+        start_time = time.time()
+        used_model = None
+        error = None
+        usage = {}
+        for candidate in chain:
+            try:
+                prepared = await prepare(candidate)
+                async for delta in openrouter_client.stream_response(
+                        model=candidate['name'],
+                        messages=prepared,
+                        temperature=LLM_TEMPERATURE,
+                        max_tokens=answer_budget(candidate.get('max_tokens', 400), prepared),
+                        usage=usage
+                ):
+                    await reply.append(delta)
+                used_model = candidate
+                break
+            except OpenRouterError as e:
+                logger.error(f"Ошибка OpenRouter ({candidate['name']}): {e}")
+                error = e
+                if reply.text:
+                    # Часть ответа уже показана - переключать модель поздно
+                    break
+
+        if used_model is None:
+            await reply.finish(
+                f"❌ *Ошибка запроса к модели {model['name']}:*\n{error.message}\n\n"
+                f"*Попробуйте:*\n"
+                f"• Другую модель: /setmodel\n"
+                f"• Повторить позже",
+                parse_mode='Markdown'
+            )
+            return
+
+        latency = int((time.time() - start_time) * 1000)
+        usage_ledger.record(update.effective_user.id, used_model['name'], usage, latency)
+        answer = reply.text
+        if cache_key and used_model is model:
+            await response_cache.aput(cache_key, model['name'], answer)
+        if history:
+            await conversations.aremember(conversation_key, messages[-1]['content'], answer)
+
+        header = ""
+        if used_model is not model:
+            metric.counter("llm_fallbacks_total", model=model['name'], fallback=used_model['name']).inc()
+            header = f"↪️ *{model['name']}* недоступна, ответила *{used_model['name']}*\n"
+        # Обрезаем ответ если слишком длинный для Telegram
+        answer = _fit_answer(answer, header + render("", latency))
+        await reply.finish(header + render(answer, latency), parse_mode='Markdown')
+
+    try:
+        ticket = llm_scheduler.submit(update.effective_user.id, model['name'], job)
+    except QueueFullError as e:
+        await update.message.reply_text(
+            f"⏳ Слишком много ваших запросов в очереди (максимум {e.limit}).\n"
+            f"Дождитесь ответа и попробуйте снова."
+        )
+        return
+
+    try:
+        if ticket.position:
+            await reply.start(f"⏳ Вы #{ticket.position} в очереди. Ответ появится здесь.")
+        else:
+            await reply.start()
+    except BaseException:
+        llm_scheduler.cancel(ticket)
+        raise
+    finally:
+        placeholder_sent.set()
+
+    try:
+        await ticket.result()
+    except asyncio.CancelledError:
+        llm_scheduler.cancel(ticket)
+        raise
+
+
+async def assign_request_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Привязывает update_id к записям лога, сделанным при обработке этого update."""
+    bind_request_id(update.update_id)
+
+
+async def enforce_rate_limit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Проверяет лимиты до обработчиков команд.
+
+    Если лимит исчерпан, пользователь получает время до повтора, а update
+    дальше не обрабатывается.
+    """
+    message = update.effective_message
+    user = update.effective_user
+    if not message or not user or not message.text or not message.text.startswith("/"):
+        return
+
+    command = message.text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    allowed, retry_after, scope = rate_limiter.check(user.id, chat_id, command)
+    if allowed:
+        return
+
+    metric.counter("rate_limited_total", scope=scope, command=command).inc()
+    if rate_limiter.should_notify(user.id):
+        if scope == "global":
+            reason = "Бот сейчас обрабатывает слишком много запросов."
+        else:
+            reason = "Слишком много запросов."
+        await message.reply_text(f"⏳ {reason} Попробуйте снова через {math.ceil(retry_after)} с.")
+    raise ApplicationHandlerStop
+
+
+@timed("handler_latency_ms", command="start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     welcome_text = (
@@ -91,16 +347,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(welcome_text, parse_mode='Markdown')
 
 
+@timed("handler_latency_ms", command="models")
 async def show_models(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать список всех моделей"""
     try:
-        models = db.get_all_models()
+        models = await adb.get_all_models()
 
         if not models:
             await update.message.reply_text("❌ Модели не найдены в базе данных")
             return
 
-        active_model = db.get_active_model()
+        active_model = await adb.get_active_model()
         active_model_name = active_model['name'] if active_model else "Не выбрана"
 
         text = f"📋 *Список доступных моделей*\n\n"
@@ -128,6 +385,7 @@ async def show_models(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Произошла ошибка при получении списка моделей")
 
 
+@timed("handler_latency_ms", command="setmodel")
 async def set_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Выбор активной модели"""
     if not context.args:
@@ -149,7 +407,7 @@ async def set_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        models = db.get_all_models()
+        models = await adb.get_all_models()
         model_ids = [model['id'] for model in models]
 
         if model_id not in model_ids:
@@ -161,10 +419,10 @@ async def set_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        success = db.set_active_model(model_id)
+        success = await adb.set_active_model(model_id)
 
         if success:
-            active_model = db.get_active_model()
+            active_model = await adb.get_active_model()
             free_status = "🆓 БЕСПЛАТНАЯ" if active_model['is_free'] == 1 else "💳 ПЛАТНАЯ"
             await update.message.reply_text(
                 f"✅ *Модель успешно изменена!*\n\n"
@@ -184,6 +442,7 @@ async def set_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Произошла ошибка при изменении модели")
 
 
+@timed("handler_latency_ms", command="ask")
 async def ask_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Задать вопрос активной модели"""
     if not context.args:
@@ -206,7 +465,7 @@ async def ask_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        active_model = db.get_active_model()
+        active_model = await adb.get_active_model()
 
         if not active_model:
             await update.message.reply_text(
@@ -220,38 +479,17 @@ async def ask_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_chat_action("typing")
 
         user_id = update.effective_user.id
-        character_prompt = db.get_character_prompt(user_id)
+        character_prompt = await adb.get_character_prompt(user_id)
 
         messages = _build_messages_for_character(character_prompt, question)
         if not messages:
             await update.message.reply_text("❌ Вопрос не может быть пустым.")
             return
 
-        # Отправляем запрос к OpenRouter
-        response = openrouter_client.generate_response(
-            model=active_model['name'],
-            messages=messages,
-            max_tokens=active_model.get('max_tokens', 400)
-        )
-
-        if "error" in response:
-            await update.message.reply_text(
-                f"❌ *Ошибка запроса:*\n{response['error']}\n\n"
-                f"*Попробуйте:*\n"
-                f"• Другую модель: /setmodel\n"
-                f"• Повторить позже",
-                parse_mode='Markdown'
-            )
-        else:
-            answer = response['text']
-            latency = response.get('latency_ms', 0)
+        free_status = "🆓" if active_model['is_free'] == 1 else "💳"
 
-            # Обрезаем ответ если слишком длинный для Telegram
-            if len(answer) > MAX_RESPONSE_LENGTH:
-                answer = answer[:MAX_RESPONSE_LENGTH] + "\n\n... (сообщение обрезано)"
-
-            free_status = "🆓" if active_model['is_free'] == 1 else "💳"
-            reply_text = (
+        def render(answer: str, latency: int) -> str:
+            return (
                 f"{free_status} *{active_model['name']}*\n"
                 f"⏱ *Время ответа:* {latency}мс\n\n"
                 f"{answer}\n\n"
@@ -261,13 +499,14 @@ async def ask_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"• `/current` - текущие настройки"
             )
 
-            await update.message.reply_text(reply_text, parse_mode='Markdown')
+        await _stream_answer(update, active_model, messages, render, history=True)
 
     except Exception as e:
         logger.error(f"Ошибка в ask_model: {e}")
         await update.message.reply_text("❌ Произошла ошибка при обработке запроса")
 
 
+@timed("handler_latency_ms", command="ask_model")
 async def ask_model_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Задать вопрос конкретной модели по ID"""
     if not context.args or len(context.args) < 2:
@@ -301,10 +540,10 @@ async def ask_model_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         # Получаем модель по ID
-        model = db.get_model_by_id(model_id)
+        model = await adb.get_model_by_id(model_id)
 
         if not model:
-            models = db.get_all_models()
+            models = await adb.get_all_models()
             model_ids = [m['id'] for m in models]
             await update.message.reply_text(
                 f"❌ Модель с ID `{model_id}` не найдена\n\n"
@@ -317,39 +556,17 @@ async def ask_model_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_chat_action("typing")
 
         user_id = update.effective_user.id
-        character_prompt = db.get_character_prompt(user_id)
+        character_prompt = await adb.get_character_prompt(user_id)
 
         messages = _build_messages_for_character(character_prompt, question)
         if not messages:
             await update.message.reply_text("❌ Вопрос не может быть пустым.")
             return
 
-        # Отправляем запрос к OpenRouter
-        response = openrouter_client.generate_response(
-            model=model['name'],
-            messages=messages,
-            max_tokens=model.get('max_tokens', 400)
-        )
+        free_status = "🆓" if model['is_free'] == 1 else "💳"
 
-        if "error" in response:
-            await update.message.reply_text(
-                f"❌ *Ошибка при запросе к модели {model['name']}:*\n"
-                f"{response['error']}\n\n"
-                f"*Попробуйте:*\n"
-                f"• Другую модель\n"
-                f"• Повторить позже",
-                parse_mode='Markdown'
-            )
-        else:
-            answer = response['text']
-            latency = response.get('latency_ms', 0)
-
-            # Обрезаем ответ если слишком длинный для Telegram
-            if len(answer) > MAX_RESPONSE_LENGTH:
-                answer = answer[:MAX_RESPONSE_LENGTH] + "\n\n... (сообщение обрезано)"
-
-            free_status = "🆓" if model['is_free'] == 1 else "💳"
-            reply_text = (
+        def render(answer: str, latency: int) -> str:
+            return (
                 f"{free_status} *{model['name']} (ID: {model_id})*\n"
                 f"⏱ *Время ответа:* {latency}мс\n\n"
                 f"{answer}\n\n"
@@ -358,24 +575,25 @@ async def ask_model_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"*Использовать как активную:* `/setmodel {model_id}`"
             )
 
-            await update.message.reply_text(reply_text, parse_mode='Markdown')
+        await _stream_answer(update, model, messages, render, fallback=False, history=True)
 
     except Exception as e:
         logger.error(f"Ошибка в ask_model_command: {e}")
         await update.message.reply_text("❌ Произошла ошибка при обработке запроса")
 
 
+@timed("handler_latency_ms", command="characters")
 async def show_characters(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать список всех персонажей"""
     try:
-        characters = db.get_all_characters()
+        characters = await adb.get_all_characters()
 
         if not characters:
             await update.message.reply_text("❌ Персонажи не найдены в базе данных")
             return
 
         user_id = update.effective_user.id
-        user_character = db.get_user_character(user_id)
+        user_character = await adb.get_user_character(user_id)
         active_character_name = user_character['name'] if user_character else "Не выбран"
 
         text = f"🎭 *Список доступных персонажей*\n\n"
@@ -400,6 +618,7 @@ async def show_characters(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Произошла ошибка при получении списка персонажей")
 
 
+@timed("handler_latency_ms", command="setcharacter")
 async def set_character(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Выбор персонажа для пользователя"""
     if not context.args:
@@ -421,7 +640,7 @@ async def set_character(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        characters = db.get_all_characters()
+        characters = await adb.get_all_characters()
         character_ids = [character['id'] for character in characters]
 
         if character_id not in character_ids:
@@ -434,10 +653,10 @@ async def set_character(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         user_id = update.effective_user.id
-        success = db.set_user_character(user_id, character_id)
+        success = await adb.set_user_character(user_id, character_id)
 
         if success:
-            character = db.get_character_by_id(character_id)
+            character = await adb.get_character_by_id(character_id)
             prompt_preview = character['prompt'][:150] + "..." if len(character['prompt']) > 150 else character[
                 'prompt']
             await update.message.reply_text(
@@ -456,12 +675,13 @@ async def set_character(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Произошла ошибка при изменении персонажа")
 
 
+@timed("handler_latency_ms", command="current")
 async def current_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать текущую активную модель и персонаж"""
     try:
-        active_model = db.get_active_model()
+        active_model = await adb.get_active_model()
         user_id = update.effective_user.id
-        user_character = db.get_user_character(user_id)
+        user_character = await adb.get_user_character(user_id)
 
         if not active_model:
             await update.message.reply_text(
@@ -506,6 +726,7 @@ async def current_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Произошла ошибка при получении настроек")
 
 
+@timed("handler_latency_ms", command="ask_random")
 async def ask_random_character(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Задать вопрос случайному персонажу"""
     if not context.args:
@@ -527,7 +748,7 @@ async def ask_random_character(update: Update, context: ContextTypes.DEFAULT_TYP
         return
 
     try:
-        active_model = db.get_active_model()
+        active_model = await adb.get_active_model()
 
         if not active_model:
             await update.message.reply_text(
@@ -538,13 +759,11 @@ async def ask_random_character(update: Update, context: ContextTypes.DEFAULT_TYP
             return
 
         # Получаем случайного персонажа
-        characters = db.get_all_characters()
-        if not characters:
+        random_character = await adb.get_random_character()
+        if not random_character:
             await update.message.reply_text("❌ Персонажи не найдены")
             return
 
-        random_character = random.choice(characters)
-
         await update.message.reply_chat_action("typing")
 
         # Формируем сообщения для модели
@@ -553,30 +772,8 @@ async def ask_random_character(update: Update, context: ContextTypes.DEFAULT_TYP
             await update.message.reply_text("❌ Вопрос не может быть пустым.")
             return
 
-        # Отправляем запрос к OpenRouter
-        response = openrouter_client.generate_response(
-            model=active_model['name'],
-            messages=messages,
-            max_tokens=active_model.get('max_tokens', 400)
-        )
-
-        if "error" in response:
-            await update.message.reply_text(
-                f"❌ *Ошибка:* {response['error']}\n\n"
-                f"*Попробуйте:*\n"
-                f"• Позже\n"
-                f"• Другую модель: /setmodel",
-                parse_mode='Markdown'
-            )
-        else:
-            answer = response['text']
-            latency = response.get('latency_ms', 0)
-
-            # Обрезаем ответ если слишком длинный для Telegram
-            if len(answer) > MAX_RESPONSE_LENGTH:
-                answer = answer[:MAX_RESPONSE_LENGTH] + "\n\n... (сообщение обрезано)"
-
-            reply_text = (
+        def render(answer: str, latency: int) -> str:
+            return (
                 f"🎭 *Случайный персонаж:* {random_character['name']}\n"
                 f"🤖 *Модель:* {active_model['name']}\n"
                 f"⏱ *Время ответа:* {latency}мс\n\n"
@@ -586,13 +783,14 @@ async def ask_random_character(update: Update, context: ContextTypes.DEFAULT_TYP
                 f"`/setcharacter {random_character['id']}`"
             )
 
-            await update.message.reply_text(reply_text, parse_mode='Markdown')
+        await _stream_answer(update, active_model, messages, render)
 
     except Exception as e:
         logger.error(f"Ошибка в ask_random_character: {e}")
         await update.message.reply_text("❌ Произошла ошибка при обработке запроса")
 
 
+@timed("handler_latency_ms", command="help")
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать справку"""
     help_text = (
@@ -606,13 +804,26 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "`/models` - Список всех моделей\n"
         "`/setmodel <ID>` - Выбрать активную модель\n"
         "`/ask <вопрос>` - Задать вопрос активной модели\n"
-        "`/ask_model <ID> <вопрос>` - Задать вопрос конкретной модели\n\n"
+        "`/ask_model <ID> <вопрос>` - Задать вопрос конкретной модели\n"
+        "`/reset` - Забыть предыдущие вопросы и начать диалог заново\n\n"
 
         "*Управление персонажами:*\n"
         "`/characters` - Список всех персонажей\n"
         "`/setcharacter <ID>` - Выбрать персонажа\n"
         "`/ask_random <вопрос>` - Задать вопрос случайному персонажу\n\n"
 
+        "*Статистика:*\n"
+        "`/usage [дней]` - Ваш расход токенов (по умолчанию за 30 дней)\n\n"
+
+        "*Заметки:*\n"
+        "`/note_add <текст>` - Добавить заметку\n"
+        "`/note_list [ID]` - Последние заметки (старше ID)\n"
+        "`/note_find <запрос>` - Поиск по заметкам\n"
+        "`/note_edit <ID> <текст>` - Изменить заметку\n"
+        "`/note_del <ID>` - Удалить заметку\n"
+        "`/note_count [дней]` - Статистика заметок\n"
+        "`/note_export [txt|csv|jsonl] [gz]` - Выгрузить заметки файлом\n\n"
+
         "*Примеры использования:*\n"
         "• `/setmodel 3` - выбрать модель с ID 3\n"
         "• `/ask Что такое ИИ?` - задать вопрос\n"
@@ -622,6 +833,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "*💡 Важно:*\n"
         "• Бесплатные модели (🆓) имеют ограничения\n"
         "• Макс. длина вопроса: 2000 символов\n"
+        "• `/ask` и `/ask_model` помнят предыдущие вопросы, пока не вызван `/reset`\n"
         "• Токены - единицы измерения текста\n\n"
 
         "*❓ Проблемы?*\n"
@@ -632,9 +844,101 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
 
+@timed("handler_latency_ms", command="reset")
+async def reset_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начать диалог с моделью заново"""
+    try:
+        await conversations.areset((update.effective_chat.id, update.effective_user.id))
+        await update.message.reply_text("🧹 История диалога очищена. Следующий вопрос - с чистого листа.")
+    except Exception as e:
+        logger.error(f"Ошибка в reset_conversation: {e}")
+        await update.message.reply_text("❌ Не удалось очистить историю")
+
+
+def _parse_days(args: list, default: int) -> int:
+    """Число дней из аргумента команды (1..365)."""
+    if args and args[0].isdigit():
+        return max(1, min(int(args[0]), 365))
+    return default
+
+
+def _format_tokens(value: int) -> str:
+    return f"{int(value):,}".replace(",", " ")
+
+
+@timed("handler_latency_ms", command="usage")
+async def show_usage(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Расход токенов пользователя по моделям"""
+    try:
+        days = _parse_days(context.args, 30)
+        by_model = await usage_ledger.run(usage_ledger.user_summary, update.effective_user.id, days)
+
+        if not by_model:
+            await update.message.reply_text(f"📊 За последние {days} дн. запросов к моделям не было.")
+            return
+
+        text = f"📊 *Ваш расход токенов за {days} дн.*\n\n"
+        total_tokens = 0
+        for model_name, totals in sorted(by_model.items(), key=lambda item: -item[1]['requests']):
+            tokens = totals['prompt_tokens'] + totals['completion_tokens']
+            total_tokens += tokens
+            avg_latency = totals['latency_ms'] // totals['requests'] if totals['requests'] else 0
+            text += (
+                f"*{model_name}*\n"
+                f"• Запросов: {totals['requests']}\n"
+                f"• Токенов: {_format_tokens(tokens)} "
+                f"(вопросы {_format_tokens(totals['prompt_tokens'])}, "
+                f"ответы {_format_tokens(totals['completion_tokens'])})\n"
+                f"• Среднее время ответа: {avg_latency}мс\n\n"
+            )
+        text += f"*Всего токенов:* {_format_tokens(total_tokens)}"
+
+        await update.message.reply_text(text, parse_mode='Markdown')
+
+    except Exception as e:
+        logger.error(f"Ошибка в show_usage: {e}")
+        await update.message.reply_text("❌ Не удалось получить статистику")
+
+
+@timed("handler_latency_ms", command="usage_all")
+async def show_usage_summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сводка расхода по моделям и пользователям (только для администраторов)"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text("⛔ Команда доступна только администраторам")
+        return
+
+    try:
+        days = _parse_days(context.args, 1)
+        by_model = await usage_ledger.run(usage_ledger.model_summary, days)
+        top_users = await usage_ledger.run(usage_ledger.top_users, days)
+
+        text = f"📈 *Расход за {days} дн.*\n\n*По моделям:*\n"
+        if not by_model:
+            text += "• Запросов не было\n"
+        for model_name, totals in sorted(by_model.items(), key=lambda item: -item[1]['requests']):
+            tokens = totals['prompt_tokens'] + totals['completion_tokens']
+            text += f"• {model_name}: {totals['requests']} запр., {_format_tokens(tokens)} ток."
+            if totals['cost']:
+                text += f", ${totals['cost']:.4f}"
+            text += "\n"
+
+        if top_users:
+            text += "\n*Топ пользователей:*\n"
+            for user_id, totals in top_users:
+                tokens = totals['prompt_tokens'] + totals['completion_tokens']
+                text += f"• `{user_id}`: {totals['requests']} запр., {_format_tokens(tokens)} ток.\n"
+
+        await update.message.reply_text(text, parse_mode='Markdown')
+
+    except Exception as e:
+        logger.error(f"Ошибка в show_usage_summary: {e}")
+        await update.message.reply_text("❌ Не удалось получить сводку")
+
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     logger.error(f"Ошибка: {context.error}", exc_info=True)
+    metric.counter("handler_errors_total", error=type(context.error).__name__).inc()
 
     if update and update.message:
         try:
@@ -650,11 +954,138 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pass
 
 
+def collect_bot_metrics() -> dict:
+    """Мгновенные значения для /metrics: очереди, кэши, выключатели, повторы."""
+    gauges = {}
+
+    scheduler_stats = llm_scheduler.stats()
+    for key in ("in_flight", "queued", "users_waiting", "max_queue_depth"):
+        gauges[f"llm_scheduler_{key}"] = scheduler_stats[key]
+    for model_name, in_flight in scheduler_stats["model_in_flight"].items():
+        gauges[series_name("llm_scheduler_model_in_flight", {"model": model_name})] = in_flight
+
+    caches = dict(db.cache_stats(), responses=response_cache.stats.snapshot())
+    for cache_name, stats in caches.items():
+        for key in ("hits", "misses", "hit_rate"):
+            gauges[series_name(f"cache_{key}", {"cache": cache_name})] = stats[key]
+
+    for model_name, breaker in openrouter_client.breakers.snapshot().items():
+        gauges[series_name("circuit_breaker_open", {"model": model_name})] = int(breaker["state"] != "closed")
+
+    for key, value in openrouter_client.retry_policy.stats().items():
+        gauges[f"openrouter_retry_{key}"] = value
+
+    for key, value in rate_limiter.stats().items():
+        gauges[f"rate_limit_{key}"] = value
+
+    for key, value in send_scheduler.stats().items():
+        gauges[f"tg_send_{key}"] = value
+
+    for key, value in conversations.stats().items():
+        gauges[f"conversation_{key}"] = value
+
+    return gauges
+
+
 async def post_init(application: Application):
     commands = [BotCommand(cmd[0], cmd[1]) for cmd in COMMANDS]
     await application.bot.set_my_commands(commands)
     logger.info("Команды меню установлены")
 
+    metric.register_collector("bot", collect_bot_metrics)
+    usage_ledger.start()
+    await notes_handlers.init()
+    if metrics_server:
+        await metrics_server.start()
+
+
+async def post_shutdown(application: Application):
+    if metrics_server:
+        await metrics_server.stop()
+    await openrouter_client.aclose()
+    await usage_ledger.aclose()
+    conversations.close()
+    notes_handlers.close()
+    adb.close()
+    response_cache.close()
+    logger.info("HTTP-сессия OpenRouter и соединения с БД закрыты")
+
+
+def build_application(token: str, request: Optional[BaseRequest] = None) -> Application:
+    """
+    Создаёт приложение бота со всеми обработчиками.
+
+    request - свой транспорт Bot API (например, заглушка для локального
+    прогона воркеров); с ним встроенный Updater не создаётся.
+    """
+    builder = Application.builder() \
+        .token(token) \
+        .post_init(post_init) \
+        .post_shutdown(post_shutdown) \
+        .concurrent_updates(ChatOrderedUpdateProcessor(UPDATE_CONCURRENCY)) \
+        .rate_limiter(send_scheduler)
+    if request is not None:
+        builder = builder.request(request).updater(None)
+    application = builder.build()
+
+    # Регистрируем обработчики команд
+    application.add_handler(TypeHandler(Update, assign_request_id), group=-2)
+    application.add_handler(TypeHandler(Update, enforce_rate_limit), group=-1)
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("models", show_models))
+    application.add_handler(CommandHandler("setmodel", set_model))
+    application.add_handler(CommandHandler("ask", ask_model))
+    application.add_handler(CommandHandler("ask_model", ask_model_command))
+    application.add_handler(CommandHandler("characters", show_characters))
+    application.add_handler(CommandHandler("setcharacter", set_character))
+    application.add_handler(CommandHandler("current", current_model))
+    application.add_handler(CommandHandler("ask_random", ask_random_character))
+    application.add_handler(CommandHandler("usage", show_usage))
+    application.add_handler(CommandHandler("usage_all", show_usage_summary))
+    application.add_handler(CommandHandler("reset", reset_conversation))
+    notes_handlers.register(application)
+
+    # Обработчик ошибок
+    application.add_error_handler(error_handler)
+    return application
+
+
+async def run_application(application: Application, intake, on_started=None, stop_event=None):
+    """
+    Жизненный цикл приложения со внешним источником обновлений.
+
+    intake - объект с async start()/stop(), кладущий обновления в
+    application.update_queue (сервер вебхука, очередь воркера). Цикл
+    повторяет run_polling(): post_init, start, ожидание остановки, остановка
+    источника, stop (дообрабатывает очередь) и post_shutdown. Без stop_event
+    приложение останавливается по SIGINT/SIGTERM, с ним - когда его
+    установит вызывающий. run_webhook() из python-telegram-bot не подходит:
+    он требует tornado.
+    """
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+
+    async with application:
+        await post_init(application)
+        await application.start()
+        await intake.start()
+        try:
+            if on_started is not None:
+                await on_started(application)
+            await stop_event.wait()
+        finally:
+            # Сначала перестаём принимать, затем application.stop() дообрабатывает очередь
+            await intake.stop()
+            await application.stop()
+            await post_shutdown(application)
+
 
 def main():
     """Основная функция запуска бота"""
@@ -669,34 +1100,23 @@ def main():
 
     # Создаем приложение
     try:
-        application = Application.builder() \
-            .token(TELEGRAM_TOKEN) \
-            .post_init(post_init) \
-            .build()
-
-        # Регистрируем обработчики команд
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("models", show_models))
-        application.add_handler(CommandHandler("setmodel", set_model))
-        application.add_handler(CommandHandler("ask", ask_model))
-        application.add_handler(CommandHandler("ask_model", ask_model_command))
-        application.add_handler(CommandHandler("characters", show_characters))
-        application.add_handler(CommandHandler("setcharacter", set_character))
-        application.add_handler(CommandHandler("current", current_model))
-        application.add_handler(CommandHandler("ask_random", ask_random_character))
-
-        # Обработчик ошибок
-        application.add_error_handler(error_handler)
+        application = build_application(TELEGRAM_TOKEN)
 
         print("🤖 Бот запускается...")
         print("📊 Команды:", [cmd[0] for cmd in COMMANDS])
         print("✅ Бот готов к работе!")
 
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
-        )
+        if WEBHOOK_URL:
+            asyncio.run(run_application(
+                application,
+                WebhookServer(application),
+                on_started=lambda app: set_webhook(app.bot)
+            ))
+        else:
+            application.run_polling(
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=DROP_PENDING_UPDATES
+            )
 
     except Exception as e:
         logger.error(f"Ошибка запуска бота: {e}")
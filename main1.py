@@ -1,7 +1,7 @@
 import os
 import logging
-from datetime import datetime
 from dotenv import load_dotenv
+from logging_config import setup_logging
 from typing import List
 import telebot
 from telebot import types
@@ -14,15 +14,9 @@ if not TOKEN:
     raise RuntimeError("Токен не найден")
 
 # Настройка логирования
-os.makedirs("logs", exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(f"logs/bot_{datetime.now().strftime('%Y-%m-%d')}.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging("main1.log")
+# Отдельный логгер для входящих сообщений: его можно прореживать через LOG_SAMPLING
+message_logger = logging.getLogger("bot.messages")
 
 bot = telebot.TeleBot(TOKEN)
 BOT_INFO = {"version": "1", "author": "Махмудов Суннатилло", "purpose": "Обучение"}
@@ -66,7 +60,7 @@ def log_message(message, command=None):
     user = message.from_user
     user_info = f"ID: {user.id}, Имя: {user.first_name or ''} {user.last_name or ''}"
     if user.username: user_info += f" (@{user.username})"
-    logging.info(f"Пользователь: {user_info}, Команда: {command or 'текст'}, Текст: '{message.text}'")
+    message_logger.info(f"Пользователь: {user_info}, Команда: {command or 'текст'}, Текст: '{message.text}'")
 
 
 def make_main_kb():
@@ -1,9 +1,13 @@
 import telebot
 from telebot import types
+import html
 import logging
 import os
+import sqlite3
 from dotenv import load_dotenv
+from logging_config import setup_logging
 import db
+from notes_export import EXPORT_FORMATS, export_notes
 
 load_dotenv()
 
@@ -11,11 +15,7 @@ TOKEN = os.getenv("TOKEN")
 DB_PATH = os.getenv("DB_PATH", "bot.db")
 
 # Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+setup_logging("main3.log")
 
 logger = logging.getLogger(__name__)
 
@@ -51,7 +51,7 @@ def send_welcome(message):
 /note_edit - Редактировать заметку
 /note_del - Удалить заметку
 /note_count - Статистика
-/note_export - Экспорт всех заметок
+/note_export - Экспорт всех заметок (txt, csv, jsonl; gz - сжать)
 
 Просто используйте команды из меню!
     """
@@ -74,11 +74,10 @@ def add_note_handler(message):
         note_id = db.add_note(message.from_user.id, text)
         bot.reply_to(message, f"✅ Заметка #{note_id} добавлена!")
 
+    except sqlite3.IntegrityError:
+        bot.reply_to(message, "❌ Такая заметка уже существует")
     except Exception as e:
-        error_msg = "❌ Ошибка при добавлении заметки"
-        if "UNIQUE" in str(e):
-            error_msg = "❌ Такая заметка уже существует"
-        bot.reply_to(message, error_msg)
+        bot.reply_to(message, "❌ Ошибка при добавлении заметки")
         logger.error(f"Error adding note: {e}")
 
 
@@ -117,9 +116,9 @@ def find_notes_handler(message):
             bot.reply_to(message, f"🔍 По запросу '{query}' ничего не найдено")
             return
 
-        response = f"🔍 **Результаты поиска '{query}':**\n\n"
+        response = f"🔍 <b>Результаты поиска '{html.escape(query)}':</b>\n\n"
         for note in notes:
-            response += f"#{note['id']} - {note['text']}\n\n"
+            response += f"#{note['id']} - {note['snippet']}\n\n"
 
         bot.reply_to(message, response, parse_mode='HTML')
 
@@ -154,6 +153,8 @@ def edit_note_handler(message):
         else:
             bot.reply_to(message, f"❌ Заметка #{note_id} не найдена")
 
+    except sqlite3.IntegrityError:
+        bot.reply_to(message, "❌ Такая заметка уже существует")
     except Exception as e:
         bot.reply_to(message, "❌ Ошибка при редактировании заметки")
         logger.error(f"Error editing note: {e}")
@@ -197,7 +198,10 @@ def count_notes_handler(message):
         if stats:
             response += "Активность за неделю:\n"
             for stat in stats:
-                response += f"{stat['date']}: {stat['count']} заметок\n"
+                response += f"{stat['date']}: {stat['count']} заметок"
+                if stat['edited']:
+                    response += f", правок: {stat['edited']}"
+                response += "\n"
         else:
             response += "За последнюю неделю заметок нет\n"
 
@@ -210,28 +214,26 @@ def count_notes_handler(message):
 
 @bot.message_handler(commands=['note_export'])
 def export_notes_handler(message):
-    """Экспорт заметок в файл"""
+    """Экспорт заметок в файл: /note_export [txt|csv|jsonl] [gz]"""
     try:
-        notes = db.export_notes(message.from_user.id)
-        if not notes:
+        args = message.text.split()[1:]
+        fmt = next((a for a in args if a in EXPORT_FORMATS), "txt")
+        compress = "gz" in args
+
+        if db.count_notes(message.from_user.id) == 0:
             bot.reply_to(message, "📝 У вас пока нет заметок для экспорта")
             return
 
-        # Создание текстового файла
-        filename = f"notes_{message.from_user.id}.txt"
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(f"Экспорт заметок пользователя {message.from_user.first_name}\n")
-            f.write(f"Всего заметок: {len(notes)}\n")
-            f.write("=" * 50 + "\n\n")
-
-            for note in notes:
-                f.write(f"#{note['id']} - {note['text']}\n")
-                f.write(f"Создано: {note['created_at']}\n")
-                f.write("-" * 30 + "\n")
-
-        # Отправка файла
-        with open(filename, 'rb') as f:
-            bot.send_document(message.chat.id, f, caption="📁 Ваши заметки")
+        export = export_notes(
+            message.from_user.id, fmt, compress,
+            title=f"Экспорт заметок пользователя {message.from_user.first_name}"
+        )
+        with export.file:
+            bot.send_document(
+                message.chat.id, export.file,
+                visible_file_name=export.filename,
+                caption=f"📁 Ваши заметки ({export.count})"
+            )
 
         logger.info(f"Notes exported for user {message.from_user.id}")
 
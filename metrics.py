@@ -0,0 +1,267 @@
+"""
+Метрики бота: счётчики и гистограммы задержек.
+
+Счётчики шардированы по потокам: каждый поток увеличивает свою ячейку без
+блокировок, а значение собирается суммой ячеек при чтении. Задержки
+раскладываются по фиксированным корзинам, из которых оцениваются p50, p95
+и p99 - память не растёт с числом наблюдений.
+
+Метрики могут иметь метки (например, command="ask" или model="..."):
+каждый набор меток - отдельный ряд в реестре. Мгновенные значения (глубина
+очередей, доля попаданий в кэш) не хранятся, а собираются функциями-
+сборщиками в момент снятия снимка.
+"""
+
+import time
+import bisect
+import inspect
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограммы, мс; последняя корзина - всё, что больше
+DEFAULT_BUCKETS_MS = (
+    1, 2, 5, 10, 25, 50, 100, 250, 500,
+    1000, 2500, 5000, 10000, 20000, 30000, 60000
+)
+
+LabelsKey = Tuple[Tuple[str, str], ...]
+
+
+def _labels_key(labels: Dict[str, object]) -> LabelsKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def series_name(name: str, labels: Dict[str, object]) -> str:
+    """Имя ряда в формате Prometheus: name{k="v",...}."""
+    if not labels:
+        return name
+    inner = ",".join(f'{k}="{_escape_label(str(v))}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{inner}}}"
+
+
+class Counter:
+    """Монотонный счётчик с ячейкой на каждый поток."""
+
+    def __init__(self, name: str, labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.labels = dict(labels or {})
+        self._local = threading.local()
+        self._cells = []
+        self._lock = threading.Lock()
+
+    def _cell(self) -> list:
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = [0]
+            with self._lock:
+                self._cells.append(cell)
+            self._local.cell = cell
+            return cell
+
+    def inc(self, amount: int = 1):
+        if amount < 0:
+            raise ValueError("количество должно быть >= 0")
+        # Ячейку пишет только её поток, поэтому блокировка не нужна
+        self._cell()[0] += amount
+
+    def get(self) -> int:
+        return sum(cell[0] for cell in list(self._cells))
+
+
+class LatencyStats:
+    """Агрегаты задержек и гистограмма с фиксированными корзинами."""
+
+    def __init__(self, buckets_ms: Tuple[float, ...] = DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self._bucket_counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total_ms = 0
+        self.min_ms = 0
+        self.max_ms = 0
+        self._lock = threading.Lock()
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+    def observe(self, value_ms: float):
+        index = bisect.bisect_left(self.buckets_ms, value_ms)
+        with self._lock:
+            if self.count == 0:
+                self.min_ms = self.max_ms = value_ms
+            else:
+                self.min_ms = min(self.min_ms, value_ms)
+                self.max_ms = max(self.max_ms, value_ms)
+            self.count += 1
+            self.total_ms += value_ms
+            self._bucket_counts[index] += 1
+
+    def _percentile(self, q: float) -> float:
+        """Оценка перцентиля линейной интерполяцией внутри корзины (под блокировкой)."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self._bucket_counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.buckets_ms[i - 1] if i > 0 else 0
+                upper = self.buckets_ms[i] if i < len(self.buckets_ms) else self.max_ms
+                value = lower + (upper - lower) * (rank - cumulative) / bucket_count
+                return float(min(max(value, self.min_ms), self.max_ms))
+            cumulative += bucket_count
+        return float(self.max_ms)
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            return self._percentile(q)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "count": self.count,
+                "total_ms": self.total_ms,
+                "min_ms": self.min_ms,
+                "max_ms": self.max_ms,
+                "avg_ms": self.avg_ms,
+                "p50_ms": self._percentile(0.50),
+                "p95_ms": self._percentile(0.95),
+                "p99_ms": self._percentile(0.99),
+                "buckets": dict(zip(self.buckets_ms + (float("inf"),), self._bucket_counts))
+            }
+
+
+class LatencyMetric(LatencyStats):
+    """Именованная гистограмма задержек."""
+
+    def __init__(
+            self,
+            name: str,
+            labels: Optional[Dict[str, str]] = None,
+            buckets_ms: Tuple[float, ...] = DEFAULT_BUCKETS_MS
+    ):
+        super().__init__(buckets_ms)
+        self.name = name
+        self.labels = dict(labels or {})
+
+    @contextmanager
+    def time(self):
+        """Замеряет время выполнения блока with."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe((time.perf_counter() - start) * 1000)
+
+
+class MetricsRegistry:
+    """Реестр метрик; одна метрика на пару (имя, метки)."""
+
+    def __init__(self):
+        self._counters: Dict[Tuple[str, LabelsKey], Counter] = {}
+        self._latencies: Dict[Tuple[str, LabelsKey], LatencyMetric] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, float]]] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, **labels) -> Counter:
+        key = (name, _labels_key(labels))
+        counter = self._counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(key, Counter(name, dict(key[1])))
+        return counter
+
+    def latency(self, name: str, **labels) -> LatencyMetric:
+        key = (name, _labels_key(labels))
+        latency = self._latencies.get(key)
+        if latency is None:
+            with self._lock:
+                latency = self._latencies.setdefault(key, LatencyMetric(name, dict(key[1])))
+        return latency
+
+    def register_collector(self, name: str, collector: Callable[[], Dict[str, float]]):
+        """
+        Регистрирует сборщик мгновенных значений (gauge).
+
+        collector() возвращает {имя ряда: значение}; имена рядов строятся
+        через series_name. Повторная регистрация с тем же name заменяет сборщик.
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def _collect_gauges(self) -> Dict[str, float]:
+        gauges = {}
+        for name, collector in list(self._collectors.items()):
+            try:
+                gauges.update(collector())
+            except Exception as e:
+                logger.warning(f"Сборщик метрик {name} завершился с ошибкой: {e}")
+        return gauges
+
+    def snapshot(self) -> dict:
+        """Текущие значения всех метрик, ключи - имена рядов (см. series_name)."""
+        return {
+            "counters": {
+                series_name(c.name, c.labels): c.get() for c in list(self._counters.values())
+            },
+            "latencies": {
+                series_name(l.name, l.labels): l.snapshot() for l in list(self._latencies.values())
+            },
+            "gauges": self._collect_gauges()
+        }
+
+
+# Глобальный реестр процесса
+metric = MetricsRegistry()
+
+
+def timed(
+        name: str,
+        logger: Optional[logging.Logger] = None,
+        registry: Optional[MetricsRegistry] = None,
+        **labels
+):
+    """
+    Декоратор: записывает длительность вызова функции в гистограмму name.
+
+    Работает и с обычными функциями, и с корутинами. Время пишется и при
+    исключении. Если передан logger, длительность дополнительно пишется в debug.
+    """
+    def decorator(func):
+        def observe(start: float):
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            (registry or metric).latency(name, **labels).observe(elapsed_ms)
+            if logger is not None:
+                logger.debug(f"{name}: {elapsed_ms:.1f} мс")
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe(start)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(start)
+
+        return wrapper
+
+    return decorator
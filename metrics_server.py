@@ -0,0 +1,146 @@
+"""
+HTTP-эндпоинт /metrics в текстовом формате OpenMetrics.
+
+Сервер работает в том же event loop, что и бот, и по умолчанию слушает
+только localhost. Снимок реестра отрисовывается не чаще раза в
+METRICS_CACHE_S секунд, поэтому частый опрос Prometheus не нагружает бота.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from http_server import HttpError, read_request, write_response, MAX_HEADER_BYTES
+from metrics import MetricsRegistry, metric
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# 0 - бот не запускает эндпоинт
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_CACHE_S = float(os.getenv("METRICS_CACHE_S", "1.0"))
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+REQUEST_TIMEOUT_S = 5.0
+
+
+def _split_series(series: str) -> Tuple[str, str]:
+    """'name{a="b"}' -> ('name', 'a="b"')."""
+    brace = series.find("{")
+    if brace < 0:
+        return series, ""
+    return series[:brace], series[brace + 1:-1]
+
+
+def _with_labels(name: str, labels: str, extra: str = "") -> str:
+    inner = ",".join(part for part in (labels, extra) if part)
+    return f"{name}{{{inner}}}" if inner else name
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_openmetrics(snapshot: dict) -> str:
+    """Отрисовывает MetricsRegistry.snapshot() в формате OpenMetrics."""
+    families: Dict[str, Tuple[str, list]] = {}
+
+    def family(name: str, kind: str) -> list:
+        if name not in families:
+            families[name] = (kind, [])
+        return families[name][1]
+
+    for series, value in snapshot.get("counters", {}).items():
+        name, labels = _split_series(series)
+        base = name[:-len("_total")] if name.endswith("_total") else name
+        family(base, "counter").append(f"{_with_labels(base + '_total', labels)} {_format_value(value)}")
+
+    for series, value in snapshot.get("gauges", {}).items():
+        name, labels = _split_series(series)
+        family(name, "gauge").append(f"{_with_labels(name, labels)} {_format_value(value)}")
+
+    for series, stats in snapshot.get("latencies", {}).items():
+        name, labels = _split_series(series)
+        lines = family(name, "histogram")
+        cumulative = 0
+        for bound, bucket_count in stats["buckets"].items():
+            cumulative += bucket_count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f"{_with_labels(name + '_bucket', labels, le)} {cumulative}")
+        lines.append(f"{_with_labels(name + '_count', labels)} {stats['count']}")
+        lines.append(f"{_with_labels(name + '_sum', labels)} {_format_value(float(stats['total_ms']))}")
+
+    out = []
+    for name in sorted(families):
+        kind, lines = families[name]
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(lines)
+    out.append("# EOF")
+    return "\n".join(out) + "\n"
+
+
+class MetricsServer:
+    """Минимальный HTTP-сервер, отдающий GET /metrics."""
+
+    def __init__(
+            self,
+            registry: MetricsRegistry = metric,
+            host: str = METRICS_HOST,
+            port: int = METRICS_PORT,
+            cache_s: float = METRICS_CACHE_S
+    ):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.cache_s = cache_s
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._body = b""
+        self._rendered_at = 0.0
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._handle, self.host, self.port, limit=MAX_HEADER_BYTES
+        )
+        # При port=0 ОС выбирает свободный порт
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def render(self) -> bytes:
+        now = time.monotonic()
+        if not self._body or now - self._rendered_at >= self.cache_s:
+            self._body = render_openmetrics(self.registry.snapshot()).encode("utf-8")
+            self._rendered_at = now
+        return self._body
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await read_request(reader, timeout_s=REQUEST_TIMEOUT_S)
+            if request is None:
+                return
+            if request.method != "GET":
+                write_response(writer, 405)
+            elif request.path != "/metrics":
+                write_response(writer, 404)
+            else:
+                write_response(writer, 200, self.render(), CONTENT_TYPE)
+            await writer.drain()
+        except HttpError as e:
+            write_response(writer, e.status)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        except ConnectionError as e:
+            logger.debug(f"Клиент метрик отключился: {e}")
+        finally:
+            writer.close()
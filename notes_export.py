@@ -0,0 +1,96 @@
+"""
+Потоковый экспорт заметок.
+
+Заметки читаются из БД порциями (db.export_notes) и сразу пишутся в
+SpooledTemporaryFile: небольшой экспорт целиком остаётся в памяти, а
+большой переезжает в анонимный временный файл, который удаляется при
+закрытии и не виден другим экспортам. Память не зависит от числа заметок.
+"""
+
+import io
+import os
+import csv
+import gzip
+import json
+import tempfile
+from typing import IO, NamedTuple
+
+import db
+
+EXPORT_FORMATS = ("txt", "csv", "jsonl")
+# Сколько байт экспорта держать в памяти, прежде чем перейти на диск
+EXPORT_SPOOL_BYTES = int(os.getenv("NOTES_EXPORT_SPOOL_BYTES", str(1024 * 1024)))
+EXPORT_CHUNK_ROWS = int(os.getenv("NOTES_EXPORT_CHUNK_ROWS", "1000"))
+
+_FIELDS = ("id", "text", "created_at", "updated_at")
+
+
+class NotesExport(NamedTuple):
+    file: IO[bytes]
+    filename: str
+    count: int
+
+
+def _write_txt(out: io.TextIOBase, notes, title: str, total: int) -> int:
+    out.write(f"{title}\n")
+    out.write(f"Всего заметок: {total}\n")
+    out.write("=" * 50 + "\n\n")
+    count = 0
+    for note in notes:
+        out.write(f"#{note['id']} - {note['text']}\n")
+        out.write(f"Создано: {note['created_at']}\n")
+        out.write("-" * 30 + "\n")
+        count += 1
+    return count
+
+
+def _write_csv(out: io.TextIOBase, notes, title: str, total: int) -> int:
+    writer = csv.DictWriter(out, fieldnames=_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    count = 0
+    for note in notes:
+        writer.writerow(note)
+        count += 1
+    return count
+
+
+def _write_jsonl(out: io.TextIOBase, notes, title: str, total: int) -> int:
+    count = 0
+    for note in notes:
+        out.write(json.dumps({field: note[field] for field in _FIELDS}, ensure_ascii=False))
+        out.write("\n")
+        count += 1
+    return count
+
+
+_WRITERS = {"txt": _write_txt, "csv": _write_csv, "jsonl": _write_jsonl}
+
+
+def export_notes(user_id: int, fmt: str = "txt", compress: bool = False, title: str = "") -> NotesExport:
+    """
+    Собирает экспорт заметок пользователя; file спозиционирован в начало.
+
+    Вызывающий закрывает file после отправки. fmt - один из EXPORT_FORMATS,
+    compress - сжать gzip.
+    """
+    if fmt not in _WRITERS:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES, mode="w+b")
+    try:
+        raw = gzip.GzipFile(fileobj=spool, mode="wb") if compress else spool
+        # newline="" - csv сам пишет переводы строк
+        out = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        total = db.count_notes(user_id) if fmt == "txt" else 0
+        count = _WRITERS[fmt](out, db.export_notes(user_id, EXPORT_CHUNK_ROWS), title, total)
+        out.flush()
+        out.detach()
+        if compress:
+            raw.close()  # дописывает хвост gzip, spool остаётся открытым
+        spool.seek(0)
+    except Exception:
+        spool.close()
+        raise
+
+    filename = f"notes_{user_id}.{fmt}" + (".gz" if compress else "")
+    return NotesExport(spool, filename, count)
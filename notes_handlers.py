@@ -0,0 +1,277 @@
+"""
+Команды заметок (/note_*) для Application из main.py.
+
+Асинхронный перенос обработчиков main3.py: хранилище то же (функции
+заметок в db.py), а запросы к БД и сборка экспорта выполняются в
+отдельном пуле потоков, поэтому медленная операция с заметками не
+задерживает ни другие команды заметок, ни запросы к моделям в том же
+event loop.
+
+Подключение: notes_handlers.register(application); меню команд - COMMANDS.
+"""
+
+import os
+import html
+import time
+import sqlite3
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from telegram import InputFile, Update
+from telegram.ext import Application, CommandHandler, ContextTypes
+
+import db
+from metrics import metric, timed
+from notes_export import EXPORT_FORMATS, export_notes
+
+logger = logging.getLogger(__name__)
+
+NOTES_DB_WORKERS = int(os.getenv("NOTES_DB_WORKERS", str(db.NOTES_POOL_SIZE)))
+NOTE_MAX_LENGTH = 200
+NOTES_PAGE_SIZE = 10
+
+COMMANDS = [
+    ("note_add", "Добавить заметку"),
+    ("note_list", "Список заметок"),
+    ("note_find", "Поиск заметок"),
+    ("note_edit", "Редактировать заметку"),
+    ("note_del", "Удалить заметку"),
+    ("note_count", "Статистика заметок"),
+    ("note_export", "Экспорт заметок"),
+]
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+async def _run(name: str, func, *args):
+    """Выполняет операцию с заметками в пуле потоков и замеряет её время."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=NOTES_DB_WORKERS, thread_name_prefix="notes-db")
+
+    def timed_call():
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            metric.latency("db_query_ms", query=name).observe((time.perf_counter() - started) * 1000)
+
+    return await asyncio.get_running_loop().run_in_executor(_executor, timed_call)
+
+
+def _command_text(update: Update) -> str:
+    """Текст после команды с сохранением переводов строк."""
+    parts = (update.message.text or "").split(maxsplit=1)
+    return parts[1].strip() if len(parts) > 1 else ""
+
+
+def _parse_id(value: str) -> Optional[int]:
+    return int(value) if value.isdigit() else None
+
+
+@timed("handler_latency_ms", command="note_add")
+async def note_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Добавление новой заметки"""
+    text = _command_text(update)
+    if not text:
+        await update.message.reply_text("❌ Использование: /note_add <текст заметки>")
+        return
+    if len(text) > NOTE_MAX_LENGTH:
+        await update.message.reply_text(f"❌ Заметка слишком длинная (макс. {NOTE_MAX_LENGTH} символов)")
+        return
+
+    try:
+        note_id = await _run("add_note", db.add_note, update.effective_user.id, text)
+        await update.message.reply_text(f"✅ Заметка #{note_id} добавлена!")
+    except sqlite3.IntegrityError:
+        await update.message.reply_text("❌ Такая заметка уже существует")
+    except Exception as e:
+        logger.error(f"Ошибка в note_add: {e}")
+        await update.message.reply_text("❌ Ошибка при добавлении заметки")
+
+
+@timed("handler_latency_ms", command="note_list")
+async def note_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Последние заметки; /note_list <id> - заметки старше указанной"""
+    before_id = _parse_id(context.args[0]) if context.args else None
+    try:
+        notes = await _run(
+            "list_notes", db.list_notes, update.effective_user.id, NOTES_PAGE_SIZE, before_id
+        )
+        if not notes:
+            await update.message.reply_text(
+                "📝 Больше заметок нет" if before_id else "📝 У вас пока нет заметок"
+            )
+            return
+
+        response = "📋 <b>Ваши последние заметки:</b>\n\n"
+        for note in notes:
+            response += f"#{note['id']} - {html.escape(note['text'])}\n"
+            response += f"<i>{note['created_at']}</i>\n\n"
+        if len(notes) == NOTES_PAGE_SIZE:
+            response += f"Дальше: /note_list {notes[-1]['id']}"
+
+        await update.message.reply_text(response, parse_mode='HTML')
+    except Exception as e:
+        logger.error(f"Ошибка в note_list: {e}")
+        await update.message.reply_text("❌ Ошибка при получении заметок")
+
+
+@timed("handler_latency_ms", command="note_find")
+async def note_find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Полнотекстовый поиск по заметкам"""
+    query = _command_text(update)
+    if not query:
+        await update.message.reply_text("❌ Использование: /note_find <запрос>")
+        return
+
+    try:
+        notes = await _run("find_notes", db.find_notes, update.effective_user.id, query, NOTES_PAGE_SIZE)
+        if not notes:
+            await update.message.reply_text(f"🔍 По запросу '{query}' ничего не найдено")
+            return
+
+        response = f"🔍 <b>Результаты поиска '{html.escape(query)}':</b>\n\n"
+        for note in notes:
+            response += f"#{note['id']} - {note['snippet']}\n\n"
+
+        await update.message.reply_text(response, parse_mode='HTML')
+    except Exception as e:
+        logger.error(f"Ошибка в note_find: {e}")
+        await update.message.reply_text("❌ Ошибка при поиске заметок")
+
+
+@timed("handler_latency_ms", command="note_edit")
+async def note_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Редактирование заметки"""
+    parts = _command_text(update).split(maxsplit=1)
+    if len(parts) < 2:
+        await update.message.reply_text("❌ Использование: /note_edit <id> <новый текст>")
+        return
+
+    note_id, new_text = _parse_id(parts[0]), parts[1]
+    if note_id is None:
+        await update.message.reply_text("❌ ID заметки должен быть числом")
+        return
+    if len(new_text) > NOTE_MAX_LENGTH:
+        await update.message.reply_text(f"❌ Заметка слишком длинная (макс. {NOTE_MAX_LENGTH} символов)")
+        return
+
+    try:
+        success = await _run("update_note", db.update_note, update.effective_user.id, note_id, new_text)
+        if success:
+            await update.message.reply_text(f"✅ Заметка #{note_id} обновлена!")
+        else:
+            await update.message.reply_text(f"❌ Заметка #{note_id} не найдена")
+    except sqlite3.IntegrityError:
+        await update.message.reply_text("❌ Такая заметка уже существует")
+    except Exception as e:
+        logger.error(f"Ошибка в note_edit: {e}")
+        await update.message.reply_text("❌ Ошибка при редактировании заметки")
+
+
+@timed("handler_latency_ms", command="note_del")
+async def note_del(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Удаление заметки"""
+    if not context.args:
+        await update.message.reply_text("❌ Использование: /note_del <id>")
+        return
+
+    note_id = _parse_id(context.args[0])
+    if note_id is None:
+        await update.message.reply_text("❌ ID заметки должен быть числом")
+        return
+
+    try:
+        success = await _run("delete_note", db.delete_note, update.effective_user.id, note_id)
+        if success:
+            await update.message.reply_text(f"✅ Заметка #{note_id} удалена!")
+        else:
+            await update.message.reply_text(f"❌ Заметка #{note_id} не найдена")
+    except Exception as e:
+        logger.error(f"Ошибка в note_del: {e}")
+        await update.message.reply_text("❌ Ошибка при удалении заметки")
+
+
+@timed("handler_latency_ms", command="note_count")
+async def note_count(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Статистика заметок; /note_count <дней> - другое окно активности"""
+    days = max(1, min(int(context.args[0]), 365)) if context.args and context.args[0].isdigit() else 7
+    user_id = update.effective_user.id
+    try:
+        count, stats = await asyncio.gather(
+            _run("count_notes", db.count_notes, user_id),
+            _run("get_notes_statistics", db.get_notes_statistics, user_id, days)
+        )
+
+        response = "📊 *Статистика заметок:*\n\n"
+        response += f"Всего заметок: *{count}*\n\n"
+        if stats:
+            response += f"Активность за {days} дн.:\n"
+            for stat in stats:
+                response += f"{stat['date']}: {stat['count']} заметок"
+                if stat['edited']:
+                    response += f", правок: {stat['edited']}"
+                response += "\n"
+        else:
+            response += f"За последние {days} дн. заметок нет\n"
+
+        await update.message.reply_text(response, parse_mode='Markdown')
+    except Exception as e:
+        logger.error(f"Ошибка в note_count: {e}")
+        await update.message.reply_text("❌ Ошибка при получении статистики")
+
+
+@timed("handler_latency_ms", command="note_export")
+async def note_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Экспорт заметок в файл: /note_export [txt|csv|jsonl] [gz]"""
+    fmt = next((a for a in context.args if a in EXPORT_FORMATS), "txt")
+    compress = "gz" in context.args
+    user = update.effective_user
+
+    try:
+        if await _run("count_notes", db.count_notes, user.id) == 0:
+            await update.message.reply_text("📝 У вас пока нет заметок для экспорта")
+            return
+
+        export = await _run(
+            "export_notes", export_notes, user.id, fmt, compress,
+            f"Экспорт заметок пользователя {user.first_name}"
+        )
+        with export.file:
+            # Пока экспорт в памяти, у SpooledTemporaryFile нет name, и PTB не
+            # должен угадывать имя файла по нему
+            await update.message.reply_document(
+                document=InputFile(export.file, filename=export.filename, read_file_handle=False),
+                caption=f"📁 Ваши заметки ({export.count})"
+            )
+        logger.info(f"Заметки пользователя {user.id} экспортированы ({export.count}, {export.filename})")
+    except Exception as e:
+        logger.error(f"Ошибка в note_export: {e}")
+        await update.message.reply_text("❌ Ошибка при экспорте заметок")
+
+
+def register(application: Application, group: int = 0):
+    """Регистрирует команды заметок в приложении."""
+    application.add_handler(CommandHandler("note_add", note_add), group=group)
+    application.add_handler(CommandHandler("note_list", note_list), group=group)
+    application.add_handler(CommandHandler("note_find", note_find), group=group)
+    application.add_handler(CommandHandler("note_edit", note_edit), group=group)
+    application.add_handler(CommandHandler("note_del", note_del), group=group)
+    application.add_handler(CommandHandler("note_count", note_count), group=group)
+    application.add_handler(CommandHandler("note_export", note_export), group=group)
+
+
+async def init():
+    """Создаёт таблицы заметок (вызывается из post_init)."""
+    await _run("init_db", db.init_db)
+
+
+def close():
+    """Останавливает пул потоков заметок (вызывается из post_shutdown)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
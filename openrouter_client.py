@@ -5,32 +5,315 @@
 import os
 import time
 import json
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+import httpx
 import requests
-from typing import List, Dict, Any, Optional
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Any, Optional, AsyncIterator, Callable, Awaitable
 from dotenv import load_dotenv
 
+from circuit_breaker import CircuitBreakerRegistry
+from metrics import metric
+
 load_dotenv()
 
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# Размер пула соединений и время жизни простаивающего keep-alive соединения
+DEFAULT_POOL_SIZE = int(os.getenv("OPENROUTER_POOL_SIZE", "10"))
+DEFAULT_ASYNC_POOL_SIZE = int(os.getenv("OPENROUTER_ASYNC_POOL_SIZE", "100"))
+DEFAULT_KEEPALIVE_S = float(os.getenv("OPENROUTER_KEEPALIVE_S", "60"))
+
+# Политика повторов: число повторов, база и потолок задержки, общий бюджет времени
+DEFAULT_MAX_RETRIES = int(os.getenv("OPENROUTER_MAX_RETRIES", "2"))
+DEFAULT_RETRY_BASE_S = float(os.getenv("OPENROUTER_RETRY_BASE_S", "0.3"))
+DEFAULT_RETRY_MAX_DELAY_S = float(os.getenv("OPENROUTER_RETRY_MAX_DELAY_S", "4"))
+DEFAULT_RETRY_DEADLINE_S = float(os.getenv("OPENROUTER_RETRY_DEADLINE_S", "60"))
+
+# Статусы, после которых повтор имеет смысл; 400/401/403 и т.п. не повторяются
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+NETWORK_ERROR_MESSAGE = "Ошибка соединения: запрос к OpenRouter API прерван при сетевой ошибке"
+TIMEOUT_ERROR_MESSAGE = "Таймаут запроса к OpenRouter API"
+
 
 class OpenRouterError(Exception):
     """Ошибка работы с OpenRouter API."""
 
-    def __init__(self, message: str, status: int = None):
+    def __init__(
+            self,
+            message: str,
+            status: int = None,
+            retry_after: Optional[float] = None,
+            retryable: Optional[bool] = None
+    ):
         self.message = message
         self.status = status
+        self.retry_after = retry_after
+        self.retryable = status in RETRYABLE_STATUSES if retryable is None else retryable
         super().__init__(f"OpenRouterError (status={status}): {message}")
 
 
+class CircuitOpenError(OpenRouterError):
+    """Выключатель модели разомкнут: запрос отклонён без обращения к API."""
+
+    def __init__(self, model: str):
+        self.model = model
+        super().__init__(f"Модель {model} временно недоступна", retryable=False)
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Значение заголовка Retry-After (секунды или HTTP-дата) в секундах."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Повторы запросов с экспоненциальной задержкой и полным джиттером.
+
+    Повторяются только временные сбои (429, 5xx, таймауты, сетевые ошибки).
+    Retry-After от сервера увеличивает задержку, а общий бюджет deadline_s
+    ограничивает суммарное время всех попыток.
+    """
+
+    def __init__(
+            self,
+            max_retries: int = DEFAULT_MAX_RETRIES,
+            base_delay_s: float = DEFAULT_RETRY_BASE_S,
+            max_delay_s: float = DEFAULT_RETRY_MAX_DELAY_S,
+            deadline_s: float = DEFAULT_RETRY_DEADLINE_S
+    ):
+        self.max_retries = max_retries
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.deadline_s = deadline_s
+        self._stats = {"requests": 0, "retries": 0, "gave_up": 0, "retry_sleep_s": 0.0}
+        self._lock = threading.Lock()
+
+    def _count(self, key: str, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def stats(self) -> Dict[str, Any]:
+        """Число запросов, повторов, отказов после повторов и время ожидания."""
+        with self._lock:
+            return dict(self._stats)
+
+    def begin(self) -> float:
+        """Отмечает начало запроса; возвращает момент старта для отсчёта бюджета."""
+        self._count("requests")
+        return time.monotonic()
+
+    def attempt_timeout(self, timeout_s: float, started: float) -> float:
+        """Таймаут очередной попытки с учётом оставшегося бюджета."""
+        remaining = self.deadline_s - (time.monotonic() - started)
+        return max(0.1, min(timeout_s, remaining))
+
+    def next_delay(self, attempt: int, error: OpenRouterError, started: float) -> Optional[float]:
+        """Задержка перед повтором номер attempt + 1 или None, если повторять нельзя."""
+        if not error.retryable:
+            return None
+
+        delay = random.uniform(0, min(self.max_delay_s, self.base_delay_s * 2 ** attempt))
+        if error.retry_after is not None:
+            delay = max(delay, error.retry_after)
+
+        elapsed = time.monotonic() - started
+        if attempt >= self.max_retries or elapsed + delay >= self.deadline_s:
+            self._count("gave_up")
+            return None
+
+        self._count("retries")
+        self._count("retry_sleep_s", delay)
+        return delay
+
+    def call(self, func: Callable[[float], Any], timeout_s: float):
+        """Вызывает func(timeout) с повторами."""
+        started = self.begin()
+        attempt = 0
+        while True:
+            try:
+                return func(self.attempt_timeout(timeout_s, started))
+            except OpenRouterError as e:
+                delay = self.next_delay(attempt, e, started)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, func: Callable[[float], Awaitable], timeout_s: float):
+        """Асинхронный вариант call()."""
+        started = self.begin()
+        attempt = 0
+        while True:
+            try:
+                return await func(self.attempt_timeout(timeout_s, started))
+            except OpenRouterError as e:
+                delay = self.next_delay(attempt, e, started)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def _build_headers(api_key: str) -> Dict[str, str]:
+    """Заголовки запроса к OpenRouter API."""
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://github.com/yourusername/telegram-ai-bot",
+        "X-Title": "Telegram AI Bot"
+    }
+
+
+def _build_payload(
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int
+) -> Dict[str, Any]:
+    """Тело запроса /chat/completions."""
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        # Учёт использования OpenRouter: стоимость запроса в usage.cost
+        "usage": {"include": True}
+    }
+
+
+def _error_message(response) -> str:
+    """Извлекает текст ошибки из ответа API (JSON или сырой текст)."""
+    try:
+        error_data = response.json().get("error", {})
+    except ValueError:
+        return response.text
+    return error_data.get("message", response.text)
+
+
+def _http_error(response) -> OpenRouterError:
+    """Ошибка для ответа с кодом, отличным от 200."""
+    return OpenRouterError(
+        _error_message(response),
+        response.status_code,
+        retry_after=_parse_retry_after(response.headers.get("Retry-After"))
+    )
+
+
+def _parse_completion(data: Dict[str, Any], model: str, latency_ms: int) -> Dict[str, Any]:
+    """Преобразует ответ /chat/completions в словарь результата."""
+    if "choices" not in data or not data["choices"]:
+        raise OpenRouterError("Получен пустой ответ от API")
+
+    return {
+        "text": data["choices"][0]["message"]["content"],
+        "latency_ms": latency_ms,
+        "model": model,
+        "usage": data.get("usage", {})
+    }
+
+
+_SSE_DONE = object()
+
+
+class _SSEUsage(dict):
+    """Статистика токенов из завершающего фрагмента потока."""
+
+
+def _parse_sse_line(line: str):
+    """
+    Разбирает строку SSE-потока OpenRouter.
+
+    Возвращает фрагмент текста, _SSE_DONE для "data: [DONE]", _SSEUsage
+    для фрагмента со статистикой токенов или None для служебных и пустых строк.
+    """
+    if not line.startswith("data:"):
+        # Пустые строки-разделители и комментарии (": OPENROUTER PROCESSING")
+        return None
+
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return _SSE_DONE
+
+    chunk = json.loads(data)
+    if "error" in chunk:
+        error = chunk["error"]
+        raise OpenRouterError(error.get("message", str(error)), error.get("code"))
+
+    choices = chunk.get("choices") or []
+    content = choices[0].get("delta", {}).get("content") if choices else None
+    if not content and chunk.get("usage"):
+        return _SSEUsage(chunk["usage"])
+    return content or None
+
+
+def _record_usage(model: str, usage: Dict[str, Any]):
+    """Считает токены запроса по модели."""
+    for kind in ("prompt", "completion"):
+        tokens = usage.get(f"{kind}_tokens")
+        if tokens:
+            metric.counter("openrouter_tokens_total", model=model, type=kind).inc(int(tokens))
+
+
+def _record_call(model: str, started: float, error: Optional[OpenRouterError] = None):
+    """Пишет итог запроса (с учётом повторов) в метрики модели."""
+    if error is None:
+        metric.counter("openrouter_requests_total", model=model, status="ok").inc()
+        metric.latency("openrouter_latency_ms", model=model).observe((time.monotonic() - started) * 1000)
+    else:
+        metric.counter("openrouter_requests_total", model=model, status="error").inc()
+
+
+def _record_failure(breaker, error: OpenRouterError):
+    """Ошибки клиента (400 и т.п.) не говорят о здоровье модели и не учитываются."""
+    if error.retryable:
+        breaker.record_failure()
+    else:
+        breaker.release()
+
+
 class OpenRouterClient:
-    """Клиент для взаимодействия с OpenRouter API."""
+    """
+    Клиент для взаимодействия с OpenRouter API.
 
-    def __init__(self):
+    Держит долгоживущую requests.Session с пулом keep-alive соединений,
+    чтобы не платить за TCP- и TLS-рукопожатие на каждый запрос.
+    """
+
+    def __init__(
+            self,
+            pool_size: Optional[int] = None,
+            retry_policy: Optional[RetryPolicy] = None,
+            breakers: Optional[CircuitBreakerRegistry] = None
+    ):
         self.api_key = os.getenv("OPENROUTER_API_KEY")
-        self.base_url = "https://openrouter.ai/api/v1"
+        self.base_url = OPENROUTER_BASE_URL
+        self.pool_size = pool_size or DEFAULT_POOL_SIZE
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breakers = breakers or CircuitBreakerRegistry()
 
         if not self.api_key:
             raise ValueError("OPENROUTER_API_KEY не найден в переменных окружения")
 
+        self.session = requests.Session()
+        self.session.headers.update(_build_headers(self.api_key))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
     def generate_response(
             self,
             model: str,
@@ -51,57 +334,298 @@ class OpenRouterClient:
 
         Returns:
             Словарь с ответом или ошибкой
+
+        Если выключатель модели разомкнут, сразу выбрасывается CircuitOpenError.
         """
+        breaker = self.breakers.get(model)
+        if not breaker.allow():
+            raise CircuitOpenError(model)
+
+        payload = _build_payload(model, messages, temperature, max_tokens)
+        started = time.monotonic()
+        try:
+            result = self.retry_policy.call(
+                lambda timeout: self._post_once(model, payload, timeout), timeout_s
+            )
+        except OpenRouterError as e:
+            _record_failure(breaker, e)
+            _record_call(model, started, e)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+
+        breaker.record_success(time.monotonic() - started)
+        _record_call(model, started)
+        _record_usage(model, result["usage"])
+        return result
+
+    def _post_once(self, model: str, payload: Dict[str, Any], timeout_s: float) -> Dict[str, Any]:
+        """Одна попытка запроса без повторов."""
         try:
             start_time = time.time()
 
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": "https://github.com/yourusername/telegram-ai-bot",
-                    "X-Title": "Telegram AI Bot"
-                },
-                json={
-                    "model": model,
-                    "messages": messages,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens
-                },
+                json=payload,
                 timeout=timeout_s
             )
 
             latency_ms = int((time.time() - start_time) * 1000)
 
             if response.status_code != 200:
-                error_data = response.json().get("error", {})
-                error_message = error_data.get("message", response.text)
-                raise OpenRouterError(error_message, response.status_code)
+                raise _http_error(response)
 
-            data = response.json()
+            return _parse_completion(response.json(), model, latency_ms)
 
-            if "choices" not in data or not data["choices"]:
-                raise OpenRouterError("Пустой ответ от API")
+        except OpenRouterError:
+            raise
+        except requests.exceptions.Timeout:
+            raise OpenRouterError(TIMEOUT_ERROR_MESSAGE, retryable=True)
+        except json.JSONDecodeError:
+            raise OpenRouterError("Невалидный JSON в ответе от API")
+        except OSError:
+            # requests.ConnectionError и прочие сбои сокета
+            raise OpenRouterError(NETWORK_ERROR_MESSAGE, retryable=True)
+        except Exception as e:
+            raise OpenRouterError(f"Неизвестная ошибка: {str(e)}")
 
-            content = data["choices"][0]["message"]["content"]
+    def close(self):
+        """Закрывает пул соединений."""
+        self.session.close()
 
-            return {
-                "text": content,
-                "latency_ms": latency_ms,
-                "model": model,
-                "usage": data.get("usage", {})
-            }
 
-        except requests.exceptions.Timeout:
-            raise OpenRouterError("Таймаут запроса к OpenRouter API")
-        except requests.exceptions.ConnectionError:
-            raise OpenRouterError("Ошибка соединения с OpenRouter API")
+class AsyncOpenRouterClient:
+    """
+    Асинхронный клиент OpenRouter API.
+
+    Все запросы идут через общий httpx.AsyncClient с пулом keep-alive
+    соединений, поэтому медленная модель не блокирует event loop и другие чаты.
+    """
+
+    def __init__(
+            self,
+            pool_size: Optional[int] = None,
+            keepalive_s: Optional[float] = None,
+            retry_policy: Optional[RetryPolicy] = None,
+            breakers: Optional[CircuitBreakerRegistry] = None
+    ):
+        self.api_key = os.getenv("OPENROUTER_API_KEY")
+        self.base_url = OPENROUTER_BASE_URL
+        self.pool_size = pool_size or DEFAULT_ASYNC_POOL_SIZE
+        self.keepalive_s = keepalive_s if keepalive_s is not None else DEFAULT_KEEPALIVE_S
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breakers = breakers or CircuitBreakerRegistry()
+        self._client: Optional[httpx.AsyncClient] = None
+
+        if not self.api_key:
+            raise ValueError("OPENROUTER_API_KEY не найден в переменных окружения")
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Возвращает общую HTTP-сессию, создавая её при первом обращении."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=_build_headers(self.api_key),
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=self.keepalive_s
+                )
+            )
+        return self._client
+
+    async def generate_response(
+            self,
+            model: str,
+            messages: List[Dict[str, str]],
+            temperature: float = 0.7,
+            max_tokens: int = 400,
+            timeout_s: int = 30
+    ) -> Dict[str, Any]:
+        """
+        Асинхронно генерирует ответ от модели через OpenRouter API.
+
+        Аргументы и результат совпадают с OpenRouterClient.generate_response.
+        Если выключатель модели разомкнут, сразу выбрасывается CircuitOpenError.
+        """
+        breaker = self.breakers.get(model)
+        if not breaker.allow():
+            raise CircuitOpenError(model)
+
+        payload = _build_payload(model, messages, temperature, max_tokens)
+        started = time.monotonic()
+        try:
+            result = await self.retry_policy.acall(
+                lambda timeout: self._post_once(model, payload, timeout), timeout_s
+            )
+        except OpenRouterError as e:
+            _record_failure(breaker, e)
+            _record_call(model, started, e)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+
+        breaker.record_success(time.monotonic() - started)
+        _record_call(model, started)
+        _record_usage(model, result["usage"])
+        return result
+
+    async def _post_once(self, model: str, payload: Dict[str, Any], timeout_s: float) -> Dict[str, Any]:
+        """Одна попытка запроса без повторов."""
+        try:
+            start_time = time.time()
+
+            response = await self._get_client().post(
+                "/chat/completions",
+                json=payload,
+                timeout=timeout_s
+            )
+
+            latency_ms = int((time.time() - start_time) * 1000)
+
+            if response.status_code != 200:
+                raise _http_error(response)
+
+            return _parse_completion(response.json(), model, latency_ms)
+
+        except OpenRouterError:
+            raise
+        except httpx.TimeoutException:
+            raise OpenRouterError(TIMEOUT_ERROR_MESSAGE, retryable=True)
+        except httpx.TransportError:
+            raise OpenRouterError(NETWORK_ERROR_MESSAGE, retryable=True)
         except json.JSONDecodeError:
             raise OpenRouterError("Невалидный JSON в ответе от API")
         except Exception as e:
             raise OpenRouterError(f"Неизвестная ошибка: {str(e)}")
 
+    async def stream_response(
+            self,
+            model: str,
+            messages: List[Dict[str, str]],
+            temperature: float = 0.7,
+            max_tokens: int = 400,
+            timeout_s: int = 30,
+            usage: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Потоковая генерация ответа (SSE, "stream": true).
+
+        Асинхронный генератор, отдающий фрагменты текста по мере их прихода.
+        Аргументы совпадают с generate_response. Повтор возможен только до
+        первого полученного фрагмента - иначе пользователь увидел бы текст дважды.
+        Для выключателя задержкой считается время до первого фрагмента.
+        Если передан словарь usage, в него записывается статистика токенов
+        из завершающего фрагмента потока.
+        """
+        breaker = self.breakers.get(model)
+        if not breaker.allow():
+            raise CircuitOpenError(model)
+
+        payload = _build_payload(model, messages, temperature, max_tokens)
+        payload["stream"] = True
+
+        policy = self.retry_policy
+        started = policy.begin()
+        attempt = 0
+        recorded = False
+        try:
+            while True:
+                received = False
+                try:
+                    async for delta in self._stream_once(
+                            payload, policy.attempt_timeout(timeout_s, started), usage
+                    ):
+                        if not received:
+                            received = True
+                            if not recorded:
+                                breaker.record_success(time.monotonic() - started)
+                                metric.latency("openrouter_ttft_ms", model=model).observe(
+                                    (time.monotonic() - started) * 1000
+                                )
+                                recorded = True
+                        yield delta
+                    _record_call(model, started)
+                    return
+                except OpenRouterError as e:
+                    delay = None if received else policy.next_delay(attempt, e, started)
+                    if delay is None:
+                        if not recorded:
+                            _record_failure(breaker, e)
+                            recorded = True
+                        _record_call(model, started, e)
+                        raise
+                await asyncio.sleep(delay)
+                attempt += 1
+        finally:
+            if not recorded:
+                breaker.release()
+
+    async def _stream_once(
+            self,
+            payload: Dict[str, Any],
+            timeout_s: float,
+            usage: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """Одна попытка потокового запроса без повторов."""
+        received = False
+
+        try:
+            async with self._get_client().stream(
+                    "POST", "/chat/completions", json=payload, timeout=timeout_s
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise _http_error(response)
+
+                async for line in response.aiter_lines():
+                    delta = _parse_sse_line(line)
+                    if delta is None:
+                        continue
+                    if delta is _SSE_DONE:
+                        break
+                    if isinstance(delta, _SSEUsage):
+                        _record_usage(payload["model"], delta)
+                        if usage is not None:
+                            usage.update(delta)
+                        continue
+                    received = True
+                    yield delta
+
+        except OpenRouterError:
+            raise
+        except httpx.TimeoutException:
+            raise OpenRouterError(TIMEOUT_ERROR_MESSAGE, retryable=True)
+        except httpx.TransportError:
+            raise OpenRouterError(NETWORK_ERROR_MESSAGE, retryable=True)
+        except json.JSONDecodeError:
+            raise OpenRouterError("Невалидный JSON в ответе от API")
+
+        if not received:
+            raise OpenRouterError("Получен пустой ответ от API")
+
+    async def aclose(self):
+        """Закрывает HTTP-сессию (вызывается при остановке бота)."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_default_client: Optional[OpenRouterClient] = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client() -> OpenRouterClient:
+    """Общий клиент процесса: один пул соединений на все вызовы chat_once."""
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = OpenRouterClient()
+    return _default_client
+
 
 def chat_once(
         messages: List[Dict[str, str]],
@@ -123,8 +647,7 @@ def chat_once(
     Returns:
         Кортеж (текст ответа, задержка в мс)
     """
-    client = OpenRouterClient()
-    response = client.generate_response(
+    response = get_default_client().generate_response(
         model=model,
         messages=messages,
         temperature=temperature,
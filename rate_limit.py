@@ -0,0 +1,206 @@
+"""
+Ограничение частоты команд (token bucket).
+
+Проверяются корзины токенов пользователя, чата, пользователя на конкретную
+команду и общая корзина для команд, обращающихся к OpenRouter. Запрос
+проходит, только если токен есть во всех его корзинах; списание атомарно.
+
+Корзины хранятся в LRU-словаре: проверка - O(1), простаивающие (уже
+полностью восстановившиеся) корзины вытесняются, а общий размер ограничен,
+поэтому память не растёт с числом пользователей.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+# Лимиты задаются как "N/S": N запросов за S секунд (N - и размер всплеска)
+RATE_LIMIT_USER = os.getenv("RATE_LIMIT_USER", "20/60")
+RATE_LIMIT_CHAT = os.getenv("RATE_LIMIT_CHAT", "40/60")
+RATE_LIMIT_COMMANDS = os.getenv("RATE_LIMIT_COMMANDS", "ask=5/60,ask_model=5/60,ask_random=5/60")
+# Общий лимит под квоту OpenRouter и команды, которые его расходуют
+RATE_LIMIT_GLOBAL = os.getenv("RATE_LIMIT_GLOBAL", "20/1")
+RATE_LIMIT_GLOBAL_COMMANDS = os.getenv("RATE_LIMIT_GLOBAL_COMMANDS", "ask,ask_model,ask_random")
+RATE_LIMIT_IDLE_S = float(os.getenv("RATE_LIMIT_IDLE_S", "600"))
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+
+# Сколько простаивающих корзин проверять на вытеснение за одно обращение
+EVICT_PER_CALL = 2
+# Сообщение об ограничении - не чаще одного за NOTICE_RATE[1] секунд
+NOTICE_RATE = (1.0, 10.0)
+
+Rate = Tuple[float, float]
+
+
+def parse_rate(value: str) -> Optional[Rate]:
+    """"5/60" -> (5.0, 60.0); пустая строка или "0" - без ограничения."""
+    value = value.strip()
+    if not value or value == "0":
+        return None
+    count, _, period = value.partition("/")
+    return float(count), float(period or 1)
+
+
+def parse_command_rates(value: str) -> Dict[str, Rate]:
+    """Разбирает строку вида "ask=5/60,ask_model=3/60"."""
+    rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            command, rate = item.split("=", 1)
+            parsed = parse_rate(rate)
+            if parsed:
+                rates[command.strip()] = parsed
+    return rates
+
+
+class TokenBucket:
+    """Корзина на capacity токенов, пополняемая со скоростью rate токенов в секунду."""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, rate: float, now: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        return self.tokens
+
+    def wait_time(self, cost: float = 1) -> float:
+        """Через сколько секунд накопится cost токенов (после refill)."""
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def is_idle(self, now: float, idle_s: float) -> bool:
+        """Давно не использовалась и уже восстановилась - её можно забыть."""
+        return now - self.updated >= idle_s and self.refill(now) >= self.capacity
+
+
+class BucketStore:
+    """LRU-хранилище корзин с вытеснением простаивающих."""
+
+    def __init__(self, idle_s: float = RATE_LIMIT_IDLE_S, max_size: int = RATE_LIMIT_MAX_BUCKETS):
+        self.idle_s = idle_s
+        self.max_size = max_size
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def get(self, key: Hashable, rate: Rate, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            capacity, period = rate
+            bucket = self._buckets[key] = TokenBucket(capacity, capacity / period, now)
+        else:
+            self._buckets.move_to_end(key)
+        self._evict(now)
+        return bucket
+
+    def _evict(self, now: float):
+        # Самые давно использованные корзины - в начале словаря
+        for _ in range(EVICT_PER_CALL):
+            if len(self._buckets) <= 1:
+                return
+            oldest_key, oldest = next(iter(self._buckets.items()))
+            if not oldest.is_idle(now, self.idle_s):
+                break
+            del self._buckets[oldest_key]
+            self.evicted += 1
+
+        while len(self._buckets) > self.max_size:
+            self._buckets.popitem(last=False)
+            self.evicted += 1
+
+
+class RateLimiter:
+    """Проверка лимитов команды для пользователя и чата."""
+
+    def __init__(
+            self,
+            user_rate: Optional[Rate] = None,
+            chat_rate: Optional[Rate] = None,
+            command_rates: Optional[Dict[str, Rate]] = None,
+            global_rate: Optional[Rate] = None,
+            global_commands: Optional[Iterable[str]] = None,
+            idle_s: float = RATE_LIMIT_IDLE_S,
+            max_buckets: int = RATE_LIMIT_MAX_BUCKETS
+    ):
+        self.user_rate = user_rate if user_rate is not None else parse_rate(RATE_LIMIT_USER)
+        self.chat_rate = chat_rate if chat_rate is not None else parse_rate(RATE_LIMIT_CHAT)
+        self.command_rates = (
+            command_rates if command_rates is not None else parse_command_rates(RATE_LIMIT_COMMANDS)
+        )
+        self.global_rate = global_rate if global_rate is not None else parse_rate(RATE_LIMIT_GLOBAL)
+        self.global_commands = set(
+            global_commands if global_commands is not None
+            else (c.strip() for c in RATE_LIMIT_GLOBAL_COMMANDS.split(",") if c.strip())
+        )
+        self.buckets = BucketStore(idle_s, max_buckets)
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, user_id: int, chat_id: Optional[int], command: str, now: float) -> List[tuple]:
+        buckets = []
+        if self.user_rate:
+            buckets.append(("user", self.buckets.get(("user", user_id), self.user_rate, now)))
+        if self.chat_rate and chat_id is not None and chat_id != user_id:
+            # В личном чате chat_id совпадает с user_id - вторая корзина не нужна
+            buckets.append(("chat", self.buckets.get(("chat", chat_id), self.chat_rate, now)))
+        rate = self.command_rates.get(command)
+        if rate:
+            buckets.append(("command", self.buckets.get(("command", user_id, command), rate, now)))
+        if self.global_rate and command in self.global_commands:
+            buckets.append(("global", self.buckets.get(("global",), self.global_rate, now)))
+        return buckets
+
+    def check(
+            self,
+            user_id: int,
+            chat_id: Optional[int],
+            command: str,
+            now: Optional[float] = None
+    ) -> Tuple[bool, float, Optional[str]]:
+        """
+        Пытается списать по токену из всех корзин запроса.
+
+        Возвращает (разрешено, через сколько секунд повторить, какая корзина
+        отказала). При отказе токены не списываются ни из одной корзины.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            buckets = self._buckets_for(user_id, chat_id, command, now)
+            retry_after = 0.0
+            denied_by = None
+            for scope, bucket in buckets:
+                bucket.refill(now)
+                wait = bucket.wait_time()
+                if wait > retry_after:
+                    retry_after, denied_by = wait, scope
+
+            if denied_by is not None:
+                return False, retry_after, denied_by
+
+            for _, bucket in buckets:
+                bucket.tokens -= 1
+            return True, 0.0, None
+
+    def should_notify(self, user_id: int, now: Optional[float] = None) -> bool:
+        """Можно ли сообщить пользователю об ограничении (чтобы не отвечать на каждый спам)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self.buckets.get(("notice", user_id), NOTICE_RATE, now)
+            if bucket.refill(now) < 1:
+                return False
+            bucket.tokens -= 1
+            return True
+
+    def stats(self) -> dict:
+        return {"buckets": len(self.buckets), "evicted": self.buckets.evicted}
@@ -0,0 +1,148 @@
+"""
+Кэш ответов LLM для одинаковых запросов.
+
+Ключ - хэш модели, сообщений (промпт персонажа + вопрос), температуры и
+max_tokens. Два уровня: LRU в памяти процесса и таблица SQLite, общая для
+всех процессов бота. Кэшируются только детерминированные запросы
+(temperature <= 0): при ненулевой температуре повтор ответа был бы
+подменой случайной генерации.
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+from types import MappingProxyType
+from typing import Dict, List, Optional
+
+from db import ConnectionPool, LRUCache, CacheStats
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "86400"))
+RESPONSE_CACHE_MEMORY_SIZE = int(os.getenv("RESPONSE_CACHE_MEMORY_SIZE", "1000"))
+RESPONSE_CACHE_DB_SIZE = int(os.getenv("RESPONSE_CACHE_DB_SIZE", "100000"))
+# Как часто (в записях) проверять превышение размера таблицы
+EVICT_EVERY = 100
+
+
+def make_cache_key(
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int
+) -> str:
+    """SHA-256 от канонического JSON параметров запроса."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Двухуровневый кэш ответов: память процесса + SQLite."""
+
+    def __init__(
+            self,
+            db_path: str = "bot.db",
+            ttl_s: float = RESPONSE_CACHE_TTL_S,
+            memory_size: int = RESPONSE_CACHE_MEMORY_SIZE,
+            db_size: int = RESPONSE_CACHE_DB_SIZE,
+            enabled: bool = RESPONSE_CACHE_ENABLED
+    ):
+        self.enabled = enabled
+        self.ttl_s = ttl_s
+        self.db_size = db_size
+        self.memory = LRUCache(memory_size, ttl_s)
+        self.stats = CacheStats()
+        self._pool = ConnectionPool(db_path, size=2)
+        self._writes = 0
+        self._init_table()
+
+    def _init_table(self):
+        with self._pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_response_cache_created
+                ON response_cache(created_at)
+            ''')
+            conn.commit()
+
+    def is_cacheable(self, temperature: float) -> bool:
+        """Кэшируются только детерминированные запросы."""
+        return self.enabled and temperature <= 0
+
+    def get(self, key: str) -> Optional[dict]:
+        """Ответ из кэша ({"text", "model"}) или None."""
+        entry = self.memory.get(key)
+        if entry is not LRUCache.MISSING:
+            self.stats.hit()
+            return dict(entry)
+        return self._get_from_db(key)
+
+    def put(self, key: str, model: str, text: str):
+        """Сохраняет ответ в оба уровня кэша."""
+        self.memory.put(key, MappingProxyType({"model": model, "text": text}))
+
+        now = time.time()
+        with self._pool.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, model, text, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, text, now, now + self.ttl_s)
+            )
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now: float):
+        """Удаляет просроченные записи и самые старые сверх лимита размера."""
+        conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+        conn.execute('''
+            DELETE FROM response_cache WHERE key IN (
+                SELECT key FROM response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.db_size,))
+
+    async def aget(self, key: str) -> Optional[dict]:
+        """get() без блокировки event loop (SQLite читается в пуле потоков)."""
+        entry = self.memory.get(key)
+        if entry is not LRUCache.MISSING:
+            self.stats.hit()
+            return dict(entry)
+        return await asyncio.get_running_loop().run_in_executor(None, self._get_from_db, key)
+
+    def _get_from_db(self, key: str) -> Optional[dict]:
+        with self._pool.connection() as conn:
+            row = conn.execute(
+                "SELECT model, text FROM response_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+
+        if row is None:
+            self.stats.miss()
+            return None
+
+        entry = MappingProxyType({"model": row["model"], "text": row["text"]})
+        self.memory.put(key, entry)
+        self.stats.hit()
+        return dict(entry)
+
+    async def aput(self, key: str, model: str, text: str):
+        """put() без блокировки event loop."""
+        await asyncio.get_running_loop().run_in_executor(None, self.put, key, model, text)
+
+    def close(self):
+        self._pool.close()
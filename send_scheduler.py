@@ -0,0 +1,290 @@
+"""
+Планировщик исходящих запросов к Telegram Bot API.
+
+Подключается к Application как rate limiter python-telegram-bot, поэтому
+через него проходят все reply_text/edit_text обработчиков без изменения их
+кода. Сообщения в чат отправляются не чаще раза в CHAT_INTERVAL_S (в группах -
+GROUP_INTERVAL_S), всего - не больше GLOBAL_RATE в секунду. Ответы
+пользователям идут впереди массовых рассылок, частые правки одного
+сообщения схлопываются в последнюю, а на 429 (RetryAfter) чат
+приостанавливается и запрос повторяется.
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import datetime
+import logging
+from collections import deque
+from typing import Any, Dict, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import metric
+
+logger = logging.getLogger(__name__)
+
+CHAT_INTERVAL_S = float(os.getenv("TG_SEND_CHAT_INTERVAL_S", "1.0"))
+GROUP_INTERVAL_S = float(os.getenv("TG_SEND_GROUP_INTERVAL_S", "3.0"))
+GLOBAL_RATE = float(os.getenv("TG_SEND_GLOBAL_RATE", "30"))
+MAX_RETRIES = int(os.getenv("TG_SEND_MAX_RETRIES", "3"))
+
+# Полосы приоритета: передаются как rate_limit_args вызова Bot API
+INTERACTIVE = 0
+BULK = 1
+
+# Запросы без очереди: получение обновлений, служебные и не ограниченные по чату
+UNPACED_ENDPOINTS = {"getUpdates", "sendChatAction", "answerCallbackQuery", "answerInlineQuery"}
+EDIT_ENDPOINTS = {"editMessageText", "editMessageCaption", "editMessageReplyMarkup"}
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class _Request:
+    __slots__ = ("callback", "args", "kwargs", "endpoint", "lane", "key", "futures", "attempts")
+
+    def __init__(self, callback, args, kwargs, endpoint: str, lane: int, key, future: asyncio.Future):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.endpoint = endpoint
+        self.lane = lane
+        self.key = key
+        self.futures = [future]
+        self.attempts = 0
+
+    def resolve(self, result=None, error: Optional[BaseException] = None):
+        for future in self.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+class _ChatQueue:
+    __slots__ = ("lanes", "pending_keys", "next_at", "busy", "heap_seq")
+
+    def __init__(self):
+        self.lanes = (deque(), deque())
+        # Ключ правки -> запрос в очереди, в который схлопываются новые правки
+        self.pending_keys: Dict[Any, _Request] = {}
+        self.next_at = 0.0
+        self.busy = False
+        self.heap_seq = -1
+
+    def has_pending(self) -> bool:
+        return bool(self.lanes[INTERACTIVE] or self.lanes[BULK])
+
+
+class SendScheduler(BaseRateLimiter[int]):
+    """Очередь исходящих сообщений с темпом по чатам и общим лимитом."""
+
+    def __init__(
+            self,
+            chat_interval_s: float = CHAT_INTERVAL_S,
+            group_interval_s: float = GROUP_INTERVAL_S,
+            global_rate: float = GLOBAL_RATE,
+            max_retries: int = MAX_RETRIES
+    ):
+        self.chat_interval_s = chat_interval_s
+        self.group_interval_s = group_interval_s
+        self.global_rate = global_rate
+        self.max_retries = max_retries
+
+        self._chats: Dict[int, _ChatQueue] = {}
+        # Кучи готовности чатов по полосам: (момент готовности, seq, chat_id)
+        self._ready = ([], [])
+        self._seq = 0
+        self._tokens = global_rate
+        self._tokens_at = time.monotonic()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._deliveries = set()
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    async def initialize(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for chat in self._chats.values():
+            for lane in chat.lanes:
+                for request in lane:
+                    for future in request.futures:
+                        future.cancel()
+        self._chats.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if endpoint in UNPACED_ENDPOINTS or not isinstance(chat_id, int) or self._task is None:
+            return await callback(*args, **kwargs)
+
+        lane = BULK if rate_limit_args == BULK else INTERACTIVE
+        key = None
+        if endpoint in EDIT_ENDPOINTS and data.get("message_id") is not None:
+            key = (endpoint, data["message_id"])
+
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(chat_id, _Request(callback, args, kwargs, endpoint, lane, key, future))
+        return await future
+
+    def _enqueue(self, chat_id: int, request: _Request):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatQueue()
+
+        if request.key is not None:
+            queued = chat.pending_keys.get(request.key)
+            if queued is not None:
+                # Ещё не отправленная правка того же сообщения: отправим только последнюю
+                queued.callback, queued.args, queued.kwargs = request.callback, request.args, request.kwargs
+                queued.futures.extend(request.futures)
+                self.coalesced += 1
+                metric.counter("tg_send_coalesced_total").inc()
+                return
+            chat.pending_keys[request.key] = request
+
+        chat.lanes[request.lane].append(request)
+        self._schedule(chat_id, chat)
+
+    def _schedule(self, chat_id: int, chat: _ChatQueue):
+        """Ставит чат в кучу готовности его лучшей непустой полосы."""
+        if chat.busy or not chat.has_pending():
+            return
+        lane = INTERACTIVE if chat.lanes[INTERACTIVE] else BULK
+        self._seq += 1
+        chat.heap_seq = self._seq
+        heapq.heappush(self._ready[lane], (chat.next_at, self._seq, chat_id))
+        self._wakeup.set()
+
+    def _pick(self, now: float):
+        """Готовый к отправке чат (с приоритетом интерактивной полосы) или время ожидания."""
+        wait = None
+        for heap in self._ready:
+            while heap:
+                ready_at, seq, chat_id = heap[0]
+                chat = self._chats.get(chat_id)
+                if chat is None or chat.heap_seq != seq or chat.busy:
+                    heapq.heappop(heap)  # устаревшая запись
+                    continue
+                if ready_at <= now:
+                    heapq.heappop(heap)
+                    return chat_id, None
+                wait = ready_at - now if wait is None else min(wait, ready_at - now)
+                break
+        return None, wait
+
+    def _global_wait(self, now: float) -> float:
+        """Пополняет общий лимит; возвращает, сколько ждать следующего токена."""
+        self._tokens = min(self.global_rate, self._tokens + (now - self._tokens_at) * self.global_rate)
+        self._tokens_at = now
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.global_rate
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            # Сначала ждём токен общего лимита, и только потом выбираем чат:
+            # за время ожидания может прийти более приоритетный ответ
+            global_wait = self._global_wait(now)
+            if global_wait:
+                await asyncio.sleep(global_wait)
+                continue
+
+            chat_id, wait = self._pick(now)
+            if chat_id is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._tokens -= 1
+            chat = self._chats[chat_id]
+            lane = chat.lanes[INTERACTIVE] or chat.lanes[BULK]
+            request = lane.popleft()
+            if request.key is not None:
+                chat.pending_keys.pop(request.key, None)
+            chat.busy = True
+            task = asyncio.create_task(self._deliver(chat_id, chat, request))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    def _interval(self, chat_id: int) -> float:
+        # Отрицательные id - группы и каналы, для них лимит Telegram строже
+        return self.group_interval_s if chat_id < 0 else self.chat_interval_s
+
+    async def _deliver(self, chat_id: int, chat: _ChatQueue, request: _Request):
+        started = time.monotonic()
+        chat.next_at = started + self._interval(chat_id)
+        try:
+            result = await request.callback(*request.args, **request.kwargs)
+        except RetryAfter as e:
+            request.attempts += 1
+            delay = _retry_after_seconds(e)
+            self.retried += 1
+            metric.counter("tg_send_retry_after_total").inc()
+            if request.attempts > self.max_retries:
+                request.resolve(error=e)
+            else:
+                logger.warning(f"Telegram просит подождать {delay:.0f} с перед отправкой в чат {chat_id}")
+                chat.next_at = time.monotonic() + delay
+                newer = chat.pending_keys.get(request.key) if request.key is not None else None
+                if newer is not None:
+                    # Пока ждали, пришла более новая правка - повторять старую незачем
+                    newer.futures.extend(request.futures)
+                else:
+                    chat.lanes[request.lane].appendleft(request)
+                    if request.key is not None:
+                        chat.pending_keys[request.key] = request
+        except Exception as e:
+            request.resolve(error=e)
+        else:
+            self.sent += 1
+            metric.counter("tg_send_total", endpoint=request.endpoint).inc()
+            request.resolve(result)
+        finally:
+            chat.busy = False
+            if chat.has_pending():
+                self._schedule(chat_id, chat)
+            else:
+                # Состояние чата нужно только до конца паузы между сообщениями
+                asyncio.get_running_loop().call_later(
+                    max(0.0, chat.next_at - time.monotonic()), self._forget_idle, chat_id
+                )
+
+    def _forget_idle(self, chat_id: int):
+        chat = self._chats.get(chat_id)
+        if chat is not None and not chat.busy and not chat.has_pending():
+            del self._chats[chat_id]
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._chats),
+            "queued_interactive": sum(len(c.lanes[INTERACTIVE]) for c in self._chats.values()),
+            "queued_bulk": sum(len(c.lanes[BULK]) for c in self._chats.values()),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retried": self.retried
+        }
@@ -0,0 +1,104 @@
+"""
+Потоковая отправка ответа модели в Telegram.
+
+Ответ показывается сразу: отправляется сообщение-заглушка, которое затем
+редактируется по мере прихода фрагментов. Правки объединяются, чтобы не
+упираться в лимиты Telegram на редактирование сообщений.
+"""
+
+import os
+import time
+import logging
+from typing import Optional
+
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+# Минимальный интервал между правками одного сообщения, секунды
+EDIT_INTERVAL_S = float(os.getenv("STREAM_EDIT_INTERVAL_S", "1.0"))
+# Минимальный прирост текста (символов), ради которого стоит делать правку
+EDIT_MIN_CHARS = int(os.getenv("STREAM_EDIT_MIN_CHARS", "20"))
+
+PLACEHOLDER_TEXT = "⏳ Генерирую ответ..."
+CURSOR = " ▌"
+
+# Предел длины сообщения Telegram (в единицах UTF-16)
+TELEGRAM_MESSAGE_LIMIT = 4096
+TRUNCATED_SUFFIX = "\n\n... (сообщение обрезано)"
+
+
+def _utf16_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def fit_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> str:
+    """Обрезает готовый текст сообщения под лимит Telegram, помечая обрезку в конце."""
+    if _utf16_len(text) <= limit:
+        return text
+    budget = limit - _utf16_len(TRUNCATED_SUFFIX)
+    # Разрезанная суррогатная пара отбрасывается при декодировании
+    head = text.encode("utf-16-le")[:budget * 2].decode("utf-16-le", errors="ignore")
+    return head + TRUNCATED_SUFFIX
+
+
+class StreamingReply:
+    """Сообщение, которое наполняется текстом по мере генерации."""
+
+    def __init__(
+            self,
+            message,
+            max_length: int = 4000,
+            min_interval_s: float = EDIT_INTERVAL_S,
+            min_chars: int = EDIT_MIN_CHARS
+    ):
+        self.source_message = message
+        self.max_length = max_length
+        self.min_interval_s = min_interval_s
+        self.min_chars = min_chars
+        self.text = ""
+        self.message = None
+        self._shown_length = 0
+        self._last_edit = 0.0
+
+    async def start(self, placeholder: str = PLACEHOLDER_TEXT):
+        """Отправляет сообщение-заглушку."""
+        self.message = await self.source_message.reply_text(placeholder)
+        self._last_edit = time.monotonic()
+
+    async def append(self, delta: str):
+        """Добавляет фрагмент; правит сообщение не чаще min_interval_s."""
+        self.text += delta
+
+        now = time.monotonic()
+        if now - self._last_edit < self.min_interval_s:
+            return
+        if len(self.text) - self._shown_length < self.min_chars:
+            return
+
+        await self._edit(self.text[:self.max_length] + CURSOR)
+        self._shown_length = len(self.text)
+        self._last_edit = now
+
+    async def finish(self, text: str, parse_mode: Optional[str] = None):
+        """Финальная правка с полностью сформированным ответом (обрезается под лимит Telegram)."""
+        text = fit_message(text)
+        if self.message is None:
+            await self.source_message.reply_text(text, parse_mode=parse_mode)
+            return
+
+        try:
+            await self.message.edit_text(text, parse_mode=parse_mode)
+        except BadRequest as e:
+            if parse_mode is None:
+                raise
+            # Ответ модели может сломать разметку - показываем его как есть
+            logger.warning(f"Не удалось применить разметку {parse_mode}: {e}")
+            await self.message.edit_text(text)
+
+    async def _edit(self, text: str):
+        try:
+            await self.message.edit_text(text)
+        except BadRequest as e:
+            # "Message is not modified" и подобные ошибки не критичны для промежуточных правок
+            logger.debug(f"Промежуточная правка пропущена: {e}")
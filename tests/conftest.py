@@ -26,9 +26,8 @@ def db_module(monkeypatch):
     # Monkey-patch the Database class to use our temp file
     original_init = Database.__init__
 
-    def patched_init(self, db_path=tmp_path):
-        self.db_path = db_path
-        self.init_database()
+    def patched_init(self, db_path=tmp_path, **kwargs):
+        original_init(self, db_path, **kwargs)
 
     monkeypatch.setattr(Database, "__init__", patched_init)
 
@@ -40,6 +39,7 @@ def db_module(monkeypatch):
 
     yield db_obj
 
+    db_obj.close()
     if os.path.exists(tmp_path):
         os.unlink(tmp_path)
 
@@ -113,4 +113,86 @@ def mock_context():
     mock_context = AsyncMock()
     mock_context.args = []
 
-    return mock_context
\ No newline at end of file
+    return mock_context
+
+
+class BotHarness:
+    """
+    Приложение из main.build_application на заглушке Bot API (workers.FakeBotRequest).
+
+    async with harness: - обновления обрабатываются как при run_polling;
+    send() кладёт команду в update_queue, texts() - что бот показал в чате.
+    """
+
+    def __init__(self, main):
+        from workers import FakeBotRequest, FAKE_TOKEN
+
+        self.main = main
+        self.api = FakeBotRequest()
+        self.application = main.build_application(FAKE_TOKEN, request=self.api)
+        self._update_id = 0
+
+    async def __aenter__(self):
+        await self.application.initialize()
+        await self.application.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.application.stop()
+        await self.application.shutdown()
+
+    async def send(self, text: str, user_id: int, chat_id: int = None):
+        import time
+        from telegram import Update
+
+        self._update_id += 1
+        if chat_id is None or chat_id == user_id:
+            chat = {"id": user_id, "type": "private", "first_name": f"user{user_id}"}
+        else:
+            chat = {"id": chat_id, "type": "group", "title": f"chat{chat_id}"}
+        command_length = len(text.split(maxsplit=1)[0])
+        data = {
+            "update_id": self._update_id,
+            "message": {
+                "message_id": self._update_id,
+                "date": int(time.time()),
+                "chat": chat,
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": command_length}]
+            }
+        }
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+
+    def texts(self, chat_id: int) -> list:
+        return [
+            params.get("text") or params.get("caption", "")
+            for endpoint, params in self.api.calls
+            if endpoint.startswith(("send", "edit")) and str(params.get("chat_id")) == str(chat_id)
+        ]
+
+    def replied(self, chat_id: int, fragment: str) -> bool:
+        return any(fragment in text for text in self.texts(chat_id))
+
+    async def wait_for(self, predicate, timeout_s: float = 5.0):
+        import asyncio
+
+        async def poll():
+            while not predicate():
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(poll(), timeout_s)
+
+
+@pytest.fixture
+def bot_app(main_module, monkeypatch, tmp_path):
+    from conversation import ConversationStore
+
+    # Темп по чатам проверяется в test_send_scheduler.py, здесь он только замедляет тесты
+    monkeypatch.setattr(main_module.send_scheduler, "chat_interval_s", 0)
+    conversations = ConversationStore(str(tmp_path / "history.db"))
+    monkeypatch.setattr(main_module, "conversations", conversations)
+
+    yield BotHarness(main_module)
+
+    conversations.close()
@@ -0,0 +1,107 @@
+"""
+Тесты для модуля circuit_breaker.py и цепочки резервных моделей
+"""
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, CircuitBreakerRegistry, CLOSED, OPEN, HALF_OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", fake)
+    return fake
+
+
+def test_opens_on_failure_rate_and_recovers(clock):
+    breaker = CircuitBreaker("m", window=10, min_calls=4, failure_rate=0.5, open_s=30)
+
+    breaker.record_success(0.1)
+    breaker.record_failure()
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED  # меньше min_calls
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.snapshot()["rejected"] == 1
+
+    clock.now += 30
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # пробный слот один
+
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["calls"] == 0
+
+
+def test_failed_trial_reopens(clock):
+    breaker = CircuitBreaker("m", window=4, min_calls=2, failure_rate=0.5, open_s=10)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.snapshot()["times_opened"] == 2
+
+
+def test_release_returns_trial_slot(clock):
+    breaker = CircuitBreaker("m", window=4, min_calls=1, failure_rate=0.5, open_s=10)
+    breaker.record_failure()
+    clock.now += 10
+
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_opens_on_slow_calls(clock):
+    breaker = CircuitBreaker("m", window=5, min_calls=5, slow_call_s=2.0, slow_rate=0.8)
+    for _ in range(4):
+        breaker.record_success(5.0)
+    breaker.record_success(0.1)
+    assert breaker.state == OPEN
+
+
+def test_registry_is_available(clock):
+    registry = CircuitBreakerRegistry(min_calls=1, failure_rate=0.5, open_s=10)
+    assert registry.is_available("a")
+
+    registry.get("a").record_failure()
+    assert not registry.is_available("a")
+    assert registry.is_available("b")
+    assert registry.snapshot()["a"]["state"] == OPEN
+
+
+def test_build_fallback_chain(main_module):
+    models = [
+        {"id": 1, "name": "primary", "is_free": 1, "max_tokens": 8000},
+        {"id": 2, "name": "small", "is_free": 1, "max_tokens": 1000},
+        {"id": 3, "name": "paid", "is_free": 0, "max_tokens": 32000},
+        {"id": 4, "name": "big", "is_free": 1, "max_tokens": 16000},
+        {"id": 5, "name": "mid", "is_free": 1, "max_tokens": 4096},
+    ]
+    primary = models[0]
+
+    chain = main_module.build_fallback_chain(primary, models, depth=3, min_tokens=4096)
+    assert [m["name"] for m in chain] == ["primary", "big", "mid"]
+
+    chain = main_module.build_fallback_chain(primary, models, ["paid", "missing", "small"], depth=3)
+    assert [m["name"] for m in chain] == ["primary", "paid", "small"]
+
+    chain = main_module.build_fallback_chain(primary, models, depth=0)
+    assert chain == [primary]
@@ -2,9 +2,20 @@
 Тесты для команд бота.
 """
 
+import asyncio
+
 import pytest
 from unittest.mock import AsyncMock, patch
 
+MODEL = {"id": 1, "name": "test/model", "is_free": 1, "max_tokens": 4096}
+
+
+def _fake_llm(monkeypatch, main, stream_response):
+    monkeypatch.setattr(main.adb, "get_active_model", AsyncMock(return_value=MODEL))
+    monkeypatch.setattr(main.adb, "get_character_prompt", AsyncMock(return_value="Ты ассистент."))
+    monkeypatch.setattr(main.adb, "get_all_models", AsyncMock(return_value=[MODEL]))
+    monkeypatch.setattr(main.openrouter_client, "stream_response", stream_response)
+
 
 @pytest.mark.asyncio
 async def test_start_command(main_module, mock_update, mock_context):
@@ -82,4 +93,175 @@ async def test_ask_no_question(main_module, mock_update, mock_context):
     response_text = call_args[0][0]
 
     assert "Укажите ваш вопрос" in response_text
-    assert "/ask" in response_text
\ No newline at end of file
+    assert "/ask" in response_text
+
+
+@pytest.mark.asyncio
+async def test_usage_all_requires_admin(main_module, mock_update, mock_context):
+    from main import show_usage_summary
+
+    await show_usage_summary(mock_update, mock_context)
+
+    response_text = mock_update.message.reply_text.call_args[0][0]
+    assert "администраторам" in response_text
+
+
+@pytest.mark.asyncio
+async def test_streaming_ask_does_not_block_other_chats(bot_app, monkeypatch):
+    release = asyncio.Event()
+
+    async def stream_response(**kwargs):
+        yield "начало"
+        await release.wait()
+        yield " и конец ответа"
+
+    _fake_llm(monkeypatch, bot_app.main, stream_response)
+    assert bot_app.application.concurrent_updates == bot_app.main.UPDATE_CONCURRENCY
+
+    async with bot_app:
+        await bot_app.send("/ask долгий вопрос", user_id=1)
+        await bot_app.send("/start", user_id=2)
+        try:
+            # /start из другого чата отвечает, пока /ask ещё генерируется
+            await bot_app.wait_for(lambda: bot_app.replied(2, "Добро пожаловать"))
+            assert not bot_app.replied(1, "конец ответа")
+        finally:
+            release.set()
+        await bot_app.wait_for(lambda: bot_app.replied(1, "начало и конец ответа"))
+
+
+@pytest.mark.asyncio
+async def test_updates_of_one_chat_are_handled_in_order(bot_app, monkeypatch):
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def stream_response(**kwargs):
+        started.set()
+        await release.wait()
+        yield "ответ"
+
+    _fake_llm(monkeypatch, bot_app.main, stream_response)
+
+    async with bot_app:
+        await bot_app.send("/ask вопрос", user_id=1)
+        await bot_app.send("/start", user_id=1)
+        await bot_app.send("/start", user_id=2)
+        try:
+            await bot_app.wait_for(started.is_set)
+            await bot_app.wait_for(lambda: bot_app.replied(2, "Добро пожаловать"))
+            # /start того же чата ждёт, пока обработается /ask
+            assert not bot_app.replied(1, "Добро пожаловать")
+        finally:
+            release.set()
+        await bot_app.wait_for(lambda: bot_app.replied(1, "Добро пожаловать"))
+
+    texts = bot_app.texts(1)
+    welcome = next(i for i, text in enumerate(texts) if "Добро пожаловать" in text)
+    assert any("ответ" in text for text in texts[:welcome])
+
+
+@pytest.mark.asyncio
+async def test_failed_placeholder_cancels_request(main_module, mock_update, monkeypatch):
+    from telegram.error import NetworkError
+
+    calls = []
+
+    async def stream_response(**kwargs):
+        calls.append(kwargs)
+        yield "ответ"
+
+    _fake_llm(monkeypatch, main_module, stream_response)
+    mock_update.message.reply_text.side_effect = NetworkError("сеть недоступна")
+
+    with pytest.raises(NetworkError):
+        await main_module._stream_answer(
+            mock_update, MODEL, [{"role": "user", "content": "вопрос"}], lambda answer, latency: answer
+        )
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+    assert calls == []
+    assert main_module.llm_scheduler.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_asks_are_queued_round_robin(bot_app, monkeypatch):
+    from llm_scheduler import RequestScheduler
+
+    main = bot_app.main
+    scheduler = RequestScheduler(max_concurrency=1, user_queue_size=3)
+    monkeypatch.setattr(main, "llm_scheduler", scheduler)
+    release = asyncio.Event()
+    served = []
+
+    async def stream_response(messages, **kwargs):
+        served.append(messages[-1]["content"])
+        if len(served) == 1:
+            await release.wait()
+        yield f"ответ на {messages[-1]['content']}"
+
+    _fake_llm(monkeypatch, main, stream_response)
+
+    async with bot_app:
+        # Обновления одного чата идут по порядку, поэтому первый пользователь спрашивает из разных групп
+        for chat_id, question in ((-1, "a1"), (-2, "a2"), (-3, "a3")):
+            await bot_app.send(f"/ask {question}", user_id=1, chat_id=chat_id)
+        await bot_app.send("/ask b1", user_id=2)
+        try:
+            await bot_app.wait_for(lambda: scheduler.queued == 3)
+            assert bot_app.replied(2, "в очереди")
+        finally:
+            release.set()
+        await bot_app.wait_for(lambda: len(served) == 4 and scheduler.stats()["in_flight"] == 0)
+
+    # Второй пользователь не ждёт, пока выполнится вся очередь первого
+    assert served == ["a1", "b1", "a2", "a3"]
+    assert bot_app.replied(2, "ответ на b1")
+
+
+@pytest.mark.asyncio
+async def test_answer_budget_and_cached_answer_are_remembered(bot_app, monkeypatch, tmp_path):
+    from response_cache import ResponseCache
+
+    main = bot_app.main
+    cache = ResponseCache(str(tmp_path / "cache.db"), enabled=True)
+    monkeypatch.setattr(main, "response_cache", cache)
+    monkeypatch.setattr(main, "LLM_TEMPERATURE", 0.0)
+    requested = []
+
+    async def stream_response(messages, max_tokens, **kwargs):
+        requested.append(max_tokens)
+        yield "ответ"
+
+    _fake_llm(monkeypatch, main, stream_response)
+
+    async with bot_app:
+        await bot_app.send("/ask вопрос", user_id=1)
+        await bot_app.wait_for(lambda: bot_app.replied(1, "ответ"))
+        await bot_app.send("/reset", user_id=1)
+        await bot_app.wait_for(lambda: bot_app.replied(1, "История диалога очищена"))
+        await bot_app.send("/ask вопрос", user_id=1)
+        await bot_app.wait_for(lambda: bot_app.replied(1, "Ответ из кэша"))
+    cache.close()
+
+    # На ответ уходит остаток контекста после запроса, а не весь max_tokens модели
+    assert len(requested) == 1 and 0 < requested[0] < MODEL["max_tokens"]
+    history = main.conversations.history((1, 1))
+    assert [(t.role, t.content) for t in history] == [("user", "вопрос"), ("assistant", "ответ")]
+
+
+@pytest.mark.asyncio
+async def test_long_answer_fits_into_one_message(bot_app, monkeypatch):
+    async def stream_response(**kwargs):
+        yield "я" * 4096
+
+    _fake_llm(monkeypatch, bot_app.main, stream_response)
+
+    async with bot_app:
+        await bot_app.send("/ask расскажи подробно", user_id=1)
+        await bot_app.wait_for(lambda: bot_app.replied(1, "сообщение обрезано"))
+
+    final = bot_app.texts(1)[-1]
+    assert len(final) <= bot_app.main.MAX_RESPONSE_LENGTH
+    # Обрезается ответ, а заголовок и подсказки под ним остаются
+    assert final.startswith("🆓 *test/model*") and final.endswith("`/current` - текущие настройки")
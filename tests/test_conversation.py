@@ -0,0 +1,99 @@
+"""
+Тесты для модуля conversation.py
+"""
+
+import pytest
+
+from conversation import (
+    ConversationStore, estimate_tokens, prompt_budget, answer_budget, MESSAGE_OVERHEAD_TOKENS, ANSWER_MAX_TOKENS
+)
+
+KEY = (42, 42)
+
+
+@pytest.fixture
+def store(tmp_path):
+    conversations = ConversationStore(str(tmp_path / "history.db"), max_messages=6)
+    yield conversations
+    conversations.close()
+
+
+def _base(question: str) -> list:
+    return [{"role": "system", "content": "Ты ассистент."}, {"role": "user", "content": question}]
+
+
+def _remember(store, key, question, answer):
+    store.save(store.remember(key, question, answer))
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == MESSAGE_OVERHEAD_TOKENS
+    assert estimate_tokens("abcdefgh") == MESSAGE_OVERHEAD_TOKENS + 2
+    # Кириллица дороже латиницы той же длины
+    assert estimate_tokens("привет") > estimate_tokens("privet")
+
+
+def test_prompt_budget_is_capped():
+    assert prompt_budget(2048) == 1024
+    assert prompt_budget(1000000) == 8000
+
+
+def test_answer_budget_is_what_the_prompt_leaves():
+    messages = _base("вопрос")
+    used = sum(estimate_tokens(m["content"]) for m in messages)
+    assert answer_budget(2048, messages) == 2048 - used
+    assert answer_budget(1000000, messages) == ANSWER_MAX_TOKENS
+    assert answer_budget(used, messages) == 1
+
+
+def test_history_is_inserted_before_question(store):
+    _remember(store, KEY, "Сколько будет 2+2?", "4")
+
+    messages = store.build_messages(KEY, _base("А умножить на 3?"), max_tokens=4096)
+
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert messages[1]["content"] == "Сколько будет 2+2?"
+    assert messages[-1]["content"] == "А умножить на 3?"
+
+
+def test_old_pairs_are_trimmed_to_budget(store):
+    long_answer = "слово " * 100
+    for i in range(3):
+        _remember(store, KEY, f"вопрос {i}", long_answer)
+
+    pair_tokens = estimate_tokens("вопрос 0") + estimate_tokens(long_answer)
+    base = _base("ещё")
+    base_tokens = sum(estimate_tokens(m["content"]) for m in base)
+    # Бюджет (половина max_tokens) вмещает запрос и ровно одну пару
+    messages = store.build_messages(KEY, base, max_tokens=2 * (base_tokens + pair_tokens + 1))
+
+    assert [m["content"] for m in messages[1:-1]] == ["вопрос 2", long_answer]
+    assert store.trimmed == 1
+
+
+def test_ring_buffer_is_bounded_and_persisted(store, tmp_path):
+    for i in range(5):
+        _remember(store, KEY, f"вопрос {i}", f"ответ {i}")
+    _remember(store, (7, 7), "чужой вопрос", "чужой ответ")
+
+    assert len(store.history(KEY)) == 6
+
+    restored = ConversationStore(str(tmp_path / "history.db"), max_messages=6)
+    turns = list(restored.history(KEY))
+    restored.close()
+
+    assert [t.content for t in turns] == [
+        "вопрос 2", "ответ 2", "вопрос 3", "ответ 3", "вопрос 4", "ответ 4"
+    ]
+    assert turns[0].tokens == estimate_tokens("вопрос 2")
+
+
+def test_reset_starts_new_dialog(store, tmp_path):
+    _remember(store, KEY, "старый вопрос", "старый ответ")
+    store.reset(KEY)
+    assert store.build_messages(KEY, _base("новый"), max_tokens=4096) == _base("новый")
+
+    _remember(store, KEY, "новый вопрос", "новый ответ")
+    restored = ConversationStore(str(tmp_path / "history.db"))
+    assert [t.content for t in restored.history(KEY)] == ["новый вопрос", "новый ответ"]
+    restored.close()
@@ -155,4 +155,206 @@ def test_get_user_character_default(db_module):
         # Или возвращается какой-то существующий персонаж
         assert 'id' in character
         assert 'name' in character
-        assert 'prompt' in character
\ No newline at end of file
+        assert 'prompt' in character
+
+
+def test_set_active_model_unknown_id_keeps_current(db_module):
+    """Несуществующий ID - ValueError, активная модель не сбрасывается"""
+    active_before = db_module.get_active_model()
+
+    with pytest.raises(ValueError, match="не найдена"):
+        db_module.set_active_model(99999)
+
+    assert db_module.get_active_model()['id'] == active_before['id']
+    with sqlite3.connect(db_module.db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM models WHERE active = 1").fetchone()[0] == 1
+
+
+def test_connection_pool_reuses_wal_connections(tmp_path):
+    from db import ConnectionPool
+
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=2)
+    with pool.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        first = conn
+    with pool.connection() as conn:
+        assert conn is first
+
+    # Незавершённая транзакция откатывается при возврате в пул
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.commit()
+        conn.execute("INSERT INTO t VALUES (1)")
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+
+    pool.close()
+
+
+def test_connection_pool_is_bounded(tmp_path):
+    import queue
+    from db import ConnectionPool
+
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=2, busy_timeout_ms=50)
+    with pool.connection() as a, pool.connection() as b:
+        assert a is not b
+        with pytest.raises(queue.Empty):
+            with pool.connection():
+                pass
+    assert pool._created == 2
+
+    pool.close()
+    assert pool._created == 0
+
+
+def test_pools_are_per_instance(db_module):
+    other = Database(db_module.db_path, pool_size=1)
+
+    assert other._pool is not db_module._pool
+    assert other.pool_size == 1 and db_module.pool_size != 1
+    assert other._pool.size == 1
+
+    other.close()
+    # Закрытие одного экземпляра не трогает соединения другого
+    assert db_module.get_all_models()
+
+
+def test_catalog_cache_invalidated_on_set_active_model(db_module):
+    db_module.get_all_models()
+    db_module.get_active_model()
+    stats = db_module.cache_stats()["catalog"]
+    assert stats["hits"] >= 1
+
+    target = [m for m in db_module.get_all_models() if m['active'] == 0][0]
+    db_module.set_active_model(target['id'])
+
+    misses_before = db_module.cache_stats()["catalog"]["misses"]
+    assert db_module.get_active_model()['id'] == target['id']
+    assert db_module.cache_stats()["catalog"]["misses"] == misses_before + 1
+
+
+def test_catalog_snapshot_is_not_mutated_by_callers(db_module):
+    model = db_module.get_active_model()
+    model['name'] = "changed"
+    assert db_module.get_active_model()['name'] != "changed"
+
+
+def test_get_random_character(db_module):
+    character = db_module.get_random_character()
+    assert character is not None
+    assert character['id'] in [c['id'] for c in db_module.get_all_characters()]
+
+
+def test_user_character_cache_write_through(db_module):
+    characters = db_module.get_all_characters()
+    user_id = 2001
+
+    db_module.set_user_character(user_id, characters[0]['id'])
+    hits_before = db_module.cache_stats()["user_characters"]["hits"]
+
+    assert db_module.get_character_prompt(user_id) == characters[0]['prompt']
+    assert db_module.cache_stats()["user_characters"]["hits"] == hits_before + 1
+
+
+def test_user_character_cache_coherent_across_instances(db_module):
+    """Второй экземпляр Database на том же файле - как второй процесс бота"""
+    characters = db_module.get_all_characters()
+    user_id = 2002
+    other = Database(db_module.db_path)
+    other.user_cache_sync_s = 0
+
+    db_module.set_user_character(user_id, characters[0]['id'])
+    assert other.get_character_prompt(user_id) == characters[0]['prompt']
+
+    db_module.set_user_character(user_id, characters[1]['id'])
+    assert other.get_character_prompt(user_id) == characters[1]['prompt']
+
+    other.close()
+
+
+@pytest.mark.asyncio
+async def test_async_database_facade(db_module):
+    from db import AsyncDatabase
+
+    adb = AsyncDatabase(db_module, max_workers=2)
+
+    active_model = await adb.get_active_model()
+    assert active_model == db_module.get_active_model()
+
+    characters = await adb.get_all_characters()
+    assert await adb.set_user_character(3001, characters[0]['id']) is True
+    assert await adb.get_character_prompt(3001) == characters[0]['prompt']
+
+    stats = adb.query_stats.snapshot()
+    assert stats["get_active_model"]["count"] == 1
+    assert stats["set_user_character"]["exec_ms"] >= 0
+
+    adb._executor.shutdown(wait=True)
+
+
+def test_catalog_coherent_across_instances(db_module):
+    """Смена активной модели в одном процессе видна снимку каталога в другом"""
+    other = Database(db_module.db_path)
+    other.catalog_sync_s = 0
+    assert other.get_active_model()['id'] == db_module.get_active_model()['id']
+
+    target = [m for m in db_module.get_all_models() if m['active'] == 0][0]
+    db_module.set_active_model(target['id'])
+    assert other.get_active_model()['id'] == target['id']
+
+    hits_before = other.cache_stats()["catalog"]["hits"]
+    other.get_all_models()
+    assert other.cache_stats()["catalog"]["hits"] == hits_before + 1
+
+    other.close()
+
+
+def test_catalog_reload_racing_with_write_is_not_installed(db_module, monkeypatch):
+    """Запись во время перезагрузки снимка: прочитанный до неё снимок не закрепляется в кэше"""
+    import db
+
+    db_module.catalog_sync_s = 3600  # сверка с версией в БД не должна спасать положение
+    target = [m for m in db_module.get_all_models() if m['active'] == 0][0]
+    db_module.invalidate_catalog()
+
+    original_freeze = db._freeze
+    written = []
+
+    def freeze_then_write(rows):
+        frozen = original_freeze(rows)
+        if not written:
+            written.append(True)
+            # /setmodel из другого потока, пока этот поток собирает снимок
+            db_module.set_active_model(target['id'])
+        return frozen
+
+    monkeypatch.setattr(db, "_freeze", freeze_then_write)
+    db_module.get_active_model()
+
+    assert written
+    assert db_module.get_active_model()['id'] == target['id']
+
+
+def test_user_cache_hits_skip_changelog_between_syncs(db_module, monkeypatch):
+    characters = db_module.get_all_characters()
+    user_id = 2003
+    db_module.user_cache_sync_s = 3600
+    db_module.set_user_character(user_id, characters[0]['id'])
+    db_module.get_character_prompt(user_id)  # первая сверка с журналом
+
+    queries = []
+    connection = db_module._pool.connection
+    monkeypatch.setattr(db_module._pool, "connection", lambda: queries.append(1) or connection())
+
+    for _ in range(10):
+        assert db_module.get_character_prompt(user_id) == characters[0]['prompt']
+    assert queries == []
+
+    # Правка из другого процесса видна после следующей сверки
+    other = Database(db_module.db_path)
+    other.set_user_character(user_id, characters[1]['id'])
+    other.close()
+    assert db_module.get_character_prompt(user_id) == characters[0]['prompt']
+
+    db_module._user_synced_at = 0.0
+    assert db_module.get_character_prompt(user_id) == characters[1]['prompt']
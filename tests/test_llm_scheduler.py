@@ -0,0 +1,94 @@
+"""
+Тесты для модуля llm_scheduler.py
+"""
+
+import asyncio
+import pytest
+
+from llm_scheduler import RequestScheduler, QueueFullError, parse_model_limits
+
+
+def make_job(log, name, gate):
+    async def job():
+        log.append(f"start:{name}")
+        await gate.wait()
+        return name
+
+    return job
+
+
+@pytest.mark.asyncio
+async def test_global_and_user_limits():
+    scheduler = RequestScheduler(max_concurrency=2, user_inflight=1, user_queue_size=5)
+    gate = asyncio.Event()
+    log = []
+
+    first = scheduler.submit(1, "m", make_job(log, "u1-a", gate))
+    second = scheduler.submit(1, "m", make_job(log, "u1-b", gate))
+    third = scheduler.submit(2, "m", make_job(log, "u2-a", gate))
+
+    assert first.position == 0
+    assert second.position > 0
+    assert third.position == 0
+    assert scheduler.stats()["in_flight"] == 2
+    assert scheduler.stats()["queued"] == 1
+
+    gate.set()
+    assert await second.result() == "u1-b"
+    assert scheduler.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_round_robin_between_users():
+    scheduler = RequestScheduler(max_concurrency=1, user_inflight=1, user_queue_size=5)
+    gate = asyncio.Event()
+    log = []
+
+    tickets = [scheduler.submit(1, "m", make_job(log, "u1-0", gate))]
+    tickets += [scheduler.submit(1, "m", make_job(log, f"u1-{i}", gate)) for i in range(1, 3)]
+    tickets += [scheduler.submit(2, "m", make_job(log, f"u2-{i}", gate)) for i in range(2)]
+
+    gate.set()
+    await asyncio.gather(*(t.result() for t in tickets))
+
+    assert log == ["start:u1-0", "start:u2-0", "start:u1-1", "start:u2-1", "start:u1-2"]
+
+
+@pytest.mark.asyncio
+async def test_per_model_limit_and_queue_full():
+    scheduler = RequestScheduler(
+        max_concurrency=10, user_inflight=5, user_queue_size=1, model_limits={"slow": 1}
+    )
+    gate = asyncio.Event()
+    log = []
+
+    scheduler.submit(1, "slow", make_job(log, "a", gate))
+    queued = scheduler.submit(2, "slow", make_job(log, "b", gate))
+    assert queued.position == 1
+
+    scheduler.submit(1, "slow", make_job(log, "c", gate))
+    with pytest.raises(QueueFullError):
+        scheduler.submit(1, "slow", make_job(log, "d", gate))
+
+    assert scheduler.cancel(queued) is True
+    gate.set()
+    await asyncio.sleep(0.01)
+    assert "start:b" not in log
+
+
+@pytest.mark.asyncio
+async def test_job_exception_is_propagated():
+    scheduler = RequestScheduler()
+
+    async def failing():
+        raise RuntimeError("boom")
+
+    ticket = scheduler.submit(1, "m", failing)
+    with pytest.raises(RuntimeError):
+        await ticket.result()
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_parse_model_limits():
+    assert parse_model_limits("a/b=2, c=5") == {"a/b": 2, "c": 5}
+    assert parse_model_limits("") == {}
@@ -5,7 +5,7 @@
 import pytest
 import os
 import logging
-from logging_config import setup_logging, DotTimeFormatter
+from logging_config import setup_logging, DotTimeFormatter, QueuedLogHandler
 
 
 def test_dot_time_formatter():
@@ -54,8 +54,11 @@ def test_setup_logging_with_custom_env(temp_log_dir, monkeypatch):
         assert len(root_logger.handlers) >= 1
         assert root_logger.level == logging.DEBUG
 
+        # Файл и консоль обслуживает слушатель очереди единственного обработчика корня
+        queued = [h for h in root_logger.handlers if isinstance(h, QueuedLogHandler)]
+        assert len(queued) == 1
         file_handlers = [
-            h for h in root_logger.handlers
+            h for h in queued[0].handlers
             if isinstance(h, logging.handlers.RotatingFileHandler)
         ]
 
@@ -70,5 +73,94 @@ def test_setup_logging_with_custom_env(temp_log_dir, monkeypatch):
         assert isinstance(formatter, DotTimeFormatter)
 
     finally:
+        for h in logging.root.handlers:
+            if h not in original_handlers:
+                h.close()
         logging.root.handlers = original_handlers
-        logging.root.setLevel(original_level)
\ No newline at end of file
+        logging.root.setLevel(original_level)
+
+
+def _flush(handler):
+    # Ждём, пока фоновый поток запишет всё из очереди
+    handler.listener.stop()
+    handler.listener.start()
+
+
+def _last_json_entry(log_dir):
+    import json
+
+    handler = next(h for h in logging.root.handlers if isinstance(h, QueuedLogHandler))
+    _flush(handler)
+    with open(log_dir / "test.log", encoding="utf-8") as f:
+        return json.loads(f.readlines()[-1])
+
+
+def test_json_lines_with_request_id(temp_log_dir):
+    from logging_config import bind_request_id
+
+    original_handlers = logging.root.handlers.copy()
+    try:
+        setup_logging(json_format=True, console=False)
+        bind_request_id(42)
+        logging.getLogger("bot.test").info("привет %s", "мир")
+
+        entry = _last_json_entry(temp_log_dir)
+        assert entry["message"] == "привет мир"
+        assert entry["request_id"] == "42"
+        assert entry["logger"] == "bot.test"
+        assert entry["level"] == "INFO"
+    finally:
+        for h in logging.root.handlers:
+            if h not in original_handlers:
+                h.close()
+        logging.root.handlers = original_handlers
+
+
+def test_json_exception_keeps_traceback(temp_log_dir):
+    original_handlers = logging.root.handlers.copy()
+    try:
+        setup_logging(json_format=True, console=False)
+        try:
+            raise ValueError("сломалось")
+        except ValueError:
+            logging.getLogger("bot.test").exception("ошибка обработки")
+
+        entry = _last_json_entry(temp_log_dir)
+        # Трейсбек форматируется в потоке слушателя и попадает в отдельное поле
+        assert entry["message"] == "ошибка обработки"
+        assert entry["level"] == "ERROR"
+        assert "ValueError: сломалось" in entry["exc"]
+        assert entry["exc"].startswith("Traceback")
+    finally:
+        for h in logging.root.handlers:
+            if h not in original_handlers:
+                h.close()
+        logging.root.handlers = original_handlers
+
+
+def test_sampling_filter_keeps_warnings():
+    from logging_config import SamplingFilter, parse_sampling
+
+    sampling = SamplingFilter(parse_sampling("bot.messages=0"))
+
+    def record(name, level):
+        return logging.LogRecord(name, level, "", 1, "msg", (), None)
+
+    assert not sampling.filter(record("bot.messages", logging.INFO))
+    assert not sampling.filter(record("bot.messages.child", logging.DEBUG))
+    assert sampling.filter(record("bot.messages", logging.WARNING))
+    assert sampling.filter(record("bot.other", logging.INFO))
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    target = logging.FileHandler(str(tmp_path / "x.log"), encoding="utf-8")
+    handler = QueuedLogHandler([target], queue_size=1)
+    handler.listener.stop()  # поток записи остановлен - очередь не разбирается
+    record = logging.LogRecord("x", logging.INFO, "", 1, "msg", (), None)
+
+    handler.emit(record)
+    handler.emit(record)
+    assert handler.dropped == 1
+
+    handler.listener = None
+    handler.close()
@@ -7,6 +7,7 @@ import time
 import threading
 from metrics import Counter, LatencyStats, LatencyMetric, MetricsRegistry, metric, timed
 import logging
+from unittest.mock import Mock
 
 
 def test_counter_increment():
@@ -69,7 +70,7 @@ def test_metrics_registry():
 
 
 def test_timed_decorator():
-    mock_logger = pytest.Mock(spec=logging.Logger)
+    mock_logger = Mock(spec=logging.Logger)
 
     @timed("test_function_ms", logger=mock_logger)
     def test_function(delay=0.05):
@@ -83,4 +84,56 @@ def test_timed_decorator():
     latency_data = metric.latency("test_function_ms").snapshot()
     assert latency_data["count"] == 1
     assert latency_data["total_ms"] >= 30
-    assert mock_logger.debug.called
\ No newline at end of file
+    assert mock_logger.debug.called
+
+
+def test_latency_percentiles_from_buckets():
+    stats = LatencyStats()
+    for value in range(1, 101):
+        stats.observe(value)
+
+    snapshot = stats.snapshot()
+    assert snapshot["count"] == 100
+    assert 40 <= snapshot["p50_ms"] <= 60
+    assert 90 <= snapshot["p95_ms"] <= 100
+    assert snapshot["p50_ms"] <= snapshot["p95_ms"] <= snapshot["p99_ms"] <= snapshot["max_ms"]
+    assert sum(snapshot["buckets"].values()) == 100
+
+
+def test_counter_is_consistent_across_threads():
+    counter = Counter("threaded")
+
+    def worker():
+        for _ in range(1000):
+            counter.inc()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.get() == 8000
+
+
+def test_labels_are_separate_series():
+    registry = MetricsRegistry()
+    registry.counter("calls", command="ask").inc()
+    registry.counter("calls", command="help").inc(2)
+
+    assert registry.counter("calls", command="ask") is not registry.counter("calls", command="help")
+    counters = registry.snapshot()["counters"]
+    assert counters['calls{command="ask"}'] == 1
+    assert counters['calls{command="help"}'] == 2
+
+
+@pytest.mark.asyncio
+async def test_timed_async_function():
+    registry = MetricsRegistry()
+
+    @timed("coro_ms", registry=registry, command="x")
+    async def coro():
+        return 42
+
+    assert await coro() == 42
+    assert registry.latency("coro_ms", command="x").count == 1
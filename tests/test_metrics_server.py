@@ -0,0 +1,84 @@
+"""
+Тесты для модуля metrics_server.py
+"""
+
+import asyncio
+import pytest
+
+from metrics import MetricsRegistry
+from metrics_server import MetricsServer, render_openmetrics
+
+
+def test_render_openmetrics():
+    registry = MetricsRegistry()
+    registry.counter("openrouter_tokens_total", model="m", type="prompt").inc(12)
+    registry.counter("handler_errors").inc()
+    registry.latency("handler_latency_ms", command="ask").observe(7)
+    registry.latency("handler_latency_ms", command="ask").observe(300)
+    registry.register_collector("test", lambda: {'llm_scheduler_queued': 3})
+
+    text = render_openmetrics(registry.snapshot())
+    lines = text.splitlines()
+
+    assert "# TYPE openrouter_tokens counter" in lines
+    assert 'openrouter_tokens_total{model="m",type="prompt"} 12' in lines
+    assert "handler_errors_total 1" in lines
+    assert "# TYPE llm_scheduler_queued gauge" in lines
+    assert "llm_scheduler_queued 3" in lines
+    assert "# TYPE handler_latency_ms histogram" in lines
+    assert 'handler_latency_ms_bucket{command="ask",le="5"} 0' in lines
+    assert 'handler_latency_ms_bucket{command="ask",le="10"} 1' in lines
+    assert 'handler_latency_ms_bucket{command="ask",le="+Inf"} 2' in lines
+    assert 'handler_latency_ms_count{command="ask"} 2' in lines
+    assert 'handler_latency_ms_sum{command="ask"} 307' in lines
+    assert lines[-1] == "# EOF"
+
+
+def test_failing_collector_is_skipped():
+    registry = MetricsRegistry()
+
+    def broken():
+        raise RuntimeError("boom")
+
+    registry.register_collector("broken", broken)
+    registry.register_collector("ok", lambda: {"up": 1})
+
+    assert registry.snapshot()["gauges"] == {"up": 1}
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    registry = MetricsRegistry()
+    registry.counter("requests_total").inc(5)
+    server = MetricsServer(registry, host="127.0.0.1", port=0, cache_s=60)
+    await server.start()
+
+    async def fetch(path: str) -> bytes:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return response
+
+    try:
+        response = await fetch("/metrics")
+        assert response.startswith(b"HTTP/1.1 200 OK")
+        assert b"application/openmetrics-text" in response
+        assert b"requests_total 5" in response
+
+        # Снимок кэшируется на cache_s секунд
+        registry.counter("requests_total").inc()
+        assert b"requests_total 5" in await fetch("/metrics")
+
+        assert (await fetch("/other")).startswith(b"HTTP/1.1 404")
+    finally:
+        await server.stop()
+
+
+def test_collect_bot_metrics(main_module):
+    gauges = main_module.collect_bot_metrics()
+
+    assert gauges["llm_scheduler_in_flight"] == 0
+    assert 'cache_hit_rate{cache="catalog"}' in gauges
+    assert 'cache_hits{cache="responses"}' in gauges
@@ -0,0 +1,214 @@
+"""
+Тесты для заметок в db.py (main3.py)
+"""
+
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def notes(tmp_path):
+    import db
+    db.init_db(str(tmp_path / "notes.db"))
+    yield db
+    db._notes_pool.close()
+
+
+def test_add_and_list_with_keyset_pagination(notes):
+    ids = [notes.add_note(1, f"заметка {i}") for i in range(5)]
+    notes.add_note(2, "чужая заметка")
+
+    first_page = notes.list_notes(1, limit=2)
+    assert [n['id'] for n in first_page] == [ids[4], ids[3]]
+    assert first_page[0]['text'] == "заметка 4"
+    assert first_page[0]['created_at']
+
+    second_page = notes.list_notes(1, limit=2, before_id=first_page[-1]['id'])
+    assert [n['id'] for n in second_page] == [ids[2], ids[1]]
+    assert [n['id'] for n in notes.list_notes(1, limit=10, before_id=ids[1])] == [ids[0]]
+
+
+def test_duplicate_note_is_rejected(notes):
+    notes.add_note(1, "купить молоко")
+    with pytest.raises(sqlite3.IntegrityError):
+        notes.add_note(1, "купить молоко")
+    # У другого пользователя такая же заметка допустима
+    notes.add_note(2, "купить молоко")
+
+    other_id = notes.add_note(1, "купить хлеб")
+    with pytest.raises(sqlite3.IntegrityError):
+        notes.update_note(1, other_id, "купить молоко")
+
+    # Уникальность держит индекс по хэшу, а не копия текста в индексе
+    with notes._notes_connection() as conn:
+        indexed = [row[2] for row in conn.execute("PRAGMA index_info(idx_notes_user_text_hash)")]
+    assert indexed == ["user_id", "text_hash"]
+
+
+def test_add_notes_batch_is_atomic(notes, monkeypatch):
+    monkeypatch.setattr(notes, "NOTES_BATCH_SIZE", 3)
+    ids = notes.add_notes(1, [f"n{i}" for i in range(7)])
+    assert ids == [n['id'] for n in notes.export_notes(1)]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        notes.add_notes(1, ["новая", "n0"])
+    assert notes.count_notes(1) == 7
+
+
+def test_update_and_delete_only_own_notes(notes):
+    note_id = notes.add_note(1, "черновик")
+
+    assert notes.update_note(2, note_id, "взлом") is False
+    assert notes.update_note(1, note_id, "чистовик") is True
+    assert notes.list_notes(1)[0]['text'] == "чистовик"
+    assert notes.list_notes(1)[0]['updated_at'] is not None
+
+    assert notes.delete_note(2, note_id) is False
+    assert notes.delete_note(1, note_id) is True
+    assert notes.delete_note(1, note_id) is False
+    assert notes.count_notes(1) == 0
+
+
+def test_find_notes(notes):
+    notes.add_note(1, "Позвонить маме")
+    notes.add_note(1, "позвонить в банк насчёт карты")
+    notes.add_note(1, "Купить молоко")
+    notes.add_note(2, "Позвонить другу")
+
+    # Регистр кириллицы не важен, слова ищутся по началу
+    assert {n['text'] for n in notes.find_notes(1, "ПОЗВОН")} == {
+        "Позвонить маме", "позвонить в банк насчёт карты"
+    }
+    assert [n['text'] for n in notes.find_notes(1, "позвонить мам")] == ["Позвонить маме"]
+    assert notes.find_notes(1, "другу") == []
+    # Операторы FTS5 во вводе не ломают запрос
+    assert notes.find_notes(1, 'молоко" OR "*') == []
+    assert notes.find_notes(1, "  ") == []
+
+
+def test_find_notes_ranking_snippet_and_pages(notes):
+    notes.add_note(1, "кот " + "слово " * 30)
+    notes.add_note(1, "кот кот кот <дома>")
+    for i in range(3):
+        notes.add_note(1, f"кот номер {i}")
+
+    results = notes.find_notes(1, "кот", limit=2)
+    assert results[0]['text'] == "кот кот кот <дома>"
+    assert results[0]['snippet'] == "<b>кот</b> <b>кот</b> <b>кот</b> &lt;дома&gt;"
+
+    pages = results + notes.find_notes(1, "кот", limit=2, offset=2) + notes.find_notes(1, "кот", limit=2, offset=4)
+    assert len({n['id'] for n in pages}) == 5
+
+
+def test_search_index_follows_edits(notes):
+    note_id = notes.add_note(1, "старый текст")
+    notes.update_note(1, note_id, "новый текст")
+
+    assert notes.find_notes(1, "старый") == []
+    assert [n['id'] for n in notes.find_notes(1, "новый")] == [note_id]
+
+    notes.delete_note(1, note_id)
+    assert notes.find_notes(1, "текст") == []
+
+
+def test_search_index_built_for_existing_notes(tmp_path):
+    import db
+    path = str(tmp_path / "old.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE notes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+            "text TEXT NOT NULL, created_at TEXT NOT NULL DEFAULT (datetime('now')), updated_at TEXT)"
+        )
+        conn.execute("INSERT INTO notes (user_id, text) VALUES (1, 'заметка до индекса')")
+
+    db.init_db(path)
+    assert [n['text'] for n in db.find_notes(1, "индекс")] == ["заметка до индекса"]
+    # Старые заметки получили хэш и тоже защищены от дубликатов
+    with pytest.raises(sqlite3.IntegrityError):
+        db.add_note(1, "заметка до индекса")
+    db._notes_pool.close()
+
+
+def test_count_and_statistics(notes):
+    notes.add_notes(1, ["a", "b", "c"])
+    with notes._notes_connection() as conn:
+        conn.execute("UPDATE notes SET created_at = datetime('now', '-3 days') WHERE text = 'c'")
+        conn.execute("UPDATE notes SET created_at = datetime('now', '-30 days') WHERE text = 'b'")
+        conn.commit()
+
+    assert notes.count_notes(1) == 3
+    stats = notes.get_notes_statistics(1, days=7)
+    assert [s['count'] for s in stats] == [1, 1]
+    assert stats[0]['date'] > stats[1]['date']
+
+
+def test_per_user_queries_use_indexes(notes):
+    with notes._notes_connection() as conn:
+        plan = " ".join(row[3] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM notes WHERE user_id = 1 AND id < 100 ORDER BY id DESC LIMIT 10"
+        ))
+        assert "idx_notes_user_id" in plan
+        plan = " ".join(row[3] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT COUNT(*) FROM notes WHERE user_id = 1 AND created_at >= '2024-01-01'"
+        ))
+        assert "idx_notes_user_created" in plan
+
+
+def test_rollups_follow_add_edit_delete(notes):
+    ids = notes.add_notes(1, ["a", "b", "c"])
+    notes.update_note(1, ids[0], "a2")
+    notes.delete_note(1, ids[1])
+
+    stats = notes.get_notes_statistics(1, days=1)
+    assert len(stats) == 1
+    assert stats[0]['count'] == 2
+    assert stats[0]['edited'] == 1
+
+    with notes._notes_connection() as conn:
+        real = conn.execute("SELECT COUNT(*) FROM notes WHERE user_id = 1").fetchone()[0]
+    assert notes.count_notes(1) == real == 2
+
+
+def test_count_sees_writes_from_other_connections(notes, tmp_path):
+    notes.add_note(1, "a")
+    assert notes.count_notes(1) == 1
+
+    # Другой процесс пишет в ту же БД мимо функций модуля
+    other = sqlite3.connect(str(tmp_path / "notes.db"))
+    other.execute("INSERT INTO notes (user_id, text) VALUES (1, 'b')")
+    other.commit()
+    other.close()
+
+    assert notes.count_notes(1) == 2
+    assert notes.count_notes(99) == 0
+
+
+def test_statistics_window(notes):
+    notes.add_notes(1, ["a", "b"])
+    with notes._notes_connection() as conn:
+        conn.execute("UPDATE notes SET created_at = '2024-03-10 12:00:00' WHERE text = 'a'")
+        conn.execute("UPDATE notes SET created_at = '2024-03-01 08:00:00' WHERE text = 'b'")
+        conn.commit()
+
+    assert [s['date'] for s in notes.get_notes_statistics(1, days=10, until="2024-03-10")] == [
+        "2024-03-10", "2024-03-01"
+    ]
+    assert [s['date'] for s in notes.get_notes_statistics(1, days=9, until="2024-03-10")] == ["2024-03-10"]
+    assert notes.get_notes_statistics(1, days=7) == []
+
+
+def test_rollups_backfilled_for_existing_notes(tmp_path):
+    import db
+    path = str(tmp_path / "old.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE notes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+            "text TEXT NOT NULL, created_at TEXT NOT NULL DEFAULT (datetime('now')), updated_at TEXT)"
+        )
+        conn.executemany("INSERT INTO notes (user_id, text) VALUES (?, ?)", [(1, "x"), (1, "y"), (2, "z")])
+
+    db.init_db(path)
+    assert db.count_notes(1) == 2
+    assert db.get_notes_statistics(2)[0]['count'] == 1
+    db._notes_pool.close()
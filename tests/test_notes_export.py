@@ -0,0 +1,76 @@
+"""
+Тесты для модуля notes_export.py
+"""
+
+import csv
+import gzip
+import io
+import json
+import os
+
+import pytest
+
+import notes_export
+
+
+@pytest.fixture
+def notes(tmp_path, monkeypatch):
+    import db
+    db.init_db(str(tmp_path / "notes.db"))
+    # Порции по 2 строки - проверяем склейку порций
+    monkeypatch.setattr(notes_export, "EXPORT_CHUNK_ROWS", 2)
+    db.add_notes(1, ["первая", 'с запятой, "кавычками"\nи переводом строки', "третья"])
+    db.add_note(2, "чужая")
+    yield db
+    db._notes_pool.close()
+
+
+def test_txt_export(notes):
+    export = notes_export.export_notes(1, title="Экспорт заметок пользователя Тест")
+    with export.file:
+        text = export.file.read().decode("utf-8")
+
+    assert export.filename == "notes_1.txt"
+    assert export.count == 3
+    assert text.startswith("Экспорт заметок пользователя Тест\nВсего заметок: 3\n")
+    assert "- первая\n" in text and "- третья\n" in text
+    assert "чужая" not in text
+
+
+def test_csv_and_jsonl_round_trip(notes):
+    export = notes_export.export_notes(1, "csv")
+    with export.file:
+        rows = list(csv.DictReader(io.TextIOWrapper(export.file, encoding="utf-8", newline="")))
+    assert [r["text"] for r in rows] == ["первая", 'с запятой, "кавычками"\nи переводом строки', "третья"]
+
+    export = notes_export.export_notes(1, "jsonl")
+    with export.file:
+        records = [json.loads(line) for line in export.file.read().decode("utf-8").splitlines()]
+    assert [r["text"] for r in records] == [r["text"] for r in rows]
+    assert set(records[0]) == {"id", "text", "created_at", "updated_at"}
+
+
+def test_gzip_export(notes):
+    export = notes_export.export_notes(1, "jsonl", compress=True)
+    with export.file:
+        data = gzip.decompress(export.file.read()).decode("utf-8")
+
+    assert export.filename == "notes_1.jsonl.gz"
+    assert len(data.splitlines()) == 3
+
+
+def test_large_export_spills_without_leaving_files(notes, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(notes_export, "EXPORT_SPOOL_BYTES", 64)
+    files_before = set(os.listdir(tmp_path))
+
+    export = notes_export.export_notes(1)
+    assert export.file._rolled  # перешёл с памяти на анонимный временный файл
+    export.file.close()
+
+    assert set(os.listdir(tmp_path)) == files_before
+
+
+def test_unknown_format(notes):
+    with pytest.raises(ValueError):
+        notes_export.export_notes(1, "xml")
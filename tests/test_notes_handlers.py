@@ -0,0 +1,154 @@
+"""
+Тесты для модуля notes_handlers.py
+"""
+
+import asyncio
+import threading
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+import notes_handlers
+
+
+@pytest.fixture
+def notes(tmp_path):
+    import db
+    db.init_db(str(tmp_path / "notes.db"))
+    yield db
+    notes_handlers.close()
+    db._notes_pool.close()
+
+
+def _update(text: str, user_id: int = 12345):
+    update = MagicMock()
+    update.effective_user.id = user_id
+    update.effective_user.first_name = "TestUser"
+    update.message.text = text
+    update.message.reply_text = AsyncMock()
+    update.message.reply_document = AsyncMock()
+    return update
+
+
+def _context(text: str):
+    context = MagicMock()
+    context.args = text.split()[1:]
+    return context
+
+
+async def _call(handler, text: str, user_id: int = 12345):
+    update = _update(text, user_id)
+    await handler(update, _context(text))
+    return update
+
+
+def _reply(update) -> str:
+    return update.message.reply_text.call_args[0][0]
+
+
+@pytest.mark.asyncio
+async def test_add_list_and_pages(notes, monkeypatch):
+    monkeypatch.setattr(notes_handlers, "NOTES_PAGE_SIZE", 2)
+    for i in range(3):
+        update = await _call(notes_handlers.note_add, f"/note_add заметка <{i}>")
+        assert "добавлена" in _reply(update)
+
+    update = await _call(notes_handlers.note_list, "/note_list")
+    text = _reply(update)
+    assert "заметка &lt;2&gt;" in text and "заметка &lt;0&gt;" not in text
+    assert update.message.reply_text.call_args[1]["parse_mode"] == "HTML"
+
+    next_page = text.rsplit("/note_list ", 1)[1]
+    update = await _call(notes_handlers.note_list, f"/note_list {next_page}")
+    assert "заметка &lt;0&gt;" in _reply(update)
+
+
+@pytest.mark.asyncio
+async def test_add_validation_and_duplicates(notes):
+    assert "Использование" in _reply(await _call(notes_handlers.note_add, "/note_add"))
+    too_long = "x" * (notes_handlers.NOTE_MAX_LENGTH + 1)
+    assert "слишком длинная" in _reply(await _call(notes_handlers.note_add, f"/note_add {too_long}"))
+
+    await _call(notes_handlers.note_add, "/note_add молоко")
+    assert "уже существует" in _reply(await _call(notes_handlers.note_add, "/note_add молоко"))
+    note_id = notes.add_note(12345, "хлеб")
+    assert "уже существует" in _reply(await _call(notes_handlers.note_edit, f"/note_edit {note_id} молоко"))
+
+
+@pytest.mark.asyncio
+async def test_find_edit_delete_and_count(notes):
+    note_id = notes.add_note(12345, "Позвонить маме")
+    notes.add_note(1, "Позвонить другу")
+
+    update = await _call(notes_handlers.note_find, "/note_find позвон")
+    assert "<b>Позвонить</b> маме" in _reply(update) and "другу" not in _reply(update)
+
+    assert "обновлена" in _reply(await _call(notes_handlers.note_edit, f"/note_edit {note_id} Позвонить папе"))
+    assert "не найдена" in _reply(await _call(notes_handlers.note_edit, f"/note_edit {note_id} чужое", user_id=1))
+    assert "числом" in _reply(await _call(notes_handlers.note_del, "/note_del abc"))
+
+    text = _reply(await _call(notes_handlers.note_count, "/note_count"))
+    assert "Всего заметок: *1*" in text and "правок: 1" in text
+
+    assert "удалена" in _reply(await _call(notes_handlers.note_del, f"/note_del {note_id}"))
+    assert "не найдена" in _reply(await _call(notes_handlers.note_del, f"/note_del {note_id}"))
+
+
+@pytest.mark.asyncio
+async def test_export_sends_document(notes):
+    assert "нет заметок" in _reply(await _call(notes_handlers.note_export, "/note_export"))
+
+    notes.add_notes(12345, ["a", "b"])
+    update = await _call(notes_handlers.note_export, "/note_export jsonl gz")
+
+    kwargs = update.message.reply_document.call_args[1]
+    assert kwargs["document"].filename == "notes_12345.jsonl.gz"
+    assert "(2)" in kwargs["caption"]
+    assert kwargs["document"].input_file_content.closed
+
+
+@pytest.mark.asyncio
+async def test_db_work_runs_off_the_event_loop(notes, monkeypatch):
+    threads = []
+
+    def record_thread(user_id):
+        threads.append(threading.current_thread().name)
+        return 0
+
+    monkeypatch.setattr(notes, "count_notes", record_thread)
+    monkeypatch.setattr(notes, "get_notes_statistics", lambda user_id, days: [])
+
+    await asyncio.gather(*(_call(notes_handlers.note_count, "/note_count", user_id=i) for i in range(5)))
+    assert threads and all(name.startswith("notes-db") for name in threads)
+
+
+def test_registered_in_main_application(main_module):
+    application = main_module.build_application("123:test")
+    commands = {c for h in application.handlers[0] for c in getattr(h, "commands", ())}
+    assert {cmd for cmd, _ in notes_handlers.COMMANDS} <= commands
+    assert set(notes_handlers.COMMANDS) <= set(main_module.COMMANDS)
+
+
+@pytest.mark.asyncio
+async def test_slow_export_does_not_block_other_chats(notes, bot_app, monkeypatch):
+    notes.add_note(1, "первая")
+    notes.add_note(2, "вторая")
+    release = threading.Event()
+    real_export = notes_handlers.export_notes
+
+    def slow_export(*args):
+        release.wait(5)
+        return real_export(*args)
+
+    monkeypatch.setattr(notes_handlers, "export_notes", slow_export)
+
+    async with bot_app:
+        await bot_app.send("/note_export", user_id=1)
+        await bot_app.send("/note_count", user_id=2)
+        try:
+            # Экспорт первого чата ещё собирается, а второй чат уже получил ответ
+            await bot_app.wait_for(lambda: bot_app.replied(2, "Всего заметок"))
+            assert bot_app.api.counts["sendDocument"] == 0
+        finally:
+            release.set()
+        await bot_app.wait_for(lambda: bot_app.replied(1, "Ваши заметки (1)"))
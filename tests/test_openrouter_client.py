@@ -210,4 +210,257 @@ def test_openrouter_client_module_reload(monkeypatch):
 
     # Проверяем, что модуль перезагрузился
     # (в реальном коде нужно проверить, что ключ используется)
-    assert reloaded_module is not None
\ No newline at end of file
+    assert reloaded_module is not None
+
+
+def _async_client(openrouter_module, handler):
+    """AsyncOpenRouterClient, чьи запросы обрабатывает handler(request) вместо сети."""
+    import httpx
+
+    client = openrouter_module.AsyncOpenRouterClient()
+    client._client = httpx.AsyncClient(
+        base_url=client.base_url,
+        headers=openrouter_module._build_headers(client.api_key),
+        transport=httpx.MockTransport(handler)
+    )
+    return client
+
+
+@pytest.mark.asyncio
+async def test_async_generate_response_success(openrouter_module):
+    """Тест успешного запроса асинхронного клиента"""
+    import httpx
+
+    def handler(request):
+        body = json.loads(request.content)
+        assert request.url.path.endswith("/chat/completions")
+        assert request.headers["Authorization"] == "Bearer test_key"
+        assert body["model"] == "test-model"
+        assert body["max_tokens"] == 100
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "async ok"}}],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 2}
+        })
+
+    client = _async_client(openrouter_module, handler)
+    result = await client.generate_response(
+        model="test-model",
+        messages=[{"role": "user", "content": "Hi"}],
+        max_tokens=100
+    )
+    await client.aclose()
+
+    assert result["text"] == "async ok"
+    assert result["model"] == "test-model"
+    assert result["usage"]["completion_tokens"] == 2
+    assert result["latency_ms"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_async_generate_response_http_error(openrouter_module):
+    """Тест ошибки HTTP в асинхронном клиенте"""
+    import httpx
+
+    client = _async_client(
+        openrouter_module,
+        lambda request: httpx.Response(401, json={"error": {"message": "Invalid API key"}})
+    )
+
+    with pytest.raises(openrouter_module.OpenRouterError) as exc_info:
+        await client.generate_response(model="test-model", messages=[{"role": "user", "content": "Hi"}])
+    await client.aclose()
+
+    assert exc_info.value.status == 401
+    assert "Invalid API key" in str(exc_info.value)
+
+
+@pytest.mark.asyncio
+async def test_async_generate_response_timeout(openrouter_module):
+    """Тест таймаута асинхронного клиента"""
+    import httpx
+
+    def handler(request):
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    client = _async_client(openrouter_module, handler)
+
+    with pytest.raises(openrouter_module.OpenRouterError) as exc_info:
+        await client.generate_response(model="test-model", messages=[{"role": "user", "content": "Hi"}])
+    await client.aclose()
+
+    assert exc_info.value.message == "Таймаут запроса к OpenRouter API"
+
+
+@pytest.mark.asyncio
+async def test_async_client_aclose(openrouter_module):
+    """Тест aclose(): сессия закрывается, следующий запрос открывает новую"""
+    client = openrouter_module.AsyncOpenRouterClient()
+    session = client._get_client()
+    assert client._get_client() is session
+
+    await client.aclose()
+    assert session.is_closed
+    assert client._client is None
+    await client.aclose()  # повторный вызов безопасен
+
+    new_session = client._get_client()
+    assert new_session is not session
+    await client.aclose()
+
+
+@responses.activate
+def test_chat_once_reuses_one_session(openrouter_module, monkeypatch):
+    """Тест: повторные вызовы chat_once идут через одну сессию с пулом соединений"""
+    import requests
+
+    url = "https://openrouter.ai/api/v1/chat/completions"
+    responses.add(responses.POST, url, json={"choices": [{"message": {"content": "ok"}}]}, status=200)
+
+    sessions = []
+    original_post = requests.Session.post
+
+    def recording_post(self, *args, **kwargs):
+        sessions.append(self)
+        return original_post(self, *args, **kwargs)
+
+    monkeypatch.setattr(requests.Session, "post", recording_post)
+    monkeypatch.setattr(openrouter_module, "_default_client", None)
+
+    for _ in range(2):
+        openrouter_module.chat_once(messages=[{"role": "user", "content": "Hi"}], model="test-model")
+
+    assert len(sessions) == 2
+    assert sessions[0] is sessions[1]
+    client = openrouter_module.get_default_client()
+    assert client.session is sessions[0]
+    assert client.session.get_adapter(url)._pool_maxsize == client.pool_size
+    client.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_response_yields_deltas(openrouter_module):
+    """Тест потоковой генерации (SSE)"""
+    import httpx
+
+    chunks = [
+        ": OPENROUTER PROCESSING",
+        "",
+        'data: {"choices": [{"delta": {"content": "Привет"}}]}',
+        "",
+        'data: {"choices": [{"delta": {"content": ", мир"}}]}',
+        "",
+        "data: [DONE]",
+        ""
+    ]
+
+    def handler(request):
+        body = json.loads(request.content)
+        assert body["stream"] is True
+        return httpx.Response(200, text="\n".join(chunks))
+
+    client = openrouter_module.AsyncOpenRouterClient()
+    client._client = httpx.AsyncClient(
+        base_url=client.base_url,
+        transport=httpx.MockTransport(handler)
+    )
+
+    deltas = [delta async for delta in client.stream_response(
+        model="test-model",
+        messages=[{"role": "user", "content": "Hi"}]
+    )]
+    await client.aclose()
+
+    assert deltas == ["Привет", ", мир"]
+
+
+@responses.activate
+def test_retry_on_server_error_then_success(openrouter_module):
+    """Тест повтора после временной ошибки 503"""
+    url = "https://openrouter.ai/api/v1/chat/completions"
+    responses.add(responses.POST, url, json={"error": {"message": "busy"}}, status=503)
+    responses.add(
+        responses.POST, url,
+        json={"choices": [{"message": {"content": "ok"}}]},
+        status=200
+    )
+
+    policy = openrouter_module.RetryPolicy(max_retries=2, base_delay_s=0, deadline_s=5)
+    client = openrouter_module.OpenRouterClient(retry_policy=policy)
+    result = client.generate_response(model="test-model", messages=[{"role": "user", "content": "Hi"}])
+
+    assert result["text"] == "ok"
+    assert len(responses.calls) == 2
+    assert policy.stats()["retries"] == 1
+
+
+@responses.activate
+def test_no_retry_on_bad_request(openrouter_module):
+    """Тест: ошибка 400 не повторяется"""
+    url = "https://openrouter.ai/api/v1/chat/completions"
+    responses.add(responses.POST, url, json={"error": {"message": "bad"}}, status=400)
+
+    policy = openrouter_module.RetryPolicy(max_retries=3, base_delay_s=0)
+    client = openrouter_module.OpenRouterClient(retry_policy=policy)
+
+    with pytest.raises(openrouter_module.OpenRouterError) as exc_info:
+        client.generate_response(model="test-model", messages=[{"role": "user", "content": "Hi"}])
+
+    assert exc_info.value.status == 400
+    assert len(responses.calls) == 1
+    assert policy.stats()["retries"] == 0
+
+
+@responses.activate
+def test_retry_after_exceeding_deadline_gives_up(openrouter_module):
+    """Тест: Retry-After больше оставшегося бюджета - повтора нет"""
+    url = "https://openrouter.ai/api/v1/chat/completions"
+    responses.add(
+        responses.POST, url,
+        json={"error": {"message": "slow down"}},
+        status=429,
+        headers={"Retry-After": "120"}
+    )
+
+    policy = openrouter_module.RetryPolicy(max_retries=3, base_delay_s=0, deadline_s=10)
+    client = openrouter_module.OpenRouterClient(retry_policy=policy)
+
+    with pytest.raises(openrouter_module.OpenRouterError) as exc_info:
+        client.generate_response(model="test-model", messages=[{"role": "user", "content": "Hi"}])
+
+    assert exc_info.value.retry_after == 120
+    assert len(responses.calls) == 1
+    assert policy.stats()["gave_up"] == 1
+
+
+@responses.activate
+def test_sync_client_circuit_breaker(openrouter_module):
+    """Тест: после серии ошибок синхронный клиент отклоняет запросы без обращения к API"""
+    from circuit_breaker import CircuitBreakerRegistry, OPEN
+
+    url = "https://openrouter.ai/api/v1/chat/completions"
+    responses.add(responses.POST, url, json={"error": {"message": "busy"}}, status=503)
+
+    breakers = CircuitBreakerRegistry(min_calls=2, failure_rate=0.5, open_s=60)
+    policy = openrouter_module.RetryPolicy(max_retries=0)
+    client = openrouter_module.OpenRouterClient(retry_policy=policy, breakers=breakers)
+    messages = [{"role": "user", "content": "Hi"}]
+
+    for _ in range(2):
+        with pytest.raises(openrouter_module.OpenRouterError):
+            client.generate_response(model="test-model", messages=messages)
+    assert breakers.get("test-model").state == OPEN
+
+    with pytest.raises(openrouter_module.CircuitOpenError):
+        client.generate_response(model="test-model", messages=messages)
+    assert len(responses.calls) == 2
+    # Выключатели других моделей не затронуты
+    assert breakers.is_available("other-model")
+
+
+def test_sse_usage_chunk_is_recognized(openrouter_module):
+    usage_line = 'data: {"choices": [{"delta": {"content": ""}}], "usage": {"prompt_tokens": 5, "completion_tokens": 7}}'
+    parsed = openrouter_module._parse_sse_line(usage_line)
+
+    assert isinstance(parsed, openrouter_module._SSEUsage)
+    assert parsed["completion_tokens"] == 7
+    assert openrouter_module._parse_sse_line('data: {"choices": [{"delta": {"content": "hi"}}]}') == "hi"
@@ -0,0 +1,111 @@
+"""
+Тесты для модуля rate_limit.py
+"""
+
+import pytest
+
+from rate_limit import RateLimiter, BucketStore, parse_rate, parse_command_rates
+
+
+def make_limiter(**overrides):
+    options = dict(
+        user_rate=(3, 3),
+        chat_rate=(100, 1),
+        command_rates={"ask": (1, 10)},
+        global_rate=(100, 1),
+        global_commands={"ask"},
+    )
+    options.update(overrides)
+    return RateLimiter(**options)
+
+
+def test_parse_rates():
+    assert parse_rate("5/60") == (5.0, 60.0)
+    assert parse_rate("0") is None
+    assert parse_command_rates("ask=2/10, help=0") == {"ask": (2.0, 10.0)}
+
+
+def test_user_bucket_refills():
+    limiter = make_limiter()
+
+    for _ in range(3):
+        assert limiter.check(1, 1, "help", now=0)[0]
+
+    allowed, retry_after, scope = limiter.check(1, 1, "help", now=0)
+    assert not allowed
+    assert scope == "user"
+    assert retry_after == pytest.approx(1.0)
+
+    assert limiter.check(1, 1, "help", now=1.0)[0]
+    # Другой пользователь не зависит от первого
+    assert limiter.check(2, 2, "help", now=1.0)[0]
+
+
+def test_command_limit_does_not_consume_on_denial():
+    limiter = make_limiter()
+
+    assert limiter.check(1, 1, "ask", now=0)[0]
+    allowed, retry_after, scope = limiter.check(1, 1, "ask", now=1)
+    assert not allowed
+    assert scope == "command"
+    assert retry_after == pytest.approx(9.0)
+
+    # Отказ по команде не списал токен из корзины пользователя
+    assert limiter.check(1, 1, "help", now=1)[0]
+    assert limiter.check(1, 1, "help", now=1)[0]
+
+
+def test_global_and_chat_buckets():
+    limiter = make_limiter(user_rate=(100, 1), command_rates={}, global_rate=(2, 1), chat_rate=(3, 60))
+
+    assert limiter.check(1, -100, "ask", now=0)[0]
+    assert limiter.check(2, -100, "ask", now=0)[0]
+    allowed, _, scope = limiter.check(3, -200, "ask", now=0)
+    assert not allowed and scope == "global"
+
+    assert limiter.check(4, -100, "help", now=0)[0]
+    allowed, _, scope = limiter.check(5, -100, "help", now=0)
+    assert not allowed and scope == "chat"
+
+
+def test_notice_is_throttled():
+    limiter = make_limiter()
+    assert limiter.should_notify(1, now=0)
+    assert not limiter.should_notify(1, now=5)
+    assert limiter.should_notify(1, now=10)
+
+
+def test_idle_buckets_are_evicted():
+    store = BucketStore(idle_s=60, max_size=1000)
+    for user_id in range(100):
+        store.get(("user", user_id), (5, 5), now=0)
+    assert len(store) == 100
+
+    # Каждое обращение после простоя вытесняет старые полностью восстановленные корзины
+    for i in range(60):
+        store.get(("user", 1000 + i), (5, 5), now=100)
+    assert len(store) <= 60
+    assert store.evicted >= 100
+
+
+def test_store_size_is_bounded():
+    store = BucketStore(idle_s=3600, max_size=10)
+    for user_id in range(50):
+        store.get(user_id, (1, 60), now=user_id)
+    assert len(store) == 10
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_middleware_replies_and_stops(main_module, mock_update, mock_context):
+    from telegram.ext import ApplicationHandlerStop
+
+    main_module.rate_limiter = make_limiter(user_rate=(1, 60))
+    mock_update.effective_message = mock_update.message
+    mock_update.message.text = "/help"
+
+    await main_module.enforce_rate_limit(mock_update, mock_context)
+    with pytest.raises(ApplicationHandlerStop):
+        await main_module.enforce_rate_limit(mock_update, mock_context)
+
+    response_text = mock_update.message.reply_text.call_args[0][0]
+    assert "Попробуйте снова через 60 с" in response_text
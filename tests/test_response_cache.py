@@ -0,0 +1,65 @@
+"""
+Тесты для модуля response_cache.py
+"""
+
+import pytest
+
+from response_cache import ResponseCache, make_cache_key
+
+MESSAGES = [
+    {"role": "system", "content": "Ты полезный AI-ассистент."},
+    {"role": "user", "content": "Что такое ИИ?"}
+]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), ttl_s=60, memory_size=10, enabled=True)
+    yield cache
+    cache.close()
+
+
+def test_cache_key_depends_on_all_parameters():
+    key = make_cache_key("m", MESSAGES, 0, 100)
+    assert key == make_cache_key("m", [dict(m) for m in MESSAGES], 0, 100)
+    assert key != make_cache_key("other", MESSAGES, 0, 100)
+    assert key != make_cache_key("m", MESSAGES, 0, 200)
+    assert key != make_cache_key("m", MESSAGES, 0.5, 100)
+
+
+def test_only_deterministic_requests_are_cacheable(cache):
+    assert cache.is_cacheable(0) is True
+    assert cache.is_cacheable(0.7) is False
+
+    cache.enabled = False
+    assert cache.is_cacheable(0) is False
+
+
+def test_memory_and_sqlite_tiers(cache, tmp_path):
+    key = make_cache_key("m", MESSAGES, 0, 100)
+    assert cache.get(key) is None
+
+    cache.put(key, "m", "Ответ")
+    assert cache.get(key) == {"model": "m", "text": "Ответ"}
+
+    # Новый экземпляр (другой процесс) видит запись через SQLite
+    other = ResponseCache(str(tmp_path / "cache.db"), enabled=True)
+    assert other.get(key)["text"] == "Ответ"
+    assert other.stats.snapshot()["hits"] == 1
+    other.close()
+
+
+def test_expired_entries_are_ignored(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), ttl_s=-1, enabled=True)
+    key = make_cache_key("m", MESSAGES, 0, 100)
+    cache.put(key, "m", "Ответ")
+    assert cache.get(key) is None
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_async_access(cache):
+    key = make_cache_key("m", MESSAGES, 0, 100)
+    await cache.aput(key, "m", "Ответ")
+    cache.memory.clear()
+    assert (await cache.aget(key))["text"] == "Ответ"
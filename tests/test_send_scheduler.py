@@ -0,0 +1,137 @@
+"""
+Тесты для модуля send_scheduler.py
+"""
+
+import asyncio
+import time
+import pytest
+from telegram.error import RetryAfter
+
+from send_scheduler import SendScheduler, BULK
+
+
+def make_call(log, name):
+    async def call():
+        log.append((name, time.monotonic()))
+        return name
+
+    return call
+
+
+async def send(scheduler, call, chat_id, endpoint="sendMessage", lane=None, message_id=None):
+    data = {"chat_id": chat_id}
+    if message_id is not None:
+        data["message_id"] = message_id
+    return await scheduler.process_request(call, (), {}, endpoint, data, lane)
+
+
+@pytest.mark.asyncio
+async def test_per_chat_pacing_and_parallel_chats():
+    scheduler = SendScheduler(chat_interval_s=0.1, global_rate=1000)
+    await scheduler.initialize()
+    log = []
+    try:
+        results = await asyncio.gather(
+            send(scheduler, make_call(log, "a1"), 1),
+            send(scheduler, make_call(log, "a2"), 1),
+            send(scheduler, make_call(log, "b1"), 2),
+        )
+        assert results == ["a1", "a2", "b1"]
+
+        times = dict(log)
+        assert times["a2"] - times["a1"] >= 0.09
+        # Другой чат не ждёт паузы первого
+        assert times["b1"] - times["a1"] < 0.05
+    finally:
+        await scheduler.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_interactive_lane_goes_first():
+    scheduler = SendScheduler(chat_interval_s=0, global_rate=1)
+    scheduler._tokens = 0  # общий лимит исчерпан - запросы копятся в очереди
+    await scheduler.initialize()
+    log = []
+    try:
+        bulk = asyncio.ensure_future(send(scheduler, make_call(log, "bulk"), 1, lane=BULK))
+        await asyncio.sleep(0)
+        reply = asyncio.ensure_future(send(scheduler, make_call(log, "reply"), 2))
+        await asyncio.wait_for(asyncio.gather(bulk, reply), 5)
+        assert [name for name, _ in log] == ["reply", "bulk"]
+    finally:
+        await scheduler.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_bulk_lane_yields_to_replies_in_same_chat():
+    scheduler = SendScheduler(chat_interval_s=0.1, global_rate=1000)
+    await scheduler.initialize()
+    log = []
+    try:
+        bulk = [
+            asyncio.ensure_future(send(scheduler, make_call(log, f"bulk{i}"), 1, lane=BULK))
+            for i in range(3)
+        ]
+        await asyncio.sleep(0.02)  # bulk0 ушёл, чат выдерживает паузу
+        reply = asyncio.ensure_future(send(scheduler, make_call(log, "reply"), 1))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queued_bulk"] == 2
+        assert scheduler.stats()["queued_interactive"] == 1
+
+        await asyncio.wait_for(asyncio.gather(reply, *bulk), 5)
+        assert [name for name, _ in log] == ["bulk0", "reply", "bulk1", "bulk2"]
+        # Рассылка соблюдает паузу чата так же, как ответы
+        times = [at for _, at in log]
+        assert all(b - a >= 0.09 for a, b in zip(times, times[1:]))
+    finally:
+        await scheduler.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_rapid_edits_are_coalesced():
+    scheduler = SendScheduler(chat_interval_s=0.2, global_rate=1000)
+    await scheduler.initialize()
+    log = []
+    try:
+        first = asyncio.ensure_future(send(scheduler, make_call(log, "msg"), 1))
+        await asyncio.sleep(0.01)
+        edits = [
+            asyncio.ensure_future(send(scheduler, make_call(log, f"edit{i}"), 1, "editMessageText", message_id=7))
+            for i in range(3)
+        ]
+        results = await asyncio.gather(first, *edits)
+
+        assert [name for name, _ in log] == ["msg", "edit2"]
+        assert results[1:] == ["edit2"] * 3
+        assert scheduler.coalesced == 2
+    finally:
+        await scheduler.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_retry_after_is_retried():
+    scheduler = SendScheduler(chat_interval_s=0, global_rate=1000)
+    await scheduler.initialize()
+    attempts = []
+
+    async def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RetryAfter(0)
+        return "ok"
+
+    try:
+        assert await asyncio.wait_for(send(scheduler, flaky, 1), 5) == "ok"
+        assert len(attempts) == 2
+        assert scheduler.retried == 1
+    finally:
+        await scheduler.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_unpaced_requests_bypass_queue():
+    scheduler = SendScheduler()
+    log = []
+    # Без initialize() и для getUpdates очередь не используется
+    assert await send(scheduler, make_call(log, "x"), 1) == "x"
+    assert await scheduler.process_request(make_call(log, "u"), (), {}, "getUpdates", {}, None) == "u"
@@ -0,0 +1,141 @@
+"""
+Тесты для модуля streaming.py
+"""
+
+from unittest.mock import AsyncMock
+
+import pytest
+from telegram.error import BadRequest
+
+import streaming
+from streaming import StreamingReply, CURSOR, PLACEHOLDER_TEXT, TELEGRAM_MESSAGE_LIMIT, TRUNCATED_SUFFIX
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(streaming.time, "monotonic", fake.monotonic)
+    return fake
+
+
+@pytest.fixture
+def source_message():
+    message = AsyncMock()
+    message.reply_text.return_value = AsyncMock()
+    return message
+
+
+def _edits(reply) -> list:
+    return [call.args[0] for call in reply.message.edit_text.call_args_list]
+
+
+@pytest.mark.asyncio
+async def test_edits_are_coalesced_by_interval_and_size(clock, source_message):
+    reply = StreamingReply(source_message, min_interval_s=1.0, min_chars=5)
+    await reply.start()
+    source_message.reply_text.assert_called_once_with(PLACEHOLDER_TEXT)
+
+    # Раньше min_interval_s после заглушки - правок нет, сколько бы текста ни пришло
+    clock.now += 0.5
+    await reply.append("Привет")
+    clock.now += 0.3
+    await reply.append(", мир")
+    assert _edits(reply) == []
+
+    clock.now += 0.5
+    await reply.append("!")
+    assert _edits(reply) == ["Привет, мир!" + CURSOR]
+
+    # Интервал прошёл, но прирост меньше min_chars
+    clock.now += 2
+    await reply.append(" Как")
+    assert len(_edits(reply)) == 1
+
+    await reply.append(" дела?")
+    assert _edits(reply)[-1] == "Привет, мир! Как дела?" + CURSOR
+
+
+@pytest.mark.asyncio
+async def test_intermediate_edit_is_cut_to_max_length(clock, source_message):
+    reply = StreamingReply(source_message, max_length=10, min_interval_s=0, min_chars=1)
+    await reply.start()
+
+    await reply.append("x" * 25)
+
+    assert _edits(reply) == ["x" * 10 + CURSOR]
+    assert reply.text == "x" * 25
+
+
+@pytest.mark.asyncio
+async def test_intermediate_edit_errors_are_ignored(clock, source_message):
+    reply = StreamingReply(source_message, min_interval_s=0, min_chars=1)
+    await reply.start()
+    reply.message.edit_text.side_effect = BadRequest("Message is not modified")
+
+    await reply.append("текст")
+
+    assert reply.text == "текст"
+
+
+@pytest.mark.asyncio
+async def test_finish_falls_back_to_plain_text_on_broken_markdown(clock, source_message):
+    reply = StreamingReply(source_message)
+    await reply.start()
+    reply.message.edit_text.side_effect = [BadRequest("Can't parse entities"), None]
+
+    await reply.finish("*незакрытая разметка", parse_mode="Markdown")
+
+    calls = reply.message.edit_text.call_args_list
+    assert calls[0].args == ("*незакрытая разметка",) and calls[0].kwargs == {"parse_mode": "Markdown"}
+    assert calls[1].args == ("*незакрытая разметка",) and calls[1].kwargs == {}
+
+
+@pytest.mark.asyncio
+async def test_finish_fits_long_text_into_telegram_limit(clock, source_message):
+    reply = StreamingReply(source_message)
+    await reply.start()
+    reply.message.edit_text.side_effect = [BadRequest("Can't parse entities"), None]
+
+    await reply.finish("↪️ *заголовок*\n" + "я" * 4096 + "\n---\nподвал", parse_mode="Markdown")
+
+    # И правка с разметкой, и запасная без неё укладываются в лимит
+    for call in reply.message.edit_text.call_args_list:
+        text = call.args[0]
+        assert len(text.encode("utf-16-le")) // 2 <= TELEGRAM_MESSAGE_LIMIT
+        assert text.startswith("↪️ *заголовок*\n") and text.endswith(TRUNCATED_SUFFIX)
+
+
+def test_fit_message_does_not_split_surrogate_pairs():
+    text = streaming.fit_message("😀" * 3000)
+
+    assert len(text.encode("utf-16-le")) // 2 <= TELEGRAM_MESSAGE_LIMIT
+    assert text.endswith(TRUNCATED_SUFFIX)
+    assert set(text[:-len(TRUNCATED_SUFFIX)]) == {"😀"}
+    assert streaming.fit_message("короткий") == "короткий"
+
+
+@pytest.mark.asyncio
+async def test_finish_without_markup_reraises(clock, source_message):
+    reply = StreamingReply(source_message)
+    await reply.start()
+    reply.message.edit_text.side_effect = BadRequest("Message to edit not found")
+
+    with pytest.raises(BadRequest):
+        await reply.finish("ответ")
+
+
+@pytest.mark.asyncio
+async def test_finish_without_placeholder_sends_new_message(source_message):
+    reply = StreamingReply(source_message)
+
+    await reply.finish("ответ", parse_mode="Markdown")
+
+    source_message.reply_text.assert_called_once_with("ответ", parse_mode="Markdown")
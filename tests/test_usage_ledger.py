@@ -0,0 +1,70 @@
+"""
+Тесты для модуля usage_ledger.py
+"""
+
+import asyncio
+import pytest
+
+from usage_ledger import UsageLedger
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = UsageLedger(str(tmp_path / "usage.db"), flush_interval_s=60, batch_size=3)
+    yield ledger
+    ledger._pool.close()
+
+
+def test_record_is_buffered_until_flush(ledger):
+    ledger.record(1, "model-a", {"prompt_tokens": 10, "completion_tokens": 5}, 100)
+    ledger.record(1, "model-a", {"prompt_tokens": 20, "completion_tokens": 15, "cost": 0.5}, 300)
+
+    with ledger._pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM usage_events").fetchone()[0] == 0
+
+    # Несброшенные суммы уже видны в статистике
+    summary = ledger.user_summary(1)
+    assert summary["model-a"]["requests"] == 2
+    assert summary["model-a"]["prompt_tokens"] == 30
+
+    assert ledger.flush() == 2
+    with ledger._pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM usage_events").fetchone()[0] == 2
+        row = conn.execute("SELECT * FROM usage_daily").fetchone()
+    assert row["requests"] == 2
+    assert row["completion_tokens"] == 20
+    assert row["latency_ms"] == 400
+    assert row["cost"] == 0.5
+
+    assert ledger.user_summary(1) == summary
+
+
+def test_rollups_accumulate_across_flushes(ledger):
+    ledger.record(1, "model-a", {"prompt_tokens": 1, "completion_tokens": 1}, 10)
+    ledger.flush()
+    ledger.record(1, "model-a", {"prompt_tokens": 2, "completion_tokens": 2}, 10)
+    ledger.record(2, "model-b", {"prompt_tokens": 100, "completion_tokens": 100}, 10)
+    ledger.flush()
+
+    with ledger._pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM usage_daily").fetchone()[0] == 2
+
+    assert ledger.user_summary(1)["model-a"]["prompt_tokens"] == 3
+    assert set(ledger.model_summary()) == {"model-a", "model-b"}
+    assert [user_id for user_id, _ in ledger.top_users()] == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_full_batch_triggers_background_flush(ledger):
+    ledger.start()
+    try:
+        for _ in range(3):
+            ledger.record(1, "model-a", {"prompt_tokens": 1, "completion_tokens": 1}, 10)
+
+        for _ in range(50):
+            if ledger.flushes:
+                break
+            await asyncio.sleep(0.02)
+        assert ledger.flushes == 1
+    finally:
+        ledger._task.cancel()
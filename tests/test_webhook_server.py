@@ -0,0 +1,123 @@
+"""
+Тесты для модуля webhook_server.py
+"""
+
+import asyncio
+import json
+import pytest
+from contextlib import asynccontextmanager
+
+from webhook_server import WebhookServer
+
+SECRET = "s3cret"
+
+# Обновление в том виде, в каком его присылает Telegram
+RECORDED_UPDATE = {
+    "update_id": 100500,
+    "message": {
+        "message_id": 7,
+        "date": 1700000000,
+        "chat": {"id": 42, "type": "private", "first_name": "Тест"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Тест"},
+        "text": "/ask Привет",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 4}]
+    }
+}
+
+
+class FakeApplication:
+    def __init__(self):
+        self.bot = None
+        self.update_queue = asyncio.Queue()
+
+
+def _request(body: bytes, path="/telegram", secret=SECRET, keep_alive=False) -> bytes:
+    headers = [
+        f"POST {path} HTTP/1.1",
+        "Host: localhost",
+        "Content-Type: application/json",
+        f"Content-Length: {len(body)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}"
+    ]
+    if secret is not None:
+        headers.append(f"X-Telegram-Bot-Api-Secret-Token: {secret}")
+    return ("\r\n".join(headers) + "\r\n\r\n").encode() + body
+
+
+async def _read_status(reader) -> int:
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+    await reader.readexactly(length)
+    return int(head.split(b" ")[1])
+
+
+@asynccontextmanager
+async def running_server():
+    webhook = WebhookServer(FakeApplication(), host="127.0.0.1", port=0, path="/telegram",
+                            secret_token=SECRET, max_body_bytes=4096)
+    await webhook.start()
+    try:
+        yield webhook
+    finally:
+        await webhook.stop()
+
+
+async def _post(server, raw: bytes) -> int:
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    writer.write(raw)
+    await writer.drain()
+    status = await _read_status(reader)
+    writer.close()
+    return status
+
+
+@pytest.mark.asyncio
+async def test_update_is_queued():
+    async with running_server() as server:
+        status = await _post(server, _request(json.dumps(RECORDED_UPDATE).encode()))
+
+        assert status == 200
+        update = server.application.update_queue.get_nowait()
+        assert update.update_id == 100500
+        assert update.message.text == "/ask Привет"
+        assert update.effective_chat.id == 42
+
+
+@pytest.mark.asyncio
+async def test_keep_alive_accepts_several_updates():
+    async with running_server() as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        for update_id in (1, 2, 3):
+            body = json.dumps(dict(RECORDED_UPDATE, update_id=update_id)).encode()
+            writer.write(_request(body, keep_alive=True))
+            await writer.drain()
+            assert await _read_status(reader) == 200
+        writer.close()
+
+        queue = server.application.update_queue
+        assert [queue.get_nowait().update_id for _ in range(3)] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_wrong_secret_is_rejected():
+    async with running_server() as server:
+        body = json.dumps(RECORDED_UPDATE).encode()
+
+        assert await _post(server, _request(body, secret="wrong")) == 403
+        assert await _post(server, _request(body, secret=None)) == 403
+        assert server.application.update_queue.empty()
+
+
+@pytest.mark.asyncio
+async def test_oversized_and_malformed_requests():
+    async with running_server() as server:
+        assert await _post(server, _request(b"x" * 5000)) == 413
+        assert await _post(server, _request(b"{not json")) == 400
+        assert await _post(server, _request(b"{}", path="/other")) == 404
+        assert server.application.update_queue.empty()
+        assert server.rejected == 3
+
+
+def test_secret_is_required():
+    with pytest.raises(ValueError):
+        WebhookServer(FakeApplication(), secret_token="")
@@ -0,0 +1,126 @@
+"""
+Тесты для модуля workers.py
+"""
+
+import asyncio
+import multiprocessing
+from collections import defaultdict
+
+import pytest
+from telegram import Bot, Update
+
+from workers import (
+    ChatOrderedUpdateProcessor, FakeBotRequest, ShardRouter, fake_updates, shard_for, update_chat_id,
+    worker_env
+)
+
+
+def _record_worker(index, workers, inbox, results):
+    """Воркер для теста: запоминает, какие обновления к нему пришли и в каком порядке."""
+    while True:
+        data = inbox.get()
+        if data is None:
+            return
+        results.put((index, update_chat_id(data), data["update_id"]))
+
+
+def test_update_chat_id():
+    message = {"update_id": 1, "message": {"chat": {"id": -100}, "from": {"id": 5}}}
+    callback = {"update_id": 2, "callback_query": {"from": {"id": 5}, "message": {"chat": {"id": 42}}}}
+    member = {"update_id": 3, "my_chat_member": {"chat": {"id": -7}, "from": {"id": 5}}}
+    inline = {"update_id": 4, "inline_query": {"from": {"id": 9}, "query": "x"}}
+
+    assert update_chat_id(message) == -100
+    assert update_chat_id(callback) == 42
+    assert update_chat_id(member) == -7
+    assert update_chat_id(inline) == 9
+    assert update_chat_id({"update_id": 5}) == 0
+
+
+def test_shard_for_is_stable():
+    assert shard_for(42, 4) == shard_for(42, 4) == 2
+    assert 0 <= shard_for(-1001234567890, 4) < 4
+
+
+def test_worker_env_splits_global_limits():
+    env = worker_env(1, 4, {
+        "LOG_FILE": "bot.log", "RATE_LIMIT_GLOBAL": "20/1", "TG_SEND_GLOBAL_RATE": "30",
+        "LLM_MAX_CONCURRENCY": "50", "METRICS_PORT": "9100"
+    })
+
+    assert env["LOG_FILE"] == "bot.worker1.log"
+    assert env["RATE_LIMIT_GLOBAL"] == "5.0/1.0"
+    assert env["TG_SEND_GLOBAL_RATE"] == "7.5"
+    assert env["LLM_MAX_CONCURRENCY"] == "12"
+    assert env["METRICS_PORT"] == "9102"
+    assert "METRICS_PORT" not in worker_env(0, 4, {})
+
+
+@pytest.mark.asyncio
+async def test_router_keeps_chat_order_and_affinity():
+    results = multiprocessing.get_context("spawn").Queue()
+    router = ShardRouter(3, target=_record_worker, target_args=(results,), queue_size=10)
+    router.start()
+    try:
+        for data in fake_updates(120, chats=7):
+            await router.route(data)
+    finally:
+        await asyncio.get_running_loop().run_in_executor(None, router.stop, 30)
+
+    by_chat = defaultdict(list)
+    workers_by_chat = defaultdict(set)
+    for _ in range(120):
+        index, chat_id, update_id = results.get(timeout=5)
+        by_chat[chat_id].append(update_id)
+        workers_by_chat[chat_id].add(index)
+
+    assert len(by_chat) == 7
+    for chat_id, update_ids in by_chat.items():
+        assert update_ids == sorted(update_ids)
+        assert workers_by_chat[chat_id] == {shard_for(chat_id, 3)}
+    assert sum(router.routed) == 120
+
+
+@pytest.mark.asyncio
+async def test_fake_bot_request():
+    request = FakeBotRequest()
+    async with Bot("123456:fake", request=request) as bot:
+        message = await bot.send_message(42, "привет")
+        edited = await bot.edit_message_text("пока", chat_id=42, message_id=message.message_id)
+
+    assert message.chat.id == 42
+    assert message.text == "привет"
+    assert edited.message_id == message.message_id
+    assert request.counts["sendMessage"] == 1
+    assert request.calls[-1][0] == "editMessageText"
+
+
+@pytest.mark.asyncio
+async def test_chat_ordered_processor_serializes_one_chat():
+    processor = ChatOrderedUpdateProcessor(10)
+    running = defaultdict(int)
+    overlaps = []
+    order = []
+
+    async def handle(chat_id, n):
+        running[chat_id] += 1
+        overlaps.append(running[chat_id])
+        await asyncio.sleep(0)
+        order.append((chat_id, n))
+        running[chat_id] -= 1
+
+    def update(update_id, chat_id):
+        return Update.de_json({"update_id": update_id, "message": {
+            "message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": "x"
+        }}, None)
+
+    await asyncio.gather(*(
+        processor.process_update(update(i, chat_id), handle(chat_id, i))
+        for i, chat_id in enumerate([1, 2, 1, 2, 1])
+    ))
+
+    assert max(overlaps) == 1
+    assert [n for chat_id, n in order if chat_id == 1] == [0, 2, 4]
+    # Разные чаты не ждали друг друга, а замки завершённых чатов удалены
+    assert order[:2] == [(1, 0), (2, 1)]
+    assert processor._locks == {}
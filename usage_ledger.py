@@ -0,0 +1,264 @@
+"""
+Учёт расхода токенов по пользователям и моделям.
+
+Каждый запрос к модели записывается в буфер в памяти, без обращения к
+базе. Буфер сбрасывается пачками в фоне: сырые события попадают в
+таблицу usage_events, а суммы за день - в usage_daily, откуда и читают
+команды статистики (без сканирования сырых строк).
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from db import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_INTERVAL_S = float(os.getenv("USAGE_FLUSH_INTERVAL_S", "5"))
+USAGE_BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE", "200"))
+# Сколько дней хранить сырые события; дневные суммы хранятся всегда
+USAGE_EVENTS_KEEP_DAYS = int(os.getenv("USAGE_EVENTS_KEEP_DAYS", "30"))
+
+_SUM_FIELDS = ("requests", "prompt_tokens", "completion_tokens", "latency_ms", "cost")
+
+
+def usage_day(ts: float) -> str:
+    """День события (UTC) в формате YYYY-MM-DD."""
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+
+def _empty_totals() -> dict:
+    return {field: 0 for field in _SUM_FIELDS}
+
+
+class UsageLedger:
+    """Буферизованный журнал расхода токенов с дневными суммами."""
+
+    def __init__(
+            self,
+            db_path: str = "bot.db",
+            flush_interval_s: float = USAGE_FLUSH_INTERVAL_S,
+            batch_size: int = USAGE_BATCH_SIZE,
+            events_keep_days: int = USAGE_EVENTS_KEEP_DAYS
+    ):
+        self.flush_interval_s = flush_interval_s
+        self.batch_size = batch_size
+        self.events_keep_days = events_keep_days
+        self._pool = ConnectionPool(db_path, size=2)
+        self._events: List[tuple] = []
+        # (день, user_id, модель) -> суммы ещё не сброшенных событий
+        self._pending: Dict[Tuple[str, int, str], dict] = {}
+        self._lock = threading.Lock()
+        # Сбросы выполняются по одному; чтение сумм ждёт завершения сброса,
+        # чтобы не увидеть пачку ни дважды, ни ни разу
+        self._flush_lock = threading.Lock()
+        self._batch_ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self._init_tables()
+
+    def _init_tables(self):
+        with self._pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS usage_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    model TEXT NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    latency_ms INTEGER NOT NULL,
+                    cost REAL NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_usage_events_created
+                ON usage_events(created_at)
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS usage_daily (
+                    day TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    model TEXT NOT NULL,
+                    requests INTEGER NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    latency_ms INTEGER NOT NULL,
+                    cost REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, user_id, model)
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_usage_daily_user
+                ON usage_daily(user_id, day)
+            ''')
+            conn.commit()
+
+    def record(self, user_id: int, model: str, usage: dict, latency_ms: int):
+        """
+        Запоминает расход одного запроса; не обращается к базе.
+
+        usage - словарь usage из ответа OpenRouter (prompt_tokens,
+        completion_tokens и, если включён учёт стоимости, cost).
+        Вызывается из потока event loop.
+        """
+        now = time.time()
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        cost = float(usage.get("cost") or 0)
+
+        with self._lock:
+            self._events.append((user_id, model, prompt_tokens, completion_tokens, latency_ms, cost, now))
+            totals = self._pending.setdefault((usage_day(now), user_id, model), _empty_totals())
+            totals["requests"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["latency_ms"] += latency_ms
+            totals["cost"] += cost
+            batch_full = len(self._events) >= self.batch_size
+
+        if batch_full and self._batch_ready is not None:
+            self._batch_ready.set()
+
+    def flush(self) -> int:
+        """Сбрасывает буфер в базу одной транзакцией; возвращает число событий."""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+                pending, self._pending = self._pending, {}
+            if not events:
+                return 0
+
+            try:
+                with self._pool.connection() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.executemany(
+                        "INSERT INTO usage_events (user_id, model, prompt_tokens, completion_tokens, "
+                        "latency_ms, cost, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        events
+                    )
+                    conn.executemany('''
+                        INSERT INTO usage_daily (day, user_id, model, requests, prompt_tokens,
+                                                 completion_tokens, latency_ms, cost)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(day, user_id, model) DO UPDATE SET
+                            requests = requests + excluded.requests,
+                            prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                            completion_tokens = completion_tokens + excluded.completion_tokens,
+                            latency_ms = latency_ms + excluded.latency_ms,
+                            cost = cost + excluded.cost
+                    ''', [
+                        (day, user_id, model, *(totals[field] for field in _SUM_FIELDS))
+                        for (day, user_id, model), totals in pending.items()
+                    ])
+                    conn.execute(
+                        "DELETE FROM usage_events WHERE created_at < ?",
+                        (time.time() - self.events_keep_days * 86400,)
+                    )
+                    conn.commit()
+            except Exception:
+                # Возвращаем события в буфер, чтобы не потерять их при сбое записи
+                with self._lock:
+                    self._events[:0] = events
+                    for key, totals in pending.items():
+                        merged = self._pending.setdefault(key, _empty_totals())
+                        for field in _SUM_FIELDS:
+                            merged[field] += totals[field]
+                raise
+
+            self.flushes += 1
+            return len(events)
+
+    async def aflush(self) -> int:
+        """flush() в пуле потоков, без блокировки event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    def start(self):
+        """Запускает фоновый сброс буфера (вызывается из работающего event loop)."""
+        self._batch_ready = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            try:
+                await self.aflush()
+            except Exception as e:
+                logger.error(f"Не удалось сохранить статистику использования: {e}")
+
+    async def aclose(self):
+        """Останавливает фоновый сброс и сохраняет остаток буфера."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.aflush()
+        self._pool.close()
+
+    def _query_daily(self, where: str, params: tuple, group_by: str) -> Dict[object, dict]:
+        with self._pool.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT {group_by} AS key, SUM(requests) AS requests,
+                       SUM(prompt_tokens) AS prompt_tokens,
+                       SUM(completion_tokens) AS completion_tokens,
+                       SUM(latency_ms) AS latency_ms, SUM(cost) AS cost
+                FROM usage_daily
+                WHERE {where}
+                GROUP BY {group_by}
+            ''', params).fetchall()
+        return {row["key"]: {field: row[field] for field in _SUM_FIELDS} for row in rows}
+
+    def _merge_pending(self, result: Dict[object, dict], since_day: str, user_id: Optional[int], group_by: str):
+        """Добавляет к результату ещё не сброшенные суммы из буфера."""
+        with self._lock:
+            pending = [(key, dict(totals)) for key, totals in self._pending.items()]
+        for (day, pending_user, model), totals in pending:
+            if day < since_day or (user_id is not None and pending_user != user_id):
+                continue
+            key = model if group_by == "model" else pending_user
+            merged = result.setdefault(key, _empty_totals())
+            for field in _SUM_FIELDS:
+                merged[field] += totals[field]
+
+    def _summary(self, days: int, user_id: Optional[int], group_by: str) -> Dict[object, dict]:
+        since_day = usage_day(time.time() - (days - 1) * 86400)
+        with self._flush_lock:
+            if user_id is None:
+                result = self._query_daily("day >= ?", (since_day,), group_by)
+            else:
+                result = self._query_daily("user_id = ? AND day >= ?", (user_id, since_day), group_by)
+            self._merge_pending(result, since_day, user_id, group_by)
+        return result
+
+    def user_summary(self, user_id: int, days: int = 30) -> Dict[str, dict]:
+        """Расход пользователя за последние days дней по моделям."""
+        return self._summary(days, user_id, "model")
+
+    def model_summary(self, days: int = 1) -> Dict[str, dict]:
+        """Расход всех пользователей за последние days дней по моделям."""
+        return self._summary(days, None, "model")
+
+    def top_users(self, days: int = 1, limit: int = 10) -> List[Tuple[int, dict]]:
+        """Пользователи с наибольшим расходом токенов за последние days дней."""
+        by_user = self._summary(days, None, "user_id")
+        ranked = sorted(
+            by_user.items(),
+            key=lambda item: item[1]["prompt_tokens"] + item[1]["completion_tokens"],
+            reverse=True
+        )
+        return ranked[:limit]
+
+    async def run(self, func, *args):
+        """Выполняет метод чтения в пуле потоков."""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
@@ -0,0 +1,144 @@
+"""
+Режим вебхука: Telegram сам присылает обновления POST-запросами.
+
+Сервер работает в event loop бота, проверяет секретный заголовок
+X-Telegram-Bot-Api-Secret-Token, ограничивает размер тела и отвечает 200
+сразу после того, как обновление поставлено в application.update_queue -
+обработка идёт отдельно. Ответ уходит только после постановки в очередь,
+поэтому обновление, не попавшее в очередь, Telegram пришлёт повторно.
+"""
+
+import os
+import hmac
+import json
+import asyncio
+import logging
+from typing import Optional
+
+from telegram import Update
+
+from http_server import HttpError, read_request, write_response, MAX_HEADER_BYTES
+from metrics import metric
+
+logger = logging.getLogger(__name__)
+
+# Публичный URL вебхука; если задан, бот работает через вебхук вместо long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_BODY_BYTES = int(os.getenv("WEBHOOK_MAX_BODY_BYTES", str(1024 * 1024)))
+# Сколько параллельных соединений разрешить Telegram (1..100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Отбрасывать ли накопившиеся за время простоя обновления при запуске
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "false").lower() in ("1", "true", "yes")
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+IDLE_TIMEOUT_S = 60.0
+
+
+async def set_webhook(bot) -> None:
+    """Регистрирует WEBHOOK_URL; обновления, пришедшие во время простоя, Telegram доставит туда."""
+    await bot.set_webhook(
+        url=WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        drop_pending_updates=DROP_PENDING_UPDATES
+    )
+    logger.info(f"Вебхук установлен: {WEBHOOK_URL}")
+
+
+class WebhookServer:
+    """HTTP-сервер, принимающий обновления Telegram в очередь приложения."""
+
+    def __init__(
+            self,
+            application,
+            host: str = WEBHOOK_LISTEN,
+            port: int = WEBHOOK_PORT,
+            path: str = WEBHOOK_PATH,
+            secret_token: str = WEBHOOK_SECRET,
+            max_body_bytes: int = WEBHOOK_MAX_BODY_BYTES
+    ):
+        if not secret_token:
+            raise ValueError("WEBHOOK_SECRET не задан: без него вебхук примет чужие запросы")
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.max_body_bytes = max_body_bytes
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.accepted = 0
+        self.rejected = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._handle, self.host, self.port, limit=MAX_HEADER_BYTES
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Вебхук слушает http://{self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.max_body_bytes, IDLE_TIMEOUT_S)
+                except HttpError as e:
+                    self._reject(writer, e.status)
+                    return
+                if request is None:
+                    return
+
+                status = await self._process(request)
+                if status != 200:
+                    self._reject(writer, status)
+                    return
+                write_response(writer, 200, keep_alive=request.keep_alive)
+                await writer.drain()
+                if not request.keep_alive:
+                    return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _reject(self, writer: asyncio.StreamWriter, status: int):
+        self.rejected += 1
+        metric.counter("webhook_rejected_total", status=status).inc()
+        write_response(writer, status)
+
+    async def _process(self, request) -> int:
+        if request.path != self.path:
+            return 404
+        if request.method != "POST":
+            return 405
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            logger.warning("Запрос к вебхуку с неверным секретным токеном")
+            return 403
+
+        try:
+            data = json.loads(request.body)
+            if not isinstance(data, dict) or not isinstance(data.get("update_id"), int):
+                raise ValueError("нет update_id")
+        except ValueError as e:
+            logger.warning(f"Некорректное обновление в вебхуке: {e}")
+            return 400
+
+        await self.submit(data)
+        self.accepted += 1
+        metric.counter("webhook_updates_total").inc()
+        return 200
+
+    async def submit(self, data: dict):
+        """Передаёт обновление на обработку; Telegram получит 200 после возврата."""
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
@@ -0,0 +1,452 @@
+"""
+Запуск бота несколькими процессами-воркерами за одной точкой приёма.
+
+Процесс-приёмник получает обновления (вебхук, long polling или тестовый
+источник) и раскладывает их по воркерам по chat_id: все обновления одного
+чата попадают в один воркер и обрабатываются там по порядку
+(ChatOrderedUpdateProcessor), а разные чаты - конкурентно. Каждый
+воркер - отдельный процесс со своим Application из main.py. Общее
+состояние живёт в bot.db; кэши Database сверяются с журналом изменений и
+версией каталога в ней, поэтому правка в одном воркере видна остальным.
+
+Общие лимиты (RATE_LIMIT_GLOBAL, TG_SEND_GLOBAL_RATE, LLM_*_CONCURRENCY)
+делятся между воркерами поровну; лимиты пользователя и чата точны, пока
+пользователь пишет из одного чата.
+
+Запуск: python workers.py, число процессов - WORKERS. С FAKE_UPDATES=N
+вместо Telegram используется тестовый источник из N обновлений, а ответы
+бота уходят в заглушку Bot API, не в сеть.
+"""
+
+import os
+import json
+import time
+import queue
+import signal
+import asyncio
+import datetime
+import logging
+import threading
+import multiprocessing
+from collections import Counter, deque
+from typing import Awaitable, Dict, Iterator, List, Optional, Sequence
+
+from dotenv import load_dotenv
+from telegram import Bot, Update
+from telegram.error import NetworkError, RetryAfter
+from telegram.ext import BaseUpdateProcessor
+from telegram.request import BaseRequest
+
+from logging_config import setup_logging
+from rate_limit import parse_rate
+from webhook_server import WebhookServer, set_webhook, WEBHOOK_URL, DROP_PENDING_UPDATES
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("WORKERS", "2"))
+# Сколько обновлений может ждать в очереди одного воркера; дальше приёмник ждёт
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+WORKER_STOP_TIMEOUT_S = float(os.getenv("WORKER_STOP_TIMEOUT_S", "30"))
+# Тестовый источник: сколько обновлений сгенерировать и по скольким чатам
+FAKE_UPDATES = int(os.getenv("FAKE_UPDATES", "0"))
+FAKE_CHATS = int(os.getenv("FAKE_CHATS", "10"))
+FAKE_TOKEN = "123456:fake"
+
+POLL_TIMEOUT_S = 30
+# Команды тестового источника: не обращаются к OpenRouter
+FAKE_COMMANDS = ("/start", "/help", "/models", "/characters", "/current", "/usage")
+
+# Поля обновления, в которых лежит сообщение с чатом
+_MESSAGE_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "business_message", "edited_business_message"
+)
+
+
+def update_chat_id(data: dict) -> int:
+    """
+    chat_id сырого обновления (без разбора в объекты telegram).
+
+    Для обновлений без чата (inline-запросы и т.п.) - id пользователя,
+    чтобы они тоже шли в один воркер; 0, если нет ни того, ни другого.
+    """
+    for field in _MESSAGE_FIELDS:
+        message = data.get(field)
+        if message:
+            return message["chat"]["id"]
+    for key, value in data.items():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+
+def shard_for(chat_id: int, workers: int) -> int:
+    """Номер воркера для чата; одинаков в любом процессе и при перезапуске."""
+    return chat_id % workers
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обработка обновлений внутри воркера: разные чаты - конкурентно (не больше
+    max_concurrent_updates сразу), обновления одного чата - по одному в
+    порядке поступления.
+
+    Так потоковый /ask не задерживает другие чаты, а /setcharacter или
+    /reset, отправленные перед /ask, успевают примениться до него. Ключ -
+    тот же, что у update_chat_id: чат, а без чата - пользователь.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._pending: Counter = Counter()
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        key = self._key(update)
+        if key is None:
+            await coroutine
+            return
+
+        # asyncio.Lock будит ожидающих в порядке очереди
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._pending[key] += 1
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            self._pending[key] -= 1
+            if not self._pending[key]:
+                del self._pending[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+def _scale(value: str, workers: int) -> str:
+    """Делит общий лимит вида "N/S" или "N" между воркерами."""
+    rate = parse_rate(value)
+    if rate is None:
+        return value
+    count, period = rate
+    return f"{count / workers}/{period}" if "/" in value else str(count / workers)
+
+
+def worker_env(index: int, workers: int, environ=None) -> dict:
+    """Переменные окружения воркера index: свой лог, свой порт метрик, доля общих лимитов."""
+    environ = os.environ if environ is None else environ
+    stem, ext = os.path.splitext(environ.get("LOG_FILE", "bot.log"))
+    env = {
+        "LOG_FILE": f"{stem}.worker{index}{ext or '.log'}",
+        "RATE_LIMIT_GLOBAL": _scale(environ.get("RATE_LIMIT_GLOBAL", "20/1"), workers),
+        "TG_SEND_GLOBAL_RATE": _scale(environ.get("TG_SEND_GLOBAL_RATE", "30"), workers),
+        "LLM_MAX_CONCURRENCY": str(max(1, int(environ.get("LLM_MAX_CONCURRENCY", "50")) // workers)),
+        "LLM_MODEL_CONCURRENCY": str(max(1, int(environ.get("LLM_MODEL_CONCURRENCY", "10")) // workers)),
+    }
+    metrics_port = int(environ.get("METRICS_PORT", "0"))
+    if metrics_port:
+        env["METRICS_PORT"] = str(metrics_port + 1 + index)
+    return env
+
+
+def fake_updates(count: int, chats: int = FAKE_CHATS, commands: Sequence[str] = FAKE_COMMANDS) -> Iterator[dict]:
+    """Обновления в формате Telegram: команды от chats пользователей по кругу."""
+    now = int(time.time())
+    for i in range(count):
+        user_id = 1000 + i % chats
+        text = commands[i % len(commands)]
+        yield {
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": now,
+                "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}]
+            }
+        }
+
+
+class FakeBotRequest(BaseRequest):
+    """
+    Заглушка Bot API: отвечает на вызовы без обращения к сети.
+
+    sendMessage и правки возвращают правдоподобное сообщение, остальные
+    методы - True. Последние вызовы хранятся в calls.
+    """
+
+    BOT_USER = {"id": 123456, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+    def __init__(self, keep_calls: int = 1000):
+        self.calls = deque(maxlen=keep_calls)
+        self.counts = Counter()
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.counts[endpoint] += 1
+        self.calls.append((endpoint, params))
+
+        if endpoint == "getMe":
+            result = self.BOT_USER
+        elif endpoint.startswith(("send", "edit")) and "chat_id" in params and endpoint != "sendChatAction":
+            chat_id = int(params["chat_id"])
+            if "message_id" in params:
+                message_id = int(params["message_id"])
+            else:
+                self._message_id += 1
+                message_id = self._message_id
+            result = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                "from": self.BOT_USER,
+                "text": params.get("text", "")
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class _InboxIntake:
+    """
+    Источник обновлений воркера: читает очередь от приёмника в отдельном
+    потоке и кладёт обновления в application.update_queue по порядку.
+    None в очереди - сигнал остановки.
+    """
+
+    def __init__(self, application, inbox, stop_event: asyncio.Event):
+        self.application = application
+        self.inbox = inbox
+        self.stop_event = stop_event
+        self._thread: Optional[threading.Thread] = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._read, args=(loop,), name="worker-inbox", daemon=True)
+        self._thread.start()
+
+    def _read(self, loop: asyncio.AbstractEventLoop):
+        update_queue = self.application.update_queue
+        while True:
+            data = self.inbox.get()
+            if data is None:
+                loop.call_soon_threadsafe(self.stop_event.set)
+                return
+            # Разбор - в этом потоке, event loop только принимает готовый объект
+            update = Update.de_json(data, self.application.bot)
+            loop.call_soon_threadsafe(update_queue.put_nowait, update)
+
+    async def stop(self):
+        # Поток завершается сам по сигналу в очереди; при остановке по сигналу
+        # ОС он демон и не держит процесс
+        pass
+
+
+def run_worker(index: int, workers: int, inbox, fake: bool = False):
+    """Точка входа процесса-воркера."""
+    os.environ.update(worker_env(index, workers))
+    # Ctrl+C обрабатывает приёмник: он дошлёт воркерам команду остановки
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import main as bot
+
+    token = FAKE_TOKEN if fake else os.getenv("TELEGRAM_BOT_TOKEN")
+    request = FakeBotRequest() if fake else None
+    application = bot.build_application(token, request=request)
+
+    async def serve():
+        stop_event = asyncio.Event()
+        await bot.run_application(application, _InboxIntake(application, inbox, stop_event), stop_event=stop_event)
+
+    bot.logger.info(f"Воркер {index + 1}/{workers} запущен (pid {os.getpid()})")
+    asyncio.run(serve())
+    if request is not None:
+        bot.logger.info(f"Воркер {index + 1}: вызовы Bot API {dict(request.counts)}")
+
+
+class ShardRouter:
+    """Процессы-воркеры и раскладка обновлений по ним по chat_id."""
+
+    def __init__(
+            self,
+            workers: int = WORKERS,
+            target=run_worker,
+            target_args: tuple = (),
+            queue_size: int = WORKER_QUEUE_SIZE
+    ):
+        if workers < 1:
+            raise ValueError("Нужен хотя бы один воркер")
+        self.workers = workers
+        context = multiprocessing.get_context("spawn")
+        self.inboxes = [context.Queue(queue_size) for _ in range(workers)]
+        self.processes = [
+            context.Process(
+                target=target, args=(i, workers, inbox, *target_args), name=f"bot-worker-{i}"
+            )
+            for i, inbox in enumerate(self.inboxes)
+        ]
+        # Порядок обновлений в очереди воркера сохраняется, даже если она полна
+        self._locks: List[Optional[asyncio.Lock]] = [None] * workers
+        self.routed = [0] * workers
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        logger.info(f"Запущено воркеров: {self.workers}")
+
+    async def route(self, data: dict):
+        """Отправляет сырое обновление воркеру его чата; ждёт, если очередь полна."""
+        shard = shard_for(update_chat_id(data), self.workers)
+        inbox = self.inboxes[shard]
+        lock = self._locks[shard]
+        if lock is None:
+            lock = self._locks[shard] = asyncio.Lock()
+        async with lock:
+            try:
+                inbox.put_nowait(data)
+            except queue.Full:
+                await asyncio.get_running_loop().run_in_executor(None, inbox.put, data)
+        self.routed[shard] += 1
+
+    def stop(self, timeout_s: float = WORKER_STOP_TIMEOUT_S):
+        """Просит воркеры дообработать очереди и завершиться."""
+        for inbox in self.inboxes:
+            inbox.put(None)
+        deadline = time.monotonic() + timeout_s
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"{process.name} не завершился за {timeout_s:.0f} с, останавливаем принудительно")
+                process.terminate()
+                process.join()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "alive": sum(process.is_alive() for process in self.processes),
+            "routed": list(self.routed)
+        }
+
+
+class ShardedWebhookServer(WebhookServer):
+    """Вебхук, отдающий обновления воркерам; 200 - после постановки в очередь воркера."""
+
+    def __init__(self, router: ShardRouter, **kwargs):
+        super().__init__(None, **kwargs)
+        self.router = router
+
+    async def submit(self, data: dict):
+        await self.router.route(data)
+
+
+async def poll_updates(bot: Bot, router: ShardRouter, stop_event: asyncio.Event):
+    """Ведущий long polling: получает обновления и раскладывает их по воркерам."""
+    await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+    offset = None
+    while not stop_event.is_set():
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=POLL_TIMEOUT_S, allowed_updates=Update.ALL_TYPES
+            )
+        except RetryAfter as e:
+            delay = e.retry_after
+            await asyncio.sleep(delay.total_seconds() if isinstance(delay, datetime.timedelta) else delay)
+            continue
+        except NetworkError as e:
+            logger.warning(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await router.route(update.to_dict())
+            # Подтверждаем Telegram только то, что уже передано воркеру
+            offset = update.update_id + 1
+
+
+async def run_intake(router: ShardRouter, fake_count: int = 0):
+    """Процесс-приёмник: получает обновления, пока не придёт SIGINT/SIGTERM."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    if fake_count:
+        started = time.monotonic()
+        for data in fake_updates(fake_count):
+            await router.route(data)
+        logger.info(f"Тестовый источник: {fake_count} обновлений за {time.monotonic() - started:.2f} с")
+        return
+
+    async with Bot(os.getenv("TELEGRAM_BOT_TOKEN")) as bot:
+        if WEBHOOK_URL:
+            server = ShardedWebhookServer(router)
+            await server.start()
+            try:
+                await set_webhook(bot)
+                await stop_event.wait()
+            finally:
+                await server.stop()
+        else:
+            polling = asyncio.create_task(poll_updates(bot, router, stop_event))
+            await stop_event.wait()
+            polling.cancel()
+            try:
+                await polling
+            except asyncio.CancelledError:
+                pass
+
+
+def main():
+    setup_logging("workers.log")
+    if not FAKE_UPDATES and not os.getenv("TELEGRAM_BOT_TOKEN"):
+        print("❌ Ошибка: TELEGRAM_BOT_TOKEN не найден")
+        return
+
+    router = ShardRouter(WORKERS, target_args=(bool(FAKE_UPDATES),))
+    router.start()
+    try:
+        asyncio.run(run_intake(router, FAKE_UPDATES))
+    finally:
+        # Воркеры дообрабатывают свои очереди до выхода
+        router.stop()
+        logger.info(f"Распределение по воркерам: {router.routed}")
+
+
+if __name__ == "__main__":
+    main()